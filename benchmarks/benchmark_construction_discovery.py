@@ -0,0 +1,158 @@
+# Copyright (C) 2024 twyleg
+"""
+Scan cost of a workspace: the time Workspace takes to discover all constructions and the files they list, measured on
+synthetic workspaces with many constructions (construction.json plus empty source, image, 3D and gcode files).
+
+Variants:
+    scandir: Construction as is, a single directory listing per subdir
+    glob: The former discovery, one glob per file extension per subdir and a relative_to per match
+    index: Construction loaded from an up to date workspace index, a stat per dir instead of a listing
+
+Directory listings are cheap on a local disk with a warm page cache. On network file systems every listing is a round
+trip, there the number of listings per construction matters more than the measured time. --scan-concurrency issues the
+listings of several constructions at once, which hides that latency rather than the local CPU cost measured here.
+
+Usage:
+    python benchmarks/benchmark_construction_discovery.py [--constructions=1000,10000] [--variants=scandir,glob,index] [--scan-concurrency=N]
+        [--repeat=N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from glob import glob
+from pathlib import Path
+from typing import Iterator, List
+
+FILE_DIR = Path(__file__).parent
+sys.path.insert(0, str(FILE_DIR.parent))
+
+from construction_utils.readme_generator import Construction, Workspace  # noqa: E402
+from construction_utils.workspace_index import WorkspaceIndex  # noqa: E402
+
+VARIANTS = ("scandir", "glob", "index")
+# fmt: off
+SUBDIR_EXTENSIONS = {
+    Construction.SUBDIR_NAME_SOURCE: Construction.FILE_EXTENSIONS_SOURCE,
+    Construction.SUBDIR_NAME_IMG: Construction.FILE_EXTENSIONS_IMG,
+    Construction.SUBDIR_NAME_3D: Construction.FILE_EXTENSIONS_3D,
+    Construction.SUBDIR_NAME_GCODE: Construction.FILE_EXTENSIONS_GCODE,
+}
+SUBDIR_FILE_NAMES = {
+    Construction.SUBDIR_NAME_SOURCE: ["part_a.FCStd", "part_b.FCStd", "part_c.FCStd"],
+    Construction.SUBDIR_NAME_IMG: ["00-photo.jpg", "01-photo.png", "02-photo.png"],
+    Construction.SUBDIR_NAME_3D: ["part_a-Body.stl", "part_b-Body.stl", "part_c-Body.step"],
+    Construction.SUBDIR_NAME_GCODE: ["part_a.gcode", "part_b.3mf"],
+}
+# fmt: on
+
+
+def create_workspace(workspace_dir_path: Path, construction_count: int) -> None:
+    for index in range(construction_count):
+        construction_dir_path = workspace_dir_path / f"construction_{index:05d}"
+        construction_dir_path.mkdir()
+        (construction_dir_path / Construction.FILENAME_CONSTRUCTION_FILE).write_text(json.dumps({"name": f"Construction {index}", "tags": []}))
+        for subdir_name, file_names in SUBDIR_FILE_NAMES.items():
+            (construction_dir_path / subdir_name).mkdir()
+            for file_name in file_names:
+                (construction_dir_path / subdir_name / file_name).touch()
+    (workspace_dir_path / WorkspaceIndex.DEFAULT_INDEX_FILE_PATH).parent.mkdir()
+    # The workspace index lists dirs modified within the last seconds again on every scan
+    mtime_ns = time.time_ns() - 10 * 1000 * 1000 * 1000
+    for dir_path, _, _ in os.walk(workspace_dir_path):
+        os.utime(dir_path, ns=(mtime_ns, mtime_ns))
+
+
+def find_files_in_subdir_with_glob(construction: Construction, subdir_name: str) -> List[Path]:
+    files: List[str] = []
+    for extension in SUBDIR_EXTENSIONS[subdir_name]:
+        files.extend(glob(str(construction.construction_dir_path / subdir_name / f"*.{extension}")))
+    files.sort()
+    return [Path(file).relative_to(construction.construction_dir_path) for file in files]
+
+
+@contextmanager
+def discovery(variant: str) -> Iterator[None]:
+    if variant in ("scandir", "index"):
+        yield
+        return
+    find_files_in_subdir = getattr(Construction, "_Construction__find_files_in_subdir")
+    setattr(Construction, "_Construction__find_files_in_subdir", find_files_in_subdir_with_glob)
+    try:
+        yield
+    finally:
+        setattr(Construction, "_Construction__find_files_in_subdir", find_files_in_subdir)
+
+
+def get_listing_count(variant: str) -> int:
+    if variant == "index":
+        return 0
+    if variant == "scandir":
+        return len(SUBDIR_EXTENSIONS)
+    return sum(len(extensions) for extensions in SUBDIR_EXTENSIONS.values())
+
+
+def scan_workspace(workspace_dir_path: Path, scan_concurrency: int, workspace_index: WorkspaceIndex | None = None) -> int:
+    # Constructions read their files on first access, read everything a README generation would
+    construction_count = 0
+    for construction in Workspace(workspace_dir_path, scan_concurrency=scan_concurrency, workspace_index=workspace_index):
+        construction.scan()
+        construction_count += 1
+    return construction_count
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_variants(value: str) -> List[str]:
+    variants = [variant for variant in value.split(",") if variant]
+    unknown_variants = [variant for variant in variants if variant not in VARIANTS]
+    if unknown_variants:
+        raise argparse.ArgumentTypeError(f"Unknown variants {unknown_variants}, available: {', '.join(VARIANTS)}")
+    return variants
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure the construction discovery of a workspace scan on synthetic workspaces")
+    parser.add_argument("--constructions", type=parse_int_list, default=[1000, 10000], help="Construction counts to measure. Default: 1000,10000")
+    parser.add_argument("--variants", type=parse_variants, default=list(VARIANTS), help=f"Variants to measure. Default: {','.join(VARIANTS)}")
+    parser.add_argument("--scan-concurrency", type=int, default=1, help="Constructions scanned at once by the workspace. Default: 1")
+    parser.add_argument("--repeat", type=int, default=3, help="Scans per measurement, the fastest one is reported. Default: 3")
+    args = parser.parse_args()
+
+    print(f"{'variant':<8} {'constructions':>13} {'seconds':>9} {'us/constr.':>11} {'listings/constr.':>17}")
+    for construction_count in args.constructions:
+        with tempfile.TemporaryDirectory(prefix="construction_utils_benchmark_") as tmp_dir:
+            workspace_dir_path = Path(tmp_dir)
+            create_workspace(workspace_dir_path, construction_count)
+            for variant in args.variants:
+                durations: List[float] = []
+                if variant == "index":
+                    workspace_index = WorkspaceIndex(workspace_dir_path)
+                    scan_workspace(workspace_dir_path, args.scan_concurrency, workspace_index)
+                    workspace_index.save()
+                with discovery(variant):
+                    for _ in range(args.repeat):
+                        start_time = time.monotonic()
+                        # The index is opened as part of the scan, like by a new generate_docs run
+                        workspace_index = WorkspaceIndex(workspace_dir_path) if variant == "index" else None
+                        scanned_construction_count = scan_workspace(workspace_dir_path, args.scan_concurrency, workspace_index)
+                        durations.append(time.monotonic() - start_time)
+                        assert scanned_construction_count == construction_count
+                duration = min(durations)
+                # fmt: off
+                print(
+                    f"{variant:<8} {construction_count:>13} {duration:>9.2f} {duration / construction_count * 1e6:>11.0f} {get_listing_count(variant):>17}",
+                    flush=True
+                )
+                # fmt: on
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
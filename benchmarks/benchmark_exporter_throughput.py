@@ -0,0 +1,156 @@
+# Copyright (C) 2024 twyleg
+"""
+End-to-end export throughput of the FreecadExporter, measured on the fake FreeCAD of the tests
+(tests/resources/fake_freecad) so that scheduling and orchestration changes can be compared on any Linux machine,
+without FreeCAD and X server. The fake simulates the FreeCAD startup and per document latencies.
+
+Variants:
+    pool: Jobs rendered by the local FreeCAD worker processes
+    daemon: Jobs sent to a running render daemon
+    cache: Jobs restored from a warm render cache (the cache is filled by an unmeasured run first)
+
+Usage:
+    python benchmarks/benchmark_exporter_throughput.py [--jobs=1,10,100,1000] [--variants=pool,daemon,cache] [-j WORKERS]
+                                                      [--startup-delay=SECONDS] [--document-delay=SECONDS]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+FILE_DIR = Path(__file__).parent
+sys.path.insert(0, str(FILE_DIR.parent))
+
+from construction_utils.freecad_exporter import (  # noqa: E402
+    RENDER_BACKEND_GUI,
+    FreecadExporter,
+    create_freecad_command,
+    get_available_cpu_count,
+    stop_render_daemon,
+)
+from construction_utils.render_cache import RenderCache  # noqa: E402
+
+FAKE_FREECAD_FILE_PATH = FILE_DIR.parent / "tests/resources/fake_freecad/freecad"
+SOURCE_FILE_PATHS = sorted((FILE_DIR.parent / "tests/resources/src").glob("*.FCStd"))
+VARIANTS = ("pool", "daemon", "cache")
+DAEMON_STARTUP_TIMEOUT = 60.0
+
+logm = logging.getLogger(__name__)
+
+
+def create_source_files(source_dir_path: Path, job_count: int) -> List[Path]:
+    source_dir_path.mkdir(parents=True)
+    source_file_paths: List[Path] = []
+    for index in range(job_count):
+        source_file_path = source_dir_path / f"part_{index:04d}.FCStd"
+        shutil.copyfile(SOURCE_FILE_PATHS[index % len(SOURCE_FILE_PATHS)], source_file_path)
+        source_file_paths.append(source_file_path)
+    return source_file_paths
+
+
+def run_export(freecad_exporter: FreecadExporter, source_file_paths: List[Path], output_dir_path: Path) -> int:
+    for source_file_path in source_file_paths:
+        freecad_exporter.add_export_job(source_file_path, output_dir_path)
+    return len(freecad_exporter.export())
+
+
+def benchmark_pool(tmp_dir_path: Path, source_file_paths: List[Path], workers: int) -> int:
+    freecad_exporter = FreecadExporter(
+        workers=workers, render_daemon_socket_path=tmp_dir_path / "no_daemon.sock", xvfb_servers=0, render_backend=RENDER_BACKEND_GUI
+    )
+    return run_export(freecad_exporter, source_file_paths, tmp_dir_path / "output")
+
+
+def benchmark_daemon(tmp_dir_path: Path, source_file_paths: List[Path], workers: int) -> int:
+    socket_path = tmp_dir_path / "daemon.sock"
+    daemon_process = subprocess.Popen(create_freecad_command(["--serve", str(socket_path)], xvfb_run=False), stdout=subprocess.DEVNULL)
+    try:
+        # Waiting for the daemon is part of the measurement, its startup is paid once per daemon instead of once per run
+        deadline = time.monotonic() + DAEMON_STARTUP_TIMEOUT
+        while not socket_path.exists():
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Render daemon did not start within {DAEMON_STARTUP_TIMEOUT}s")
+            time.sleep(0.01)
+        freecad_exporter = FreecadExporter(workers=workers, render_daemon_socket_path=socket_path, xvfb_servers=0, render_backend=RENDER_BACKEND_GUI)
+        return run_export(freecad_exporter, source_file_paths, tmp_dir_path / "output")
+    finally:
+        stop_render_daemon(socket_path)
+        daemon_process.wait()
+
+
+def benchmark_cache(tmp_dir_path: Path, source_file_paths: List[Path], workers: int) -> int:
+    render_cache = RenderCache(FreecadExporter.RENDER_PARAMETERS, "benchmark", tmp_dir_path / "render_cache")
+    # fmt: off
+    freecad_exporter = FreecadExporter(
+        workers=workers,
+        render_daemon_socket_path=tmp_dir_path / "no_daemon.sock",
+        render_cache=render_cache,
+        xvfb_servers=0,
+        render_backend=RENDER_BACKEND_GUI
+    )
+    # fmt: on
+    return run_export(freecad_exporter, source_file_paths, tmp_dir_path / "output")
+
+
+def warm_up_cache(tmp_dir_path: Path, source_file_paths: List[Path], workers: int) -> None:
+    benchmark_cache(tmp_dir_path, source_file_paths, workers)
+    shutil.rmtree(tmp_dir_path / "output")
+
+
+BENCHMARKS: dict[str, Callable[[Path, List[Path], int], int]] = {"pool": benchmark_pool, "daemon": benchmark_daemon, "cache": benchmark_cache}
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_variants(value: str) -> List[str]:
+    variants = [variant for variant in value.split(",") if variant]
+    unknown_variants = [variant for variant in variants if variant not in VARIANTS]
+    if unknown_variants:
+        raise argparse.ArgumentTypeError(f"Unknown variants {unknown_variants}, available: {', '.join(VARIANTS)}")
+    return variants
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure the export throughput of the FreecadExporter on the fake FreeCAD")
+    parser.add_argument("--jobs", type=parse_int_list, default=[1, 10, 100, 1000], help="Job counts to measure. Default: 1,10,100,1000")
+    parser.add_argument("--variants", type=parse_variants, default=list(VARIANTS), help=f"Variants to measure. Default: {','.join(VARIANTS)}")
+    parser.add_argument("-j", "--workers", type=int, default=get_available_cpu_count(), help="Number of FreeCAD workers. Default: available CPUs")
+    parser.add_argument("--startup-delay", type=float, default=2.0, help="Simulated FreeCAD startup time in seconds. Default: 2.0")
+    parser.add_argument("--document-delay", type=float, default=0.1, help="Simulated time per document in seconds. Default: 0.1")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log the exporter output")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    # Inherited by every (fake) FreeCAD process the exporter starts
+    os.environ["FREECAD_EXECUTABLE"] = str(FAKE_FREECAD_FILE_PATH)
+    os.environ["FAKE_FREECAD_STARTUP_DELAY"] = str(args.startup_delay)
+    os.environ["FAKE_FREECAD_DOCUMENT_DELAY"] = str(args.document_delay)
+
+    print(f"workers: {args.workers}, startup delay: {args.startup_delay}s, document delay: {args.document_delay}s")
+    print(f"{'variant':<8} {'jobs':>6} {'seconds':>9} {'jobs/s':>9} {'failed':>7}")
+    for variant in args.variants:
+        for job_count in args.jobs:
+            with tempfile.TemporaryDirectory(prefix="construction_utils_benchmark_") as tmp_dir:
+                tmp_dir_path = Path(tmp_dir)
+                source_file_paths = create_source_files(tmp_dir_path / "src", job_count)
+                if variant == "cache":
+                    warm_up_cache(tmp_dir_path, source_file_paths, args.workers)
+
+                start_time = time.monotonic()
+                failed_count = BENCHMARKS[variant](tmp_dir_path, source_file_paths, args.workers)
+                duration = time.monotonic() - start_time
+            print(f"{variant:<8} {job_count:>6} {duration:>9.2f} {job_count / duration:>9.1f} {failed_count:>7}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# Copyright (C) 2024 twyleg
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import IO, Any, Dict, List
+
+
+logm = logging.getLogger(__name__)
+
+
+class ExportJournal:
+    """
+    Record of the export jobs a run has finished, used to resume an interrupted run (Ctrl-C, CI timeout, OOM kill) without
+    exporting those jobs again.
+
+    Every finished job is appended as one JSON line and flushed to disk right away, so the journal is up to date no matter
+    how the run ends. A run that is not resumed starts a new journal. On resume, a job counts as finished if it was
+    recorded with the same job key and its input still has the recorded size and modification time. Paths are stored
+    relative to the journal's base dir.
+    """
+
+    JOURNAL_VERSION = 1
+    DEFAULT_JOURNAL_FILE_PATH = Path(".construction_utils/export_journal.jsonl")
+
+    def __init__(self, base_dir_path: Path, journal_file_path: Path | None = None, resume: bool = False) -> None:
+        self.base_dir_path = base_dir_path
+        self.journal_file_path = journal_file_path if journal_file_path else base_dir_path / self.DEFAULT_JOURNAL_FILE_PATH
+        self._entries: Dict[str, Dict[str, Any]] = self.__load() if resume else {}
+        self._journal_file: IO[str] | None = None
+        self._lock = threading.Lock()
+
+    def __load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.journal_file_path, "r", encoding="utf-8") as journal_file:
+                lines = journal_file.read().splitlines()
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            logm.warning("Unable to read export journal %s (%s) - exporting all jobs", self.journal_file_path, e)
+            return {}
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        for line_index, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line is torn if the run got killed while appending it
+                continue
+            if line_index == 0:
+                if entry.get("version") != self.JOURNAL_VERSION:
+                    return {}
+                continue
+            entries[entry["job"]] = entry
+        return entries
+
+    def __key(self, file_path: Path) -> str:
+        try:
+            return file_path.absolute().relative_to(self.base_dir_path.absolute()).as_posix()
+        except ValueError:
+            return file_path.absolute().as_posix()
+
+    def __path(self, key: str) -> Path:
+        return self.base_dir_path / key
+
+    def __open(self) -> IO[str]:
+        # Start from a clean copy of the entries that are resumed, a torn last line must not swallow the next entry
+        self.journal_file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_journal_file_path = self.journal_file_path.with_name(f".{self.journal_file_path.name}.{os.getpid()}.tmp")
+        with open(tmp_journal_file_path, "w", encoding="utf-8") as journal_file:
+            journal_file.write(json.dumps({"version": self.JOURNAL_VERSION}) + "\n")
+            for entry in self._entries.values():
+                journal_file.write(json.dumps(entry) + "\n")
+        os.replace(tmp_journal_file_path, self.journal_file_path)
+        return open(self.journal_file_path, "a", encoding="utf-8")
+
+    def get_finished_artifacts(self, job_key: str, input_file_path: Path) -> List[Path] | None:
+        """
+        Files exported by the job if it was finished by the resumed run and its input is unchanged since, otherwise None.
+        """
+        entry = self._entries.get(job_key)
+        if entry is None or entry["input"] != self.__key(input_file_path):
+            return None
+        try:
+            stat = input_file_path.stat()
+        except OSError:
+            return None
+        if entry["input_size"] != stat.st_size or entry["input_mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return [self.__path(artifact) for artifact in entry["artifacts"]]
+
+    def record(self, job_key: str, input_file_path: Path, artifact_file_paths: List[Path]) -> None:
+        try:
+            stat = input_file_path.stat()
+        except OSError:
+            return
+        # fmt: off
+        entry = {
+            "job": job_key,
+            "input": self.__key(input_file_path),
+            "input_size": stat.st_size,
+            "input_mtime_ns": stat.st_mtime_ns,
+            "artifacts": [self.__key(artifact_file_path) for artifact_file_path in artifact_file_paths]
+        }
+        # fmt: on
+        with self._lock:
+            try:
+                if self._journal_file is None:
+                    self._journal_file = self.__open()
+                self._journal_file.write(json.dumps(entry) + "\n")
+                self._journal_file.flush()
+                os.fsync(self._journal_file.fileno())
+            except OSError as e:
+                logm.warning("Unable to write export journal %s (%s)", self.journal_file_path, e)
+                return
+            self._entries[job_key] = entry
+
+    def close(self) -> None:
+        with self._lock:
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+
+    def remove(self) -> None:
+        """
+        Drop the journal once a run finished all of its jobs, there is nothing left to resume.
+        """
+        self.close()
+        self.journal_file_path.unlink(missing_ok=True)
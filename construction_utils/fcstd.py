@@ -0,0 +1,116 @@
+# Copyright (C) 2024 twyleg
+import hashlib
+import logging
+import zipfile
+import zlib
+from pathlib import Path
+from typing import List
+from xml.etree import ElementTree
+
+from construction_utils.png_optimizer import PNG_SIGNATURE
+
+
+logm = logging.getLogger(__name__)
+
+
+THUMBNAIL_ENTRY_NAME = "thumbnails/Thumbnail.png"
+DOCUMENT_ENTRY_NAME = "Document.xml"
+GUI_DOCUMENT_ENTRY_NAME = "GuiDocument.xml"
+ENTRY_CHUNK_SIZE = 1024 * 1024
+
+# Rewritten on every save, or only telling where and with which FreeCAD version the document was saved
+VOLATILE_DOCUMENT_PROPERTIES = {"FileName", "TransientDir", "LastModifiedBy", "LastModifiedDate"}
+VOLATILE_DOCUMENT_ATTRIBUTES = {"ProgramVersion"}
+# View provider properties that change how a document renders. Everything else in GuiDocument.xml is GUI state, like
+# the camera, tree expansion, selection or edit mode settings.
+RENDER_VIEW_PROPERTIES = {
+    "Visibility",
+    "DisplayMode",
+    "ShapeColor",
+    "ShapeMaterial",
+    "DiffuseColor",
+    "Transparency",
+    "LineColor",
+    "LineColorArray",
+    "LineWidth",
+    "PointColor",
+    "PointColorArray",
+    "PointSize",
+    "DrawStyle",
+    "Lighting",
+    "Deviation",
+    "AngularDeflection",
+}
+
+
+def read_fcstd_thumbnail(fcstd_file_path: Path) -> bytes | None:
+    """
+    The preview image FreeCAD embeds in a document when saving it (unless disabled in its preferences), None if the
+    document has none. Only the zip's central directory and the thumbnail entry are read, not the document itself.
+    """
+    try:
+        with zipfile.ZipFile(fcstd_file_path) as fcstd_file:
+            thumbnail = fcstd_file.read(THUMBNAIL_ENTRY_NAME)
+    except KeyError:
+        return None
+    except (OSError, zipfile.BadZipFile) as e:
+        logm.debug("Unable to read thumbnail of %s (%s)", fcstd_file_path, e)
+        return None
+    return thumbnail if thumbnail.startswith(PNG_SIGNATURE) else None
+
+
+def canonicalize_document_xml(document_xml: bytes) -> str:
+    document = ElementTree.fromstring(document_xml)
+    for attribute in VOLATILE_DOCUMENT_ATTRIBUTES:
+        document.attrib.pop(attribute, None)
+    document_properties = document.find("Properties")
+    if document_properties is not None:
+        for document_property in list(document_properties):
+            if document_property.get("name") in VOLATILE_DOCUMENT_PROPERTIES:
+                document_properties.remove(document_property)
+    return ElementTree.canonicalize(ElementTree.tostring(document, encoding="unicode"), strip_text=True)
+
+
+def canonicalize_gui_document_xml(gui_document_xml: bytes) -> str:
+    gui_document = ElementTree.fromstring(gui_document_xml)
+    render_view_properties: List[str] = []
+    for view_provider in gui_document.iter("ViewProvider"):
+        for view_property in view_provider.iter("Property"):
+            if view_property.get("name") in RENDER_VIEW_PROPERTIES:
+                canonical_view_property = ElementTree.canonicalize(ElementTree.tostring(view_property, encoding="unicode"), strip_text=True)
+                render_view_properties.append(f"{view_provider.get('name')}:{canonical_view_property}")
+    return "\n".join(render_view_properties)
+
+
+def compute_fcstd_fingerprint(fcstd_file_path: Path) -> str | None:
+    """
+    Fingerprint of what a document looks like when rendered: its objects and their geometry (Document.xml and the BREP
+    and other payloads) and the visibility and colors of their views. Properties FreeCAD updates on every save, the GUI
+    state (camera, tree, selection) and the thumbnail are left out, so saving a document after merely rotating or zooming
+    the view keeps the fingerprint. None if the file isn't a readable FCStd document.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with zipfile.ZipFile(fcstd_file_path) as fcstd_file:
+            entry_names = fcstd_file.namelist()
+            if DOCUMENT_ENTRY_NAME not in entry_names:
+                return None
+            for entry_name in sorted(entry_names):
+                if entry_name == THUMBNAIL_ENTRY_NAME or entry_name.endswith("/"):
+                    continue
+                if entry_name == DOCUMENT_ENTRY_NAME:
+                    entry_sha256 = hashlib.sha256(canonicalize_document_xml(fcstd_file.read(entry_name)).encode("utf-8"))
+                elif entry_name == GUI_DOCUMENT_ENTRY_NAME:
+                    entry_sha256 = hashlib.sha256(canonicalize_gui_document_xml(fcstd_file.read(entry_name)).encode("utf-8"))
+                else:
+                    # BREP and other payloads can be large, they are hashed as they are decompressed
+                    entry_sha256 = hashlib.sha256()
+                    with fcstd_file.open(entry_name) as entry_file:
+                        while chunk := entry_file.read(ENTRY_CHUNK_SIZE):
+                            entry_sha256.update(chunk)
+                sha256.update(f"{entry_name}\0{entry_sha256.hexdigest()}\0".encode("utf-8"))
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, ElementTree.ParseError, ValueError) as e:
+        # Corrupt, truncated or using an unsupported compression, hashed as plain file instead
+        logm.debug("Unable to fingerprint %s as FreeCAD document (%s)", fcstd_file_path, e)
+        return None
+    return sha256.hexdigest()
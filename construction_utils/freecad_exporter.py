@@ -1,26 +1,615 @@
 # Copyright (C) 2024 twyleg
+import glob
+import hashlib
+import heapq
+import json
 import logging
+import math
+import os
 import os.path
+import queue
+import signal
+import socket
 import subprocess
-from typing import List, Tuple
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from collections import deque
+from typing import IO, Any, Callable, Deque, Dict, List, Set, Tuple
 from shutil import which
 from pathlib import Path
 
+from construction_utils.export_journal import ExportJournal
+from construction_utils.fcstd import read_fcstd_thumbnail
+from construction_utils.png_optimizer import get_png_optimizer, optimize_pngs
+from construction_utils.render_cache import RenderCache, get_default_render_cache_dir_path
+from construction_utils.render_history import RenderHistory
+from construction_utils.render_manifest import RenderManifest, compute_input_fingerprint
+from construction_utils.runtime_dir import check_private_dir, create_private_dir, get_runtime_dir_path
+from construction_utils.xvfb_manager import XvfbManager, XvfbStartupError, get_software_gl_environment
+
 
 FILE_DIR = Path(__file__).parent
+FREECAD_EXPORT_SCRIPT_FILE_PATH = FILE_DIR / "resources/scripts/freecad_export_image_script.py"
+# Exit status of a render daemon that stopped to get restarted, EXIT_CODE_RECYCLED of the export script
+RENDER_DAEMON_EXIT_CODE_RECYCLED = 75
 logm = logging.getLogger(__name__)
 
 
+def get_available_cpu_count() -> int:
+    """
+    Number of CPUs this process may actually use.
+
+    Honours the CPU affinity mask (taskset, container cpusets) and the cgroup CPU quota (docker --cpus, k8s limits),
+    whichever is lower.
+    """
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpu_count = os.cpu_count() or 1
+
+    cgroup_cpu_limit = _read_cgroup_cpu_limit()
+    if cgroup_cpu_limit is not None:
+        cpu_count = min(cpu_count, cgroup_cpu_limit)
+
+    return max(1, cpu_count)
+
+
+def _read_cgroup_cpu_limit() -> int | None:
+    # cgroup v2
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            return math.ceil(int(quota) / int(period))
+        return None
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1
+    try:
+        quota_us = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period_us = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        if quota_us > 0 and period_us > 0:
+            return math.ceil(quota_us / period_us)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def get_default_render_daemon_socket_path() -> Path:
+    return get_runtime_dir_path() / "freecad_render_daemon.sock"
+
+
+@lru_cache(maxsize=None)
+def get_export_script_version() -> str:
+    return hashlib.sha256(FREECAD_EXPORT_SCRIPT_FILE_PATH.read_bytes()).hexdigest()[:16]
+
+
+def get_freecad_executable() -> str:
+    """
+    The FreeCAD GUI executable, "freecad" from the PATH unless overridden by the FREECAD_EXECUTABLE environment variable
+    (e.g. with the fake FreeCAD of the tests and benchmarks).
+    """
+    return os.environ.get("FREECAD_EXECUTABLE", "freecad")
+
+
+@lru_cache(maxsize=None)
+def log_png_optimizer_missing() -> None:
+    # Once per process, the daemon and watch mode export many times
+    logm.warning("Not optimizing previews, neither oxipng nor Pillow is installed (pip install construction_utils[optimize])")
+
+
+@lru_cache(maxsize=None)
+def get_freecad_version() -> str:
+    try:
+        result = subprocess.run(
+            [get_freecad_executable(), "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding="utf-8", errors="replace", timeout=60
+        )
+        version = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logm.warning("Unable to determine FreeCAD version (%s)", e)
+        return "unknown"
+    return version if version else "unknown"
+
+
+def resolve_output_file_path(input_file_path: Path, output_file_or_dir_path: Path | None) -> Path:
+    """
+    Output file the export script writes for the given job (same rules as the script itself).
+    """
+    if output_file_or_dir_path is None:
+        return input_file_path.parent / f"{input_file_path.stem}.png"
+    elif output_file_or_dir_path.suffix:
+        return output_file_or_dir_path
+    else:
+        return output_file_or_dir_path / f"{input_file_path.stem}.png"
+
+
+def get_preview_output_file_path(output_file_path: Path, view: str, view_index: int, size: int | None = None) -> Path:
+    """
+    The first view is written to the output file itself, every further view next to it with the view name as suffix.
+    Downscaled derivatives additionally get their size as suffix (example-200.png, example-front-200.png).
+    """
+    suffixes = ([view] if view_index > 0 else []) + ([str(size)] if size is not None else [])
+    if not suffixes:
+        return output_file_path
+    return output_file_path.with_name(f"{output_file_path.stem}-{'-'.join(suffixes)}{output_file_path.suffix}")
+
+
+def get_tmp_output_file_path(output_file_path: Path) -> Path:
+    # Must match the export script, which writes every output to this file first and renames it into place when complete
+    return output_file_path.with_name(f".{output_file_path.stem}.tmp{output_file_path.suffix}")
+
+
+RENDER_BACKEND_AUTO = "auto"
+RENDER_BACKEND_OFFSCREEN = "offscreen"
+RENDER_BACKEND_GUI = "gui"
+AVAILABLE_RENDER_BACKENDS = (RENDER_BACKEND_AUTO, RENDER_BACKEND_OFFSCREEN, RENDER_BACKEND_GUI)
+# Name of the console executable differs between the upstream builds and the distribution packages
+FREECAD_CMD_EXECUTABLES = ("FreeCADCmd", "freecadcmd")
+OFFSCREEN_PROBE_TIMEOUT = 60.0
+
+
+def get_freecad_cmd_executable() -> str:
+    for executable in FREECAD_CMD_EXECUTABLES:
+        if which(executable) is not None:
+            return executable
+    return FREECAD_CMD_EXECUTABLES[0]
+
+
+# fmt: off
+def create_freecad_command(script_args: List[str],
+                           xvfb_server_num: int | None = None,
+                           xvfb_run: bool = True,
+                           render_backend: str = RENDER_BACKEND_GUI) -> List[str]:
+    # fmt: on
+    """
+    Command that runs the export script. The GUI backend is wrapped by xvfb-run if available, unless the caller provides
+    a display (xvfb_run=False). The offscreen backend runs the console FreeCAD without X server.
+    """
+    args: List[str] = []
+
+    if render_backend == RENDER_BACKEND_OFFSCREEN:
+        args.append(get_freecad_cmd_executable())
+    else:
+        if xvfb_run and which("xvfb-run") is not None:
+            args.append("xvfb-run")
+            args.append("-a")
+            if xvfb_server_num is not None:
+                args.append(f"--server-num={xvfb_server_num}")
+        args.append(get_freecad_executable())
+
+    args.append(str(FREECAD_EXPORT_SCRIPT_FILE_PATH))
+    args.append("--pass")
+    args.extend(script_args)
+    return args
+
+
+def get_offscreen_probe_file_path() -> Path:
+    return get_default_render_cache_dir_path().parent / "offscreen_probe.json"
+
+
+@lru_cache(maxsize=None)
+def is_offscreen_backend_available() -> bool:
+    """
+    Whether the offscreen backend works on this machine. Creating an OpenGL context without X server depends on how
+    FreeCAD and Coin were built, so this is probed once by rendering a tiny scene. The result is cached per FreeCAD
+    installation and export script version.
+    """
+    executable = which(get_freecad_cmd_executable())
+    if executable is None:
+        return False
+
+    probe_key = f"{os.path.realpath(executable)}:{os.stat(executable).st_mtime_ns}:{get_export_script_version()}"
+    probe_file_path = get_offscreen_probe_file_path()
+    try:
+        probe = json.loads(probe_file_path.read_text())
+        if probe["key"] == probe_key:
+            return probe["available"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    logm.info("Probing offscreen render backend (%s)", executable)
+    args = create_freecad_command(["--probe"], render_backend=RENDER_BACKEND_OFFSCREEN)
+    env = {**os.environ, **get_software_gl_environment(1)}
+    try:
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8", errors="replace", env=env, timeout=OFFSCREEN_PROBE_TIMEOUT)
+        events = [event for event in map(parse_job_event, result.stdout.splitlines()) if event and event["event"] == "probe"]
+        available = bool(events) and events[-1]["ok"]
+        if not available:
+            logm.info("Offscreen render backend not available: %s", events[-1].get("error") if events else f"return code {result.returncode}")
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logm.info("Offscreen render backend not available: %s", e)
+        available = False
+
+    try:
+        probe_file_path.parent.mkdir(parents=True, exist_ok=True)
+        probe_file_path.write_text(json.dumps({"key": probe_key, "available": available}))
+    except OSError as e:
+        logm.warning("Unable to cache offscreen probe result (%s)", e)
+    return available
+
+
+def select_render_backend(render_backend: str) -> str:
+    """
+    Resolve the auto backend to the fastest one that works here: offscreen (no GUI, no X server) if possible, GUI otherwise.
+    """
+    if render_backend != RENDER_BACKEND_AUTO:
+        return render_backend
+    return RENDER_BACKEND_OFFSCREEN if is_offscreen_backend_available() else RENDER_BACKEND_GUI
+
+
+def get_recycle_args(max_documents: int | None, max_rss: int | None) -> List[str]:
+    recycle_args: List[str] = []
+    if max_documents is not None:
+        recycle_args.append(f"--max-documents={max_documents}")
+    if max_rss is not None:
+        recycle_args.append(f"--max-rss={max(1, max_rss // (1024 * 1024))}")
+    return recycle_args
+
+
+def is_render_daemon_running(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+            return True
+        except OSError:
+            return False
+
+
+def run_render_daemon(socket_path: Path, render_backend: str = RENDER_BACKEND_AUTO, max_documents: int | None = None, max_rss: int | None = None) -> int:
+    """
+    Run a FreeCAD render daemon in the foreground until it is stopped (Ctrl-C or stop_render_daemon()). FreeCAD is
+    restarted once it exported max_documents documents or its resident memory exceeds max_rss bytes.
+
+    FreecadExporter sends its jobs to this daemon when it is reachable and thereby avoids the FreeCAD and Xvfb startup.
+    """
+    try:
+        create_private_dir(socket_path.parent)
+    except OSError as e:
+        logm.error("Unable to create render daemon socket dir (%s)", e)
+        return 1
+    if is_render_daemon_running(socket_path):
+        logm.error("Render daemon already running: %s", socket_path)
+        return 1
+
+    render_backend = select_render_backend(render_backend)
+    env: Dict[str, str] | None = None
+    xvfb_run = True
+    if render_backend == RENDER_BACKEND_OFFSCREEN:
+        env = {**os.environ, **get_software_gl_environment(get_available_cpu_count())}
+    elif XvfbManager.is_available():
+        xvfb_manager = XvfbManager(server_count=1, render_threads=get_available_cpu_count())
+        try:
+            env = {**os.environ, **xvfb_manager.get_environment(xvfb_manager.start()[0])}
+            xvfb_run = False
+        except XvfbStartupError as e:
+            logm.warning("%s - falling back to xvfb-run", e)
+
+    serve_args = ["--serve", str(socket_path.absolute()), *get_recycle_args(max_documents, max_rss)]
+    args = create_freecad_command(serve_args, xvfb_run=xvfb_run, render_backend=render_backend)
+    logm.info("Starting render daemon: %s", socket_path)
+    logm.debug("FreeCAD command: %s", " ".join(args))
+    try:
+        while (returncode := subprocess.run(args, env=env).returncode) == RENDER_DAEMON_EXIT_CODE_RECYCLED:
+            logm.info("Restarting render daemon to free FreeCAD's memory")
+        return returncode
+    except KeyboardInterrupt:
+        logm.info("Render daemon stopped")
+        return 0
+
+
+def stop_render_daemon(socket_path: Path) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(socket_path))
+            stream = client.makefile("rw", encoding="utf-8")
+            stream.write(json.dumps({"command": "shutdown"}) + "\n")
+            stream.flush()
+            stream.readline()
+            return True
+    except OSError:
+        return False
+
+
+def parse_job_event(line: str) -> Dict[str, Any] | None:
+    if not line.startswith('{"event":'):
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    elif minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+AVAILABLE_VIEWS = ("axo", "front", "rear", "top", "bottom", "left", "right")
+DEFAULT_VIEWS = ("axo",)
+# Widths the README templates display previews at: 200 in the construction README, 400 in the workspace README
+DEFAULT_PREVIEW_SIZES = (200, 400)
+AVAILABLE_EXPORT_FORMATS = ("stl", "step")
+DEFAULT_EXPORT_FORMATS = ("stl",)
+
+
+@dataclass(frozen=True)
+class ExportJob:
+    input_file_path: Path
+    output_file_or_dir_path: Path | None = None
+    views: Tuple[str, ...] = DEFAULT_VIEWS
+    sizes: Tuple[int, ...] = DEFAULT_PREVIEW_SIZES
+    export_dir_path: Path | None = None
+    export_formats: Tuple[str, ...] = ()
+
+    @property
+    def output_file_path(self) -> Path:
+        return resolve_output_file_path(self.input_file_path, self.output_file_or_dir_path)
+
+    def preview_output_file_paths(self) -> Dict[Tuple[str, int | None], Path]:
+        """
+        All files the job writes, keyed by view and size. The full size render has size None.
+        """
+        return {
+            (view, size): get_preview_output_file_path(self.output_file_path, view, view_index, size)
+            for view_index, view in enumerate(self.views)
+            for size in (None, *self.sizes)
+        }
+
+
+@dataclass
+class ExportFailure:
+    job: ExportJob
+    reason: str
+    detail: str
+
+    REASON_FAILED = "failed"
+    REASON_TIMEOUT = "timeout"
+    REASON_CRASHED = "crashed"
+    REASON_STARTUP_FAILED = "startup_failed"
+
+
+def write_failure_report(failures: List[ExportFailure], report_file_path: Path) -> None:
+    report_file_path.parent.mkdir(parents=True, exist_ok=True)
+    # fmt: off
+    report = [
+        {
+            "input": str(failure.job.input_file_path),
+            "output": str(failure.job.output_file_path),
+            "reason": failure.reason,
+            "detail": failure.detail
+        }
+        for failure in failures
+    ]
+    # fmt: on
+    with open(report_file_path, "w") as report_file:
+        json.dump({"failures": report}, report_file, indent=4)
+
+
+class ExportProgress:
+    """
+    Collects the job events of all workers and reports per-job progress, throughput and ETA while the export runs.
+
+    Jobs added with an estimated duration are accounted by that estimate: the ETA is the estimated time of the remaining
+    jobs spread across the workers, corrected by how far the estimates of the finished jobs were off.
+    """
+
+    def __init__(self, job_count: int = 0, worker_count: int = 1) -> None:
+        self.job_count = job_count
+        self.worker_count = worker_count
+        self.rendered_count = 0
+        self.failures: List[ExportFailure] = []
+        self.artifacts: Dict[ExportJob, List[Path]] = {}
+        self.durations: Dict[ExportJob, float] = {}
+        self._remaining_estimated_durations: Dict[ExportJob, float] = {}
+        self._finished_estimated_duration = 0.0
+        self._finished_duration = 0.0
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._start_time = time.monotonic()
+
+    def add_job(self, job: ExportJob, estimated_duration: float) -> None:
+        with self._lock:
+            self.job_count += 1
+            self._remaining_estimated_durations[job] = estimated_duration
+
+    @property
+    def failed_count(self) -> int:
+        return len(self.failures)
+
+    @property
+    def finished_count(self) -> int:
+        return self.rendered_count + self.failed_count
+
+    def throughput(self) -> float:
+        elapsed_time = time.monotonic() - self._start_time
+        return self.finished_count / elapsed_time if elapsed_time > 0 else 0.0
+
+    def eta(self) -> float | None:
+        remaining_count = self.job_count - self.finished_count
+        if remaining_count > len(self._remaining_estimated_durations):
+            # Not every job has an estimate, extrapolate from the throughput so far
+            throughput = self.throughput()
+            return remaining_count / throughput if throughput > 0 else None
+        if not self._remaining_estimated_durations:
+            return 0.0
+
+        estimated_durations = self._remaining_estimated_durations.values()
+        # The batch can't finish before its longest job, no matter how many workers there are
+        eta = max(sum(estimated_durations) / max(1, self.worker_count), max(estimated_durations))
+        if self._finished_estimated_duration > 0 and self._finished_duration > 0:
+            eta *= self._finished_duration / self._finished_estimated_duration
+        return eta
+
+    def __finish_job(self, job: ExportJob, duration: float | None) -> None:
+        estimated_duration = self._remaining_estimated_durations.pop(job, None)
+        if duration is not None and estimated_duration is not None:
+            self._finished_estimated_duration += estimated_duration
+            self._finished_duration += duration
+
+    def __log_progress(self, status: str, input_file_path: Path | str, duration: float | None) -> None:
+        eta = self.eta()
+        logm.info(
+            "[%d/%d] %s %s (%s) - %.2f jobs/s - ETA %s",
+            self.finished_count,
+            self.job_count,
+            status,
+            input_file_path,
+            f"{duration:.1f}s" if duration is not None else "-",
+            self.throughput(),
+            format_duration(eta) if eta is not None else "unknown",
+        )
+
+    def handle_event(self, worker_name: str, event: Dict[str, Any], job: ExportJob) -> None:
+        if event["event"] == "started":
+            logm.debug("[%s] Started: %s", worker_name, event["input"])
+        elif event["event"] == "rendered":
+            with self._lock:
+                self.rendered_count += 1
+                self.artifacts[job] = [Path(artifact) for artifact in event.get("artifacts", [])]
+                self.durations[job] = event["duration"]
+                self.__finish_job(job, event["duration"])
+                self.__log_progress("Rendered", event["input"], event["duration"])
+        elif event["event"] == "failed":
+            self.add_failure(worker_name, ExportFailure(job, ExportFailure.REASON_FAILED, event["error"]), event["duration"])
+
+    def add_failure(self, worker_name: str, failure: ExportFailure, duration: float | None = None) -> None:
+        with self._lock:
+            self.failures.append(failure)
+            self.__finish_job(failure.job, duration)
+            logm.error("[%s] Export failed (%s): %s - %s", worker_name, failure.reason, failure.job.input_file_path, failure.detail)
+            self.__log_progress("Failed", failure.job.input_file_path, duration)
+
+    def log_estimate(self) -> None:
+        eta = self.eta()
+        if self.finished_count < self.job_count and eta is not None:
+            logm.info("Estimated export time: %s for %d job(s) on %d worker(s)", format_duration(eta), self.job_count - self.finished_count, self.worker_count)
+
+    def log_summary(self) -> None:
+        logm.info(
+            "Exported %d/%d job(s) in %s, %d failed",
+            self.rendered_count,
+            self.job_count,
+            format_duration(time.monotonic() - self._start_time),
+            self.failed_count,
+        )
+        if self.failures or self.finished_count != self.job_count:
+            logm.error("Export failed!")
+        else:
+            logm.info("Export done!")
+
+
 class FreecadExporter:
+    """
+    Renders preview images of FreeCAD documents.
+
+    Jobs can be added before or while the export runs: start() launches the workers in the background, every job added
+    afterwards reaches a worker as soon as one is free, and wait() blocks until all jobs are done. export() is the
+    blocking shortcut for start() followed by wait().
+    """
 
     MODIFICATION_TIME_REQUIRED_DELTA = 2.0
+    XVFB_SERVER_NUM_BASE = 99
+    DEFAULT_XVFB_SERVERS = 1
+    DEFAULT_JOB_TIMEOUT = 300.0
+    DEFAULT_STARTUP_TIMEOUT = 120.0
+    # FreeCAD doesn't free all memory of a closed document. Worker processes are replaced by fresh ones once they exported
+    # this many documents or their resident memory exceeds this size (in bytes), so memory stays bounded for any batch size.
+    DEFAULT_MAX_DOCUMENTS_PER_WORKER = 100
+    DEFAULT_MAX_WORKER_RSS = 1024 * 1024 * 1024
+    # Time a worker waits for further jobs before starting FreeCAD, so that jobs that are added in quick succession share a FreeCAD startup.
+    JOB_COLLECTION_TIME = 0.5
+    # Up to this many pending jobs (e.g. an interactive rerun) the render daemon exports them alone, which is faster than
+    # starting FreeCAD. Larger batches are shared with local workers that run next to the daemon.
+    RENDER_DAEMON_ONLY_JOB_COUNT = 8
 
-    def __init__(self) -> None:
-        self._export_jobs: List[Tuple[Path, Path | None]] = []
+    # Must reflect what the export script renders. Changing a value invalidates all previews recorded in a RenderManifest.
+    RENDER_PARAMETERS: Dict[str, str | int] = {"camera": "orthographic", "width": 1000, "height": 1000, "background": "White"}
 
-    @staticmethod
-    def __is_xvfb_available() -> bool:
-        return which("xvfb-run") is not None
+    # fmt: off
+    def __init__(self,
+                 workers: int | None = None,
+                 render_daemon_socket_path: Path | None = None,
+                 render_manifest: RenderManifest | None = None,
+                 render_cache: RenderCache | None = None,
+                 render_history: RenderHistory | None = None,
+                 export_journal: ExportJournal | None = None,
+                 job_timeout: float | None = DEFAULT_JOB_TIMEOUT,
+                 startup_timeout: float | None = DEFAULT_STARTUP_TIMEOUT,
+                 max_documents_per_worker: int | None = DEFAULT_MAX_DOCUMENTS_PER_WORKER,
+                 max_worker_rss: int | None = DEFAULT_MAX_WORKER_RSS,
+                 xvfb_servers: int = DEFAULT_XVFB_SERVERS,
+                 render_backend: str = RENDER_BACKEND_AUTO,
+                 optimize_previews: bool = True,
+                 fast_previews: bool = False) -> None:
+        # fmt: on
+        if render_backend not in AVAILABLE_RENDER_BACKENDS:
+            raise ValueError(f"Invalid render backend {render_backend}, available: {', '.join(AVAILABLE_RENDER_BACKENDS)}")
+        if workers is not None and workers < 1:
+            raise ValueError(f"Invalid number of workers {workers}, at least one is required")
+        self._render_backend = render_backend
+        self._local_render_backend = RENDER_BACKEND_GUI
+        self._export_jobs: List[ExportJob] = []
+        self._job_timeout = job_timeout
+        self._startup_timeout = startup_timeout
+        self._max_documents_per_worker = max_documents_per_worker
+        self._max_worker_rss = max_worker_rss
+        self._render_manifest = render_manifest
+        self._render_cache = render_cache
+        self._render_history = render_history
+        self._export_journal = export_journal
+        self._optimize_previews = optimize_previews
+        self._fast_previews = fast_previews
+        self._estimated_durations: Dict[ExportJob, float] = {}
+        self._restored_jobs: List[ExportJob] = []
+        self._thumbnail_jobs: List[ExportJob] = []
+        self._resumed_artifacts: Dict[ExportJob, List[Path]] = {}
+        self._input_sha256s: Dict[Path, str] = {}
+        self._output_mtimes_before_export: Dict[Path, int | None] = {}
+        self._workers = workers if workers is not None else get_available_cpu_count()
+        self._render_daemon_socket_path = render_daemon_socket_path if render_daemon_socket_path else get_default_render_daemon_socket_path()
+        # Split the CPUs between the workers, so the llvmpipe threads of parallel renders don't compete
+        self._render_threads = max(1, get_available_cpu_count() // max(1, self._workers))
+        # fmt: off
+        self._xvfb_manager = XvfbManager(
+            server_count=min(xvfb_servers, max(1, self._workers)),
+            render_threads=self._render_threads
+        ) if xvfb_servers > 0 else None
+        # fmt: on
+
+        self._pending_jobs: Deque[ExportJob] = deque()
+        self._active_worker_count = 0
+        self._local_workers_started = False
+        self._worker_threads: List[threading.Thread] = []
+        self._condition = threading.Condition()
+        self._started = False
+        self._workers_launched = False
+        self._closed = False
+        self._aborted = False
+        self._worker_processes: Set[subprocess.Popen] = set()
+        self._render_daemon_connections: Set[socket.socket] = set()
+        self._progress = ExportProgress()
+        self._dirty_check_executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="dirty_check")
+        self._dirty_checks: List[Tuple[ExportJob, Future]] = []
 
     @staticmethod
     def __is_file_dirty(input_file_path: Path, output_file_path: Path) -> bool:
@@ -29,52 +618,806 @@ class FreecadExporter:
         else:
             return True
 
-    def add_export_job(self, input_file_path: Path, output_file_or_dir_path: Path | None = None, force=False) -> None:
-        if output_file_or_dir_path is None or self.__is_file_dirty(input_file_path, output_file_or_dir_path) or force:
-            self._export_jobs.append((input_file_path, output_file_or_dir_path))
+    @staticmethod
+    def __to_file_arg(job: ExportJob) -> str:
+        if job.output_file_or_dir_path:
+            return f"{job.input_file_path}:{job.output_file_or_dir_path}"
+        return str(job.input_file_path)
 
-    def export(self) -> None:
+    @staticmethod
+    def __to_job_requests(jobs: List[ExportJob]) -> List[List[Any]]:
+        """
+        Jobs in the JSON format of the export script's jobs file and render daemon requests.
+        """
+        # fmt: off
+        return [
+            [
+                str(job.input_file_path.absolute()),
+                str(job.output_file_or_dir_path.absolute()) if job.output_file_or_dir_path else None,
+                list(job.views),
+                list(job.sizes),
+                str(job.export_dir_path.absolute()) if job.export_dir_path else None,
+                list(job.export_formats)
+            ]
+            for job in jobs
+        ]
+        # fmt: on
 
-        file_args: List[str] = []
+    @classmethod
+    def __write_jobs_file(cls, jobs: List[ExportJob]) -> Path:
+        # Next to the render daemon socket, which FreeCAD can access even where it runs sandboxed with a private /tmp (snap)
+        runtime_dir_path = create_private_dir(get_runtime_dir_path())
+        jobs_file_fd, jobs_file_name = tempfile.mkstemp(prefix="jobs_", suffix=".json", dir=runtime_dir_path)
+        with os.fdopen(jobs_file_fd, "w", encoding="utf-8") as jobs_file:
+            json.dump({"jobs": cls.__to_job_requests(jobs)}, jobs_file)
+        return Path(jobs_file_name)
 
-        logm.info("Running FreeCAD export script")
+    # fmt: off
+    def add_export_job(self,
+                       input_file_path: Path,
+                       output_file_or_dir_path: Path | None = None,
+                       force=False,
+                       views: List[str] | Tuple[str, ...] = DEFAULT_VIEWS,
+                       sizes: List[int] | Tuple[int, ...] = DEFAULT_PREVIEW_SIZES,
+                       export_dir_path: Path | None = None,
+                       export_formats: List[str] | Tuple[str, ...] = ()) -> None:
+        # fmt: on
+        unknown_views = [view for view in views if view not in AVAILABLE_VIEWS]
+        if unknown_views or not views:
+            raise ValueError(f"Invalid preview views {list(views)} for {input_file_path}, available: {', '.join(AVAILABLE_VIEWS)}")
+        full_size = int(self.RENDER_PARAMETERS["width"])
+        if any(size <= 0 or size >= full_size for size in sizes):
+            raise ValueError(f"Invalid preview sizes {list(sizes)} for {input_file_path}, sizes must be between 1 and {full_size - 1}")
+        unknown_export_formats = [export_format for export_format in export_formats if export_format not in AVAILABLE_EXPORT_FORMATS]
+        if unknown_export_formats:
+            raise ValueError(f"Invalid export formats {list(export_formats)} for {input_file_path}, available: {', '.join(AVAILABLE_EXPORT_FORMATS)}")
+
+        # fmt: off
+        job = ExportJob(
+            input_file_path,
+            output_file_or_dir_path,
+            tuple(views),
+            tuple(sorted(set(sizes))),
+            export_dir_path,
+            tuple(dict.fromkeys(export_formats))
+        )
+        # fmt: on
+        if self._export_journal and self.__resume_job(self._export_journal, job):
+            return
+        if force:
+            self.__queue_job(job)
+        elif self._render_manifest or self._render_cache:
+            # Hashing big documents takes a while, do it concurrently and off the caller's thread
+            self._dirty_checks.append((job, self._dirty_check_executor.submit(self.__queue_job_if_dirty, job)))
+        elif self.__is_job_dirty(job) or self.__is_job_export_dirty(job):
+            self.__queue_job(job)
+
+    def __is_job_dirty(self, job: ExportJob) -> bool:
+        return job.output_file_or_dir_path is None or any(self.__is_file_dirty(job.input_file_path, path) for path in job.preview_output_file_paths().values())
+
+    def __is_job_export_dirty(self, job: ExportJob) -> bool:
+        # Without a render manifest the exported files are only known by their name: <export dir>/<input stem>-<body>.<format>
+        export_dir_path = job.export_dir_path if job.export_dir_path else job.input_file_path.parent
+        for export_format in job.export_formats:
+            artifact_file_paths = [Path(path) for path in glob.glob(str(export_dir_path / f"{glob.escape(job.input_file_path.stem)}-*.{export_format}"))]
+            if not artifact_file_paths or any(self.__is_file_dirty(job.input_file_path, path) for path in artifact_file_paths):
+                return True
+        return False
+
+    def __get_journal_key(self, job: ExportJob) -> str:
+        return f"{get_export_script_version()}:{json.dumps(self.__to_job_requests([job])[0])}"
+
+    def __resume_job(self, export_journal: ExportJournal, job: ExportJob) -> bool:
+        artifact_file_paths = export_journal.get_finished_artifacts(self.__get_journal_key(job), job.input_file_path)
+        if artifact_file_paths is None:
+            return False
+        if not all(path.exists() for path in (*job.preview_output_file_paths().values(), *artifact_file_paths)):
+            return False
+        logm.info("Finished by the interrupted export: %s", self.__to_file_arg(job))
+        with self._condition:
+            self._resumed_artifacts[job] = artifact_file_paths
+        return True
+
+    def __write_thumbnail_previews(self, job: ExportJob) -> bool:
+        # The embedded thumbnail shows the document in a single view, further views need FreeCAD anyway
+        if len(job.views) > 1:
+            return False
+        thumbnail = read_fcstd_thumbnail(job.input_file_path)
+        if thumbnail is None:
+            return False
+        try:
+            # The thumbnail stands in for every size, its previews are provisional: backdated before the document, the
+            # modification time check of the next regular run finds them dirty and renders them properly
+            provisional_mtime = os.path.getmtime(job.input_file_path) - 2 * self.MODIFICATION_TIME_REQUIRED_DELTA
+            for output_file_path in job.preview_output_file_paths().values():
+                output_file_path.parent.mkdir(parents=True, exist_ok=True)
+                # Replaces hardlinks to the render cache instead of writing through them
+                tmp_output_file_path = get_tmp_output_file_path(output_file_path)
+                tmp_output_file_path.write_bytes(thumbnail)
+                os.utime(tmp_output_file_path, (provisional_mtime, provisional_mtime))
+                os.replace(tmp_output_file_path, output_file_path)
+        except OSError as e:
+            logm.warning("Unable to write thumbnail previews of %s (%s) - rendering them", job.input_file_path, e)
+            return False
+        logm.info("Preview from embedded thumbnail: %s", self.__to_file_arg(job))
+        with self._condition:
+            self._thumbnail_jobs.append(job)
+        return True
+
+    def __queue_job(self, job: ExportJob) -> None:
+        if self._fast_previews and self.__write_thumbnail_previews(job):
+            return
+        output_file_paths = job.preview_output_file_paths().values()
+        for output_file_path in output_file_paths:
+            # Outputs restored from the render cache are hardlinks. Break them, FreeCAD would otherwise overwrite the cache entry.
+            if output_file_path.exists() and output_file_path.stat().st_nlink > 1:
+                output_file_path.unlink()
+            # Left behind by a FreeCAD process that got killed while writing the output
+            get_tmp_output_file_path(output_file_path).unlink(missing_ok=True)
+        output_mtimes = {path: path.stat().st_mtime_ns if path.exists() else None for path in output_file_paths}
+        estimated_duration = self.__estimate_job_duration(job)
+        logm.info("Export job: %s (views: %s, sizes: %s)", self.__to_file_arg(job), ", ".join(job.views), ", ".join(str(size) for size in (*job.sizes, "full")))
+        with self._condition:
+            self._export_jobs.append(job)
+            self._output_mtimes_before_export.update(output_mtimes)
+            self._estimated_durations[job] = estimated_duration
+            self._pending_jobs.append(job)
+            self._progress.add_job(job, estimated_duration)
+            self._condition.notify_all()
+        self.__launch_workers()
+
+    def __estimate_job_duration(self, job: ExportJob) -> float:
+        if self._render_history:
+            return self._render_history.estimate(job.input_file_path)
+        try:
+            return RenderHistory.estimate_from_size(job.input_file_path.stat().st_size)
+        except OSError:
+            return RenderHistory.estimate_from_size(0)
+
+    def __compute_input_sha256(self, input_file_path: Path) -> str:
+        input_sha256 = self._input_sha256s.get(input_file_path)
+        if input_sha256 is None:
+            if self._render_manifest:
+                input_sha256 = self._render_manifest.compute_input_sha256(input_file_path)
+            else:
+                input_sha256 = compute_input_fingerprint(input_file_path)
+            self._input_sha256s[input_file_path] = input_sha256
+        return input_sha256
+
+    @staticmethod
+    def __get_output_variant(view: str, size: int | None) -> str:
+        # View and size are part of the fingerprint since they determine what ends up in the output file
+        return f"{get_export_script_version()}:{view}:{size if size is not None else 'full'}"
 
-        for export_job in self._export_jobs:
-            input_file_path = export_job[0]
-            output_file_or_dir_path = export_job[1]
+    @staticmethod
+    def __get_export_variant(job: ExportJob) -> str:
+        return f"{get_export_script_version()}:export:{','.join(job.export_formats)}"
+
+    def __queue_job_if_dirty(self, job: ExportJob) -> None:
+        try:
+            input_sha256 = self.__compute_input_sha256(job.input_file_path)
+        except OSError as e:
+            logm.warning("Unable to fingerprint %s (%s) - exporting it anyway", job.input_file_path, e)
+            self.__queue_job(job)
+            return
+
+        if self._render_manifest:
+            render_manifest = self._render_manifest
+            # fmt: off
+            is_dirty = any(
+                render_manifest.is_dirty(job.input_file_path, output_file_path, render_manifest.fingerprint(input_sha256, self.__get_output_variant(view, size)))
+                for (view, size), output_file_path in job.preview_output_file_paths().items()
+            )
+            is_export_dirty = bool(job.export_formats) and render_manifest.is_export_dirty(
+                job.input_file_path, render_manifest.fingerprint(input_sha256, self.__get_export_variant(job))
+            )
+            # fmt: on
+        else:
+            is_dirty = self.__is_job_dirty(job)
+            is_export_dirty = self.__is_job_export_dirty(job)
+
+        if not is_dirty and not is_export_dirty:
+            return
+        # The cache only holds previews, exports need FreeCAD anyway
+        if not is_export_dirty and self._render_cache and self.__restore_from_render_cache(self._render_cache, job, input_sha256):
+            return
+        self.__queue_job(job)
+
+    def __restore_from_render_cache(self, render_cache: RenderCache, job: ExportJob, input_sha256: str) -> bool:
+        # fmt: off
+        outputs = [
+            (render_cache.key(input_sha256, self.__get_output_variant(view, size)), output_file_path)
+            for (view, size), output_file_path in job.preview_output_file_paths().items()
+        ]
+        # fmt: on
+        try:
+            restored = render_cache.restore(outputs)
+        except OSError as e:
+            logm.warning("Unable to restore %s from render cache (%s)", job.input_file_path, e)
+            return False
+        if restored:
+            logm.info("Restored from render cache: %s", self.__to_file_arg(job))
+            with self._condition:
+                self._restored_jobs.append(job)
+        return restored
+
+    def __is_job_output_rewritten(self, output_file_path: Path) -> bool:
+        return output_file_path.exists() and output_file_path.stat().st_mtime_ns != self._output_mtimes_before_export[output_file_path]
+
+    def __update_render_manifest(self, render_manifest: RenderManifest) -> None:
+        for job in self._export_jobs:
+            for (view, size), output_file_path in job.preview_output_file_paths().items():
+                # Only record previews that were actually (re-)written by this export
+                if self.__is_job_output_rewritten(output_file_path):
+                    input_sha256 = self.__compute_input_sha256(job.input_file_path)
+                    fingerprint = render_manifest.fingerprint(input_sha256, self.__get_output_variant(view, size))
+                    render_manifest.update(job.input_file_path, output_file_path, input_sha256, fingerprint)
+        # Provisional previews from thumbnails, a previous render must not make them look up to date
+        for job in self._thumbnail_jobs:
+            for output_file_path in job.preview_output_file_paths().values():
+                render_manifest.remove(output_file_path)
+        # The interrupted export that finished the resumed jobs didn't get to record them
+        for job in (*self._restored_jobs, *self._resumed_artifacts):
+            input_sha256 = self.__compute_input_sha256(job.input_file_path)
+            for (view, size), output_file_path in job.preview_output_file_paths().items():
+                fingerprint = render_manifest.fingerprint(input_sha256, self.__get_output_variant(view, size))
+                render_manifest.update(job.input_file_path, output_file_path, input_sha256, fingerprint)
+        for job, artifact_file_paths in (*self._progress.artifacts.items(), *self._resumed_artifacts.items()):
+            if not job.export_formats:
+                continue
+            input_sha256 = self.__compute_input_sha256(job.input_file_path)
+            fingerprint = render_manifest.fingerprint(input_sha256, self.__get_export_variant(job))
+            for stale_artifact_file_path in render_manifest.update_export(job.input_file_path, artifact_file_paths, input_sha256, fingerprint):
+                # Exported by an earlier run from a body that no longer exists (or got renamed)
+                logm.info("Removing stale export: %s", stale_artifact_file_path)
+                stale_artifact_file_path.unlink(missing_ok=True)
+        render_manifest.save()
+
+    def __update_render_cache(self, render_cache: RenderCache) -> None:
+        failed_jobs = {failure.job for failure in self._progress.failures}
+        try:
+            for job in (*self._export_jobs, *self._resumed_artifacts):
+                if job in failed_jobs:
+                    continue
+                for (view, size), output_file_path in job.preview_output_file_paths().items():
+                    if job in self._resumed_artifacts or self.__is_job_output_rewritten(output_file_path):
+                        input_sha256 = self.__compute_input_sha256(job.input_file_path)
+                        render_cache.store(render_cache.key(input_sha256, self.__get_output_variant(view, size)), output_file_path)
+            render_cache.evict()
+        except OSError as e:
+            logm.warning("Unable to update render cache %s (%s)", render_cache.cache_dir_path, e)
+
+    def __optimize_rendered_previews(self) -> None:
+        # fmt: off
+        preview_file_paths = [
+            output_file_path
+            for job in self._export_jobs
+            for output_file_path in job.preview_output_file_paths().values()
+            if self.__is_job_output_rewritten(output_file_path)
+        ] + [
+            output_file_path
+            for job in self._resumed_artifacts
+            for output_file_path in job.preview_output_file_paths().values()
+        ]
+        # fmt: on
+        if not preview_file_paths:
+            return
+        optimizer = get_png_optimizer()
+        if optimizer is None:
+            log_png_optimizer_missing()
+            logm.debug("Not optimizing %d preview(s)", len(preview_file_paths))
+            return
+        start_time = time.monotonic()
+        result = optimize_pngs(preview_file_paths, optimizer, self._workers)
+        # fmt: off
+        logm.info(
+            "Optimized %d preview(s) with %s in %s: %s -> %s, saved %s",
+            result.file_count,
+            optimizer,
+            format_duration(time.monotonic() - start_time),
+            format_size(result.original_size),
+            format_size(result.optimized_size),
+            format_size(result.saved_size),
+        )
+        # fmt: on
+
+    def __update_render_history(self, render_history: RenderHistory) -> None:
+        for job, duration in self._progress.durations.items():
+            render_history.record(job.input_file_path, duration)
+        try:
+            render_history.save()
+        except OSError as e:
+            logm.warning("Unable to save render history %s (%s)", render_history.history_file_path, e)
 
-            if output_file_or_dir_path:
-                file_args.append(f"{input_file_path}:{output_file_or_dir_path}")
+    def __close_export_journal(self, export_journal: ExportJournal) -> None:
+        # Kept as long as jobs are left, so a rerun with resume only retries those
+        if self._progress.failures or self._progress.finished_count < self._progress.job_count:
+            export_journal.close()
+            return
+        try:
+            export_journal.remove()
+        except OSError as e:
+            logm.warning("Unable to remove export journal %s (%s)", export_journal.journal_file_path, e)
+
+    def __take_jobs(self, take_all_up_to: int = 0) -> List[ExportJob]:
+        """
+        Block until jobs are available and take this worker's share of them, a share per worker whether busy or idle. A
+        worker that becomes idle while the others are busy thereby leaves them their part of the jobs that came in
+        meanwhile. All of them are taken if there are no more than take_all_up_to. Returns an empty list once all jobs
+        are done.
+        """
+        with self._condition:
+            while True:
+                self._condition.wait_for(lambda: self._pending_jobs or self._closed)
+                # Starting FreeCAD is expensive. Let jobs that are added in quick succession accumulate before taking a share.
+                self._condition.wait_for(lambda: self._closed, timeout=self.JOB_COLLECTION_TIME)
+                if self._pending_jobs:
+                    return self.__take_job_share(1 if len(self._pending_jobs) <= take_all_up_to else self._workers)
+                elif self._closed:
+                    return []
+
+    def __take_job_share(self, share_count: int) -> List[ExportJob]:
+        """
+        Longest processing time first: deal the pending jobs, most expensive first, to whichever of the idle workers' shares
+        has the least estimated work so far and take the share that got the most expensive job. A huge document thereby
+        starts right away instead of holding up the end of the export, and every share ends up with about the same work.
+        """
+        jobs = sorted(self._pending_jobs, key=lambda job: self._estimated_durations.get(job, 0.0), reverse=True)
+        shares: List[Tuple[float, int, List[ExportJob]]] = [(0.0, share_index, []) for share_index in range(max(1, share_count))]
+        for job in jobs:
+            estimated_duration, share_index, share = heapq.heappop(shares)
+            share.append(job)
+            heapq.heappush(shares, (estimated_duration + self._estimated_durations.get(job, 0.0), share_index, share))
+
+        taken_jobs: List[ExportJob] = []
+        self._pending_jobs = deque()
+        for _, share_index, share in shares:
+            if share_index == 0:
+                taken_jobs = share
             else:
-                file_args.append(str(input_file_path))
+                self._pending_jobs.extend(share)
+        return taken_jobs
+
+    def __return_jobs(self, jobs: List[ExportJob]) -> None:
+        with self._condition:
+            self._pending_jobs.extendleft(reversed(jobs))
+            self._condition.notify_all()
+
+    def __start_worker_thread(self, target: Callable[..., None], *args: Any) -> None:
+        worker_thread = threading.Thread(target=target, args=args, daemon=True)
+        with self._condition:
+            self._active_worker_count += 1
+            self._worker_threads.append(worker_thread)
+        worker_thread.start()
+
+    def __run_render_daemon_worker(self) -> None:
+        connect_timeout = 0.0
+        while jobs := self.__take_jobs(0 if self._local_workers_started else self.RENDER_DAEMON_ONLY_JOB_COUNT):
+            with self._condition:
+                more_jobs_pending = bool(self._pending_jobs)
+            if more_jobs_pending:
+                # More than the daemon can export faster than FreeCAD starts, local workers take the rest
+                self.__start_local_workers()
+            remaining_jobs, recycled = self.__export_with_render_daemon(jobs, self._progress, connect_timeout)
+            if self._aborted:
+                return
+            if remaining_jobs is None:
+                logm.warning("Render daemon no longer reachable")
+                remaining_jobs = jobs
+            if recycled:
+                # The daemon restarts FreeCAD to free its memory, waiting for that is still cheaper than starting local workers
+                self.__return_jobs(remaining_jobs)
+                connect_timeout = self._startup_timeout or self.DEFAULT_STARTUP_TIMEOUT
+                continue
+            connect_timeout = 0.0
+            if remaining_jobs:
+                # The daemon is gone or stuck. Hand everything that's left to local workers.
+                self.__return_jobs(remaining_jobs)
+                break
+        with self._condition:
+            self._active_worker_count -= 1
+        if jobs:
+            self.__start_local_workers()
 
-        if file_args:
-            logm.info("Export jobs:")
-            for file_arg in file_args:
-                logm.info("- %s", file_arg)
+    def __run_worker(self, worker_index: int) -> None:
+        while jobs := self.__take_jobs():
+            self.__run_worker_jobs(worker_index, jobs, self._progress)
 
-            args: List[str] = []
+    def __is_render_daemon_available(self) -> bool:
+        try:
+            check_private_dir(self._render_daemon_socket_path.parent)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logm.warning("Not using render daemon (%s)", e)
+            return False
+        return is_render_daemon_running(self._render_daemon_socket_path)
 
-            if self.__is_xvfb_available():
+    def __start_xvfb_servers(self) -> bool:
+        if self._xvfb_manager is None or not XvfbManager.is_available():
+            return False
+        try:
+            displays = self._xvfb_manager.start()
+        except XvfbStartupError as e:
+            logm.warning("%s - falling back to xvfb-run", e)
+            return False
+        logm.info("Xvfb available - visual output will be redirected and hidden through Xvfb display(s) %s.", ", ".join(displays))
+        return True
+
+    def __start_local_workers(self) -> None:
+        with self._condition:
+            if self._local_workers_started:
+                return
+            self._local_workers_started = True
+        self._local_render_backend = select_render_backend(self._render_backend)
+        if self._local_render_backend == RENDER_BACKEND_OFFSCREEN:
+            logm.info("Offscreen render backend - rendering without FreeCAD GUI and X server.")
+        elif not self.__start_xvfb_servers():
+            if which("xvfb-run") is not None:
                 logm.info("xvfb available - visual output will be redirected and hidden through xvfb.")
-                args.append("xvfb-run")
-                args.append("-a")
             else:
                 logm.info("xvfb NOT available - unable to hide visual output.")
 
-            args.append("freecad")
-            args.append(str(FILE_DIR / "resources/scripts/freecad_export_image_script.py"))
-            args.append("--pass")
-            args.extend(file_args)
+        logm.info("Exporting with up to %d FreeCAD worker(s)", self._workers)
+        self._progress.worker_count = self._workers
+        for worker_index in range(self._workers):
+            self.__start_worker_thread(self.__run_worker, worker_index)
 
-            logm.debug("FreeCAD command: %s", " ".join(args))
-            completed_process = subprocess.run(args, capture_output=True)
+    def __connect_render_daemon(self, timeout: float) -> socket.socket | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             try:
-                for line in completed_process.stdout.decode("utf-8").splitlines():
-                    logm.debug(line)
-                logm.info("Export done!")
-            except subprocess.CalledProcessError as e:
-                logm.error("Export failed!")
-                logm.exception(e)
+                client.connect(str(self._render_daemon_socket_path))
+                return client
+            except OSError:
+                client.close()
+            if time.monotonic() >= deadline or self._aborted:
+                return None
+            time.sleep(0.1)
+
+    def __export_with_render_daemon(self, jobs: List[ExportJob], progress: ExportProgress, connect_timeout: float) -> Tuple[List[ExportJob] | None, bool]:
+        """
+        Send the jobs to the render daemon, waiting up to connect_timeout seconds for it to accept the connection.
+        Returns None if no daemon is reachable, otherwise the jobs the daemon did not finish (e.g. because it hung or
+        died) so they can be retried on local workers. The flag tells whether the daemon announced its restart instead,
+        the remaining jobs are then for the restarted daemon.
+        """
+        client = self.__connect_render_daemon(connect_timeout)
+        if client is None:
+            return None, False
+
+        with self._condition:
+            self._render_daemon_connections.add(client)
+        logm.info("Sending %d export job(s) to render daemon", len(jobs))
+        request = self.__to_job_requests(jobs)
+
+        finished_job_count = 0
+        started_job_index: int | None = None
+        recycled = False
+        with client, client.makefile("rw", encoding="utf-8") as stream:
+            stream.write(json.dumps({"jobs": request}) + "\n")
+            stream.flush()
+            client.settimeout(self._job_timeout)
+
+            try:
+                for line in stream:
+                    event = json.loads(line)
+                    if event["event"] == "finished":
+                        return jobs[finished_job_count:], recycled
+                    if event["event"] == "recycled":
+                        logm.info("Render daemon restarts after %d document(s) to free its memory", event["documents"])
+                        recycled = True
+                        continue
+                    self.__handle_event("daemon", event, jobs[event["job"]], progress)
+                    if event["event"] == "started":
+                        started_job_index = event["job"]
+                    else:
+                        started_job_index = None
+                        finished_job_count += 1
+                failure_reason, failure_detail = ExportFailure.REASON_CRASHED, "Render daemon closed the connection unexpectedly"
+            except TimeoutError:
+                failure_reason, failure_detail = ExportFailure.REASON_TIMEOUT, f"No progress from render daemon within {self._job_timeout}s"
+            finally:
+                with self._condition:
+                    self._render_daemon_connections.discard(client)
+        if self._aborted:
+            return jobs[finished_job_count:], False
+
+        if started_job_index is not None:
+            progress.add_failure("daemon", ExportFailure(jobs[started_job_index], failure_reason, failure_detail))
+            finished_job_count += 1
+        remaining_jobs = jobs[finished_job_count:]
+        logm.warning("Render daemon failed (%s) - exporting %d remaining job(s) with local workers", failure_detail, len(remaining_jobs))
+        return remaining_jobs, False
+
+    def __handle_event(self, worker_name: str, event: Dict[str, Any], job: ExportJob, progress: ExportProgress) -> None:
+        progress.handle_event(worker_name, event, job)
+        if event["event"] == "rendered" and self._export_journal:
+            # The outputs are complete once reported, the script renames them into place only after writing them
+            self._export_journal.record(self.__get_journal_key(job), job.input_file_path, [Path(artifact) for artifact in event.get("artifacts", [])])
+
+    @staticmethod
+    def __read_lines(stream: IO[str], lines: "queue.Queue[str | None]") -> None:
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+
+    @staticmethod
+    def __kill_process_group(process: subprocess.Popen) -> None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def __run_worker_process(self, worker_index: int, jobs: List[ExportJob], progress: ExportProgress) -> Tuple[int, int | None, str, str]:
+        """
+        Run one FreeCAD process on the jobs and supervise it. A process that shows no progress within the timeouts is killed.
+
+        Returns the number of finished jobs, the index of the job that was in progress when the process died (if any) and
+        the failure reason and detail. A process that got recycled returns no failure reason but fewer finished jobs.
+        """
+        # The jobs go through a file instead of the command line: no ARG_MAX limit and no quoting issues with paths
+        try:
+            jobs_file_path = self.__write_jobs_file(jobs)
+        except OSError as e:
+            return 0, None, ExportFailure.REASON_STARTUP_FAILED, f"Unable to write jobs file: {e}"
+        try:
+            return self.__supervise_worker_process(worker_index, jobs, [*get_recycle_args(self._max_documents_per_worker, self._max_worker_rss), f"--jobs-file={jobs_file_path}"], progress)
+        finally:
+            jobs_file_path.unlink(missing_ok=True)
+
+    # fmt: off
+    def __supervise_worker_process(self,
+                                   worker_index: int,
+                                   jobs: List[ExportJob],
+                                   script_args: List[str],
+                                   progress: ExportProgress) -> Tuple[int, int | None, str, str]:
+        # fmt: on
+        env: Dict[str, str] | None = None
+        if self._local_render_backend == RENDER_BACKEND_OFFSCREEN:
+            env = {**os.environ, **get_software_gl_environment(self._render_threads)}
+            args = create_freecad_command(script_args, render_backend=RENDER_BACKEND_OFFSCREEN)
+        elif self._xvfb_manager and self._xvfb_manager.displays:
+            # Workers share the managed Xvfb servers round-robin
+            displays = self._xvfb_manager.displays
+            env = {**os.environ, **self._xvfb_manager.get_environment(displays[worker_index % len(displays)])}
+            args = create_freecad_command(script_args, xvfb_run=False)
+        else:
+            # Every worker gets its own X server. Distinct start numbers keep parallel xvfb-run calls from racing for the same display.
+            args = create_freecad_command(script_args, xvfb_server_num=self.XVFB_SERVER_NUM_BASE + worker_index)
+        logm.debug("FreeCAD command (worker %d): %s", worker_index, " ".join(args))
+        worker_name = f"worker {worker_index}"
+
+        finished_job_count = 0
+        started_job_index: int | None = None
+        failure_reason, failure_detail = "", ""
+        recycle_detail = ""
+
+        try:
+            # A new session lets us kill FreeCAD together with xvfb-run and Xvfb
+            # fmt: off
+            process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                encoding="utf-8",
+                errors="replace",
+                env=env,
+                start_new_session=True
+            )
+            # fmt: on
+        except OSError as e:
+            return finished_job_count, started_job_index, ExportFailure.REASON_STARTUP_FAILED, f"Unable to start FreeCAD: {e}"
+        with self._condition:
+            self._worker_processes.add(process)
+            aborted = self._aborted
+        if aborted:
+            # Started while abort() killed the other workers
+            self.__kill_process_group(process)
+
+        with process:
+            assert process.stdout
+            lines: queue.Queue[str | None] = queue.Queue()
+            reader_thread = threading.Thread(target=self.__read_lines, args=(process.stdout, lines), daemon=True)
+            reader_thread.start()
+
+            timeout = self._startup_timeout
+            while True:
+                try:
+                    line = lines.get(timeout=timeout)
+                except queue.Empty:
+                    failure_reason, failure_detail = ExportFailure.REASON_TIMEOUT, f"No progress within {timeout}s"
+                    self.__kill_process_group(process)
+                    break
+
+                if line is None:
+                    break
+
+                event = parse_job_event(line)
+                if event is None:
+                    logm.debug("[%s] %s", worker_name, line.rstrip())
+                    continue
+                if event["event"] == "recycled":
+                    rss = f", {format_size(event['rss'])} resident" if event.get("rss") is not None else ""
+                    recycle_detail = f"Recycling after {event['documents']} document(s){rss}"
+                    continue
+
+                self.__handle_event(worker_name, event, jobs[event["job"]], progress)
+                if event["event"] == "started":
+                    started_job_index = event["job"]
+                else:
+                    started_job_index = None
+                    finished_job_count += 1
+                timeout = self._job_timeout
+
+            returncode = process.wait()
+            reader_thread.join()
+        with self._condition:
+            self._worker_processes.discard(process)
+
+        if not failure_reason and finished_job_count < len(jobs) and recycle_detail:
+            # Stopped on purpose to free its memory, the remaining jobs go to a fresh process
+            failure_detail = recycle_detail
+        elif not failure_reason and finished_job_count < len(jobs):
+            failure_reason, failure_detail = ExportFailure.REASON_CRASHED, f"FreeCAD exited with return code {returncode}"
+        elif returncode != 0 and not failure_reason:
+            logm.warning("FreeCAD %s exited with return code %d", worker_name, returncode)
+
+        return finished_job_count, started_job_index, failure_reason, failure_detail
+
+    def __run_worker_jobs(self, worker_index: int, jobs: List[ExportJob], progress: ExportProgress) -> None:
+        worker_name = f"worker {worker_index}"
+        pending_jobs = jobs
+
+        while pending_jobs:
+            finished_job_count, started_job_index, failure_reason, failure_detail = self.__run_worker_process(worker_index, pending_jobs, progress)
+            if self._aborted:
+                # Killed by abort(), neither a failure of the job nor a reason to respawn
+                return
+
+            if started_job_index is not None:
+                # The job in progress is the culprit. Report it and resume with the remaining jobs on a new worker process.
+                progress.add_failure(worker_name, ExportFailure(pending_jobs[started_job_index], failure_reason, failure_detail))
+                pending_jobs = pending_jobs[started_job_index + 1 :]
+            elif finished_job_count == 0:
+                # Not a single job got started, respawning would fail the same way
+                for job in pending_jobs:
+                    progress.add_failure(worker_name, ExportFailure(job, ExportFailure.REASON_STARTUP_FAILED, failure_detail))
+                return
+            else:
+                pending_jobs = pending_jobs[finished_job_count:]
+
+            if pending_jobs and failure_reason:
+                logm.warning("[%s] %s - respawning worker for %d remaining job(s)", worker_name, failure_detail, len(pending_jobs))
+            elif pending_jobs:
+                logm.info("[%s] %s - %d remaining job(s) continue on a fresh worker process", worker_name, failure_detail, len(pending_jobs))
+
+    def start(self) -> None:
+        """
+        Start exporting in the background. Jobs added from now on are picked up by the workers as they come in.
+        """
+        if self._started:
+            return
+        self._started = True
+        self._progress.start()
+        with self._condition:
+            has_pending_jobs = bool(self._pending_jobs)
+        if has_pending_jobs:
+            self.__launch_workers()
+
+    def __launch_workers(self) -> None:
+        # Deferred until the first job needs FreeCAD. A run without dirty documents neither probes FreeCAD nor starts Xvfb.
+        with self._condition:
+            if not self._started or self._workers_launched:
+                return
+            self._workers_launched = True
+
+        logm.info("Running FreeCAD export script")
+
+        if self.__is_render_daemon_available():
+            logm.info("Render daemon available (%s)", self._render_daemon_socket_path)
+            self.__start_worker_thread(self.__run_render_daemon_worker)
+        else:
+            self.__start_local_workers()
+
+    def wait(self) -> List[ExportFailure]:
+        """
+        Wait until all added jobs are exported and return the jobs that failed, timed out or crashed their worker.
+        """
+        self.start()
+        self._dirty_check_executor.shutdown(wait=True)
+        for job, dirty_check in self._dirty_checks:
+            dirty_check_error = dirty_check.exception()
+            if dirty_check_error is not None:
+                # The job was neither queued nor found up to date
+                self._progress.add_job(job, 0.0)
+                self._progress.add_failure("dirty check", ExportFailure(job, ExportFailure.REASON_FAILED, f"Dirty check failed: {dirty_check_error!r}"))
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._progress.log_estimate()
+
+        # Workers may spawn further workers (render daemon fallback), so join until none are left
+        while True:
+            with self._condition:
+                if not self._worker_threads:
+                    break
+                worker_thread = self._worker_threads.pop()
+            worker_thread.join()
+
+        if self._restored_jobs:
+            logm.info("Restored %d job(s) from render cache", len(self._restored_jobs))
+        if self._resumed_artifacts:
+            logm.info("Skipped %d job(s) finished by the interrupted export", len(self._resumed_artifacts))
+        if self._thumbnail_jobs:
+            logm.info("Wrote previews of %d job(s) from embedded thumbnails", len(self._thumbnail_jobs))
+            skipped_export_count = sum(1 for job in self._thumbnail_jobs if job.export_formats)
+            if skipped_export_count:
+                logm.info("Skipped 3D exports of %d job(s) in fast preview mode, a full run exports them", skipped_export_count)
+
+        if self._export_jobs:
+            self._progress.log_summary()
         else:
             logm.info("No FreeCAD export jobs available.")
+
+        # Before the cache update, so the cache holds the optimized previews as well
+        if self._optimize_previews and (self._export_jobs or self._resumed_artifacts):
+            self.__optimize_rendered_previews()
+        if self._render_cache and (self._export_jobs or self._resumed_artifacts):
+            self.__update_render_cache(self._render_cache)
+        if self._render_manifest and (self._export_jobs or self._restored_jobs or self._resumed_artifacts or self._thumbnail_jobs):
+            self.__update_render_manifest(self._render_manifest)
+        if self._render_history and self._progress.durations:
+            self.__update_render_history(self._render_history)
+        if self._export_journal:
+            self.__close_export_journal(self._export_journal)
+
+        return self._progress.failures
+
+    def abort(self) -> None:
+        """
+        Stop the export right away, e.g. on Ctrl-C: kill the FreeCAD workers (with their xvfb-run and Xvfb), disconnect from
+        the render daemon, drop the queued jobs and pending dirty checks and close the export journal. The jobs finished so far stay in the journal, so a run
+        with resume continues where this one stopped. Neither the manifest nor the render cache or history are updated.
+        """
+        with self._condition:
+            self._aborted = True
+            self._closed = True
+            self._pending_jobs.clear()
+            worker_processes = list(self._worker_processes)
+            render_daemon_connections = list(self._render_daemon_connections)
+            self._condition.notify_all()
+        self._dirty_check_executor.shutdown(wait=False, cancel_futures=True)
+        for client in render_daemon_connections:
+            # The daemon stops the request once it can't send its next event
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for process in worker_processes:
+            self.__kill_process_group(process)
+        if worker_processes:
+            logm.info("Export aborted, killed %d FreeCAD worker(s)", len(worker_processes))
+        if self._export_journal:
+            self._export_journal.close()
+
+    def get_exported_artifacts(self) -> List[Path]:
+        """
+        Files (STL, STEP) exported by the last export, in addition to the previews.
+        """
+        # fmt: off
+        return [
+            artifact_file_path
+            for artifact_file_paths in (*self._progress.artifacts.values(), *self._resumed_artifacts.values())
+            for artifact_file_path in artifact_file_paths
+        ]
+        # fmt: on
+
+    def export(self) -> List[ExportFailure]:
+        """
+        Run all queued export jobs and return the jobs that failed, timed out or crashed their worker.
+        """
+        self.start()
+        return self.wait()
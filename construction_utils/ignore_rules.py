@@ -0,0 +1,50 @@
+# Copyright (C) 2024 twyleg
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+from pathspec import GitIgnoreSpec
+
+
+logm = logging.getLogger(__name__)
+
+
+class IgnoreRules:
+    """
+    Patterns of the .gitignore and .constructionignore files met while walking a workspace, with the semantics of git:
+    the patterns of a file apply to its dir and everything below. Patterns of deeper files take precedence, within a dir
+    the ones of .constructionignore. Immutable, every dir extends the rules of its parent.
+    """
+
+    IGNORE_FILE_NAMES = (".gitignore", ".constructionignore")
+
+    def __init__(self, specs: Tuple[Tuple[str, GitIgnoreSpec], ...] = ()) -> None:
+        self._specs = specs
+
+    def extend(self, dir_path: Path, relative_dir_path: str, file_names: List[str]) -> "IgnoreRules":
+        """
+        Rules for the dir, with the patterns of its ignore files (if any of them is among its file names) added.
+        """
+        lines: List[str] = []
+        for ignore_file_name in self.IGNORE_FILE_NAMES:
+            if ignore_file_name not in file_names:
+                continue
+            try:
+                lines.extend((dir_path / ignore_file_name).read_text(encoding="utf-8", errors="replace").splitlines())
+            except OSError as e:
+                logm.warning("Unable to read ignore file %s (%s)", dir_path / ignore_file_name, e)
+        if not lines:
+            return self
+        return IgnoreRules(self._specs + ((relative_dir_path, GitIgnoreSpec.from_lines(lines)),))
+
+    def is_ignored_dir(self, relative_dir_path: str) -> bool:
+        """
+        Whether the dir (path relative to the workspace dir, "/" separated) is ignored. Its parents are not checked, dirs
+        are only looked at if their parent was not ignored.
+        """
+        for spec_relative_dir_path, spec in reversed(self._specs):
+            path = relative_dir_path[len(spec_relative_dir_path) + 1 :] if spec_relative_dir_path else relative_dir_path
+            result = spec.check_file(f"{path}/")
+            if result.include is not None:
+                return bool(result.include)
+        return False
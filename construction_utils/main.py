@@ -1,16 +1,52 @@
 # Copyright (C) 2024 twyleg
 import argparse
+import logging
+import sys
 
 from pathlib import Path
 from simple_python_app.subcommand_application import SubcommandApplication
 
 from construction_utils import __version__
-from construction_utils.readme_generator import generate_readmes_for_workspace
+from construction_utils.readme_generator import Workspace, generate_readmes_for_workspace
 from construction_utils.project_creator import create_project
+from construction_utils.freecad_exporter import (
+    AVAILABLE_RENDER_BACKENDS,
+    RENDER_BACKEND_AUTO,
+    FreecadExporter,
+    run_render_daemon,
+    stop_render_daemon,
+    get_default_render_daemon_socket_path,
+)
+from construction_utils.render_cache import RenderCache, get_default_render_cache_dir_path
+from construction_utils.xvfb_manager import XvfbManager, XvfbStartupError
 
 
 FILE_DIR = Path(__file__).parent
 
+logm = logging.getLogger(__name__)
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a non-negative integer")
+    return number
+
+
+def positive_float(value: str) -> float:
+    number = float(value)
+    # Also rejects nan and inf
+    if not 0.0 < number < float("inf"):
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
 
 class Application(SubcommandApplication):
 
@@ -32,6 +68,93 @@ class Application(SubcommandApplication):
             description="Generate documentation (READMEs) for for this workspace.",
             handler=self.handle_generate_docs
         )
+        generate_docs_command.parser.add_argument(
+            "-j",
+            "--workers",
+            type=positive_int,
+            default=None,
+            help="Number of parallel FreeCAD workers (default: number of available CPUs)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--render-daemon-socket",
+            type=Path,
+            default=get_default_render_daemon_socket_path(),
+            help="Socket of a running render daemon that is used instead of spawning FreeCAD (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--job-timeout",
+            type=positive_float,
+            default=FreecadExporter.DEFAULT_JOB_TIMEOUT,
+            help="Seconds a single document may take before its FreeCAD worker is killed and respawned (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--worker-max-documents",
+            type=non_negative_int,
+            default=FreecadExporter.DEFAULT_MAX_DOCUMENTS_PER_WORKER,
+            help="Documents a FreeCAD worker exports before it is replaced by a fresh process to free its memory, 0 for no limit (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--worker-max-rss",
+            type=non_negative_int,
+            default=FreecadExporter.DEFAULT_MAX_WORKER_RSS // (1024 * 1024),
+            help="Resident memory in MiB above which a FreeCAD worker is replaced by a fresh process after its current document, 0 for no limit (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--render-cache-dir",
+            type=Path,
+            default=get_default_render_cache_dir_path(),
+            help="User-level cache of rendered previews shared by all workspaces (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--render-cache-size",
+            type=positive_int,
+            default=RenderCache.DEFAULT_MAX_SIZE // (1024 * 1024),
+            help="Size cap of the render cache in MiB, least recently used previews are evicted first (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--no-render-cache",
+            action="store_true",
+            help="Neither use nor populate the render cache",
+        )
+        generate_docs_command.parser.add_argument(
+            "--xvfb-servers",
+            type=non_negative_int,
+            default=FreecadExporter.DEFAULT_XVFB_SERVERS,
+            help="Number of shared Xvfb servers the FreeCAD workers render on, 0 starts one through xvfb-run per worker process (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--render-backend",
+            choices=AVAILABLE_RENDER_BACKENDS,
+            default=RENDER_BACKEND_AUTO,
+            help="FreeCAD backend used by the local workers, auto prefers offscreen rendering without GUI and X server if it works (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--no-preview-optimization",
+            action="store_true",
+            help="Keep rendered previews as written by FreeCAD instead of re-encoding them losslessly to smaller PNGs with oxipng or Pillow",
+        )
+        generate_docs_command.parser.add_argument(
+            "--fast-previews",
+            action="store_true",
+            help="Use the thumbnail FreeCAD embeds in saved documents as preview instead of rendering, FreeCAD only renders documents without one (and exports nothing for the others)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip the export jobs an interrupted previous run already finished (recorded in .construction_utils/export_journal.jsonl)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--scan-concurrency",
+            type=positive_int,
+            default=Workspace.DEFAULT_SCAN_CONCURRENCY,
+            help="Constructions scanned at once, raise it for workspaces on network file systems, 1 scans sequentially (default: %(default)s)",
+        )
+        generate_docs_command.parser.add_argument(
+            "--workspace-index",
+            action="store_true",
+            help="Only list the dirs that changed since the last run (recorded in .construction_utils/index.sqlite), for workspaces on network file systems",
+        )
+
         create_project_command = self.add_subcommand(
             command="create_project",
             help="Create a new project with default file structure.",
@@ -44,10 +167,107 @@ class Application(SubcommandApplication):
             type=str,
             help="Name of the project",
         )
+
+        render_daemon_command = self.add_subcommand(
+            command="render_daemon",
+            help="Run a persistent FreeCAD render daemon that generate_docs uses when available.",
+            description="Run a persistent FreeCAD render daemon that generate_docs uses when available.",
+            handler=self.handle_render_daemon
+        )
+        render_daemon_command.parser.add_argument(
+            "--socket",
+            type=Path,
+            default=get_default_render_daemon_socket_path(),
+            help="Unix socket to listen on (default: %(default)s)",
+        )
+        render_daemon_command.parser.add_argument(
+            "--stop",
+            action="store_true",
+            help="Stop a running render daemon",
+        )
+        render_daemon_command.parser.add_argument(
+            "--render-backend",
+            choices=AVAILABLE_RENDER_BACKENDS,
+            default=RENDER_BACKEND_AUTO,
+            help="FreeCAD backend of the daemon (default: %(default)s)",
+        )
+        render_daemon_command.parser.add_argument(
+            "--max-documents",
+            type=non_negative_int,
+            default=FreecadExporter.DEFAULT_MAX_DOCUMENTS_PER_WORKER,
+            help="Documents the daemon exports before FreeCAD is restarted to free its memory, 0 for no limit (default: %(default)s)",
+        )
+        render_daemon_command.parser.add_argument(
+            "--max-rss",
+            type=non_negative_int,
+            default=FreecadExporter.DEFAULT_MAX_WORKER_RSS // (1024 * 1024),
+            help="Resident memory in MiB above which FreeCAD is restarted after the current document, 0 for no limit (default: %(default)s)",
+        )
+
+        xvfb_command = self.add_subcommand(
+            command="xvfb",
+            help="Start or stop the shared Xvfb servers that are kept running between generate_docs runs.",
+            description="Start or stop the shared Xvfb servers that are kept running between generate_docs runs.",
+            handler=self.handle_xvfb
+        )
+        xvfb_command.parser.add_argument(
+            "--servers",
+            type=positive_int,
+            default=FreecadExporter.DEFAULT_XVFB_SERVERS,
+            help="Number of servers to start (default: %(default)s)",
+        )
+        xvfb_command.parser.add_argument(
+            "--stop",
+            action="store_true",
+            help="Stop all running servers",
+        )
         # fmt: on
 
     def handle_generate_docs(self, args: argparse.Namespace) -> int:
-        generate_readmes_for_workspace(Path.cwd())
+        # fmt: off
+        export_failures = generate_readmes_for_workspace(
+            Path.cwd(),
+            workers=args.workers,
+            render_daemon_socket_path=args.render_daemon_socket,
+            job_timeout=args.job_timeout,
+            max_documents_per_worker=args.worker_max_documents if args.worker_max_documents > 0 else None,
+            max_worker_rss=args.worker_max_rss * 1024 * 1024 if args.worker_max_rss > 0 else None,
+            render_cache_enabled=not args.no_render_cache,
+            render_cache_dir_path=args.render_cache_dir,
+            render_cache_max_size=args.render_cache_size * 1024 * 1024,
+            xvfb_servers=args.xvfb_servers,
+            render_backend=args.render_backend,
+            preview_optimization_enabled=not args.no_preview_optimization,
+            resume=args.resume,
+            fast_previews=args.fast_previews,
+            scan_concurrency=args.scan_concurrency,
+            workspace_index_enabled=args.workspace_index
+        )
+        # fmt: on
+        return 1 if export_failures else 0
+
+    def handle_render_daemon(self, args: argparse.Namespace) -> int:
+        if args.stop:
+            return 0 if stop_render_daemon(args.socket) else 1
+        # fmt: off
+        return run_render_daemon(
+            args.socket,
+            render_backend=args.render_backend,
+            max_documents=args.max_documents if args.max_documents > 0 else None,
+            max_rss=args.max_rss * 1024 * 1024 if args.max_rss > 0 else None
+        )
+        # fmt: on
+
+    def handle_xvfb(self, args: argparse.Namespace) -> int:
+        xvfb_manager = XvfbManager(server_count=args.servers)
+        if args.stop:
+            xvfb_manager.stop()
+            return 0
+        try:
+            print("\n".join(xvfb_manager.start()))
+        except XvfbStartupError as e:
+            logm.error("%s", e)
+            return 1
         return 0
 
     def handle_create_project(self, args: argparse.Namespace) -> int:
@@ -57,7 +277,7 @@ class Application(SubcommandApplication):
 
 def main() -> None:
     application = Application()
-    application.start()
+    sys.exit(application.start())
 
 
 if __name__ == "__main__":
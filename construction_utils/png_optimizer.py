@@ -0,0 +1,130 @@
+# Copyright (C) 2024 twyleg
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+try:
+    from PIL import Image  # type: ignore
+except ImportError:
+    Image = None  # type: ignore
+
+
+logm = logging.getLogger(__name__)
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+OPTIMIZER_OXIPNG = "oxipng"
+OPTIMIZER_PILLOW = "pillow"
+
+# The previews are optimized once and then stay in the repository, so spend the effort on the highest level. oxipng tries
+# all color type, bit depth and palette reductions on every level.
+OXIPNG_ARGS = ["--opt", "6", "--strip", "safe", "--quiet"]
+
+PALETTE_MAX_COLORS = 256
+
+
+class OptimizationResult(NamedTuple):
+    file_count: int
+    original_size: int
+    optimized_size: int
+
+    @property
+    def saved_size(self) -> int:
+        return self.original_size - self.optimized_size
+
+
+def get_png_optimizer() -> str | None:
+    """
+    oxipng if it is on the PATH, otherwise Pillow if it is installed (pip install construction_utils[optimize]), None if
+    neither is available.
+    """
+    if shutil.which("oxipng"):
+        return OPTIMIZER_OXIPNG
+    if Image is not None:
+        return OPTIMIZER_PILLOW
+    return None
+
+
+def _to_palette_image(image: "Image.Image") -> "Image.Image | None":
+    """
+    Lossless palette version of an RGB(A) image with at most 256 colors, None if the image has more colors. Unlike
+    Image.quantize() every color keeps its exact value, alpha goes to the tRNS chunk.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        return None
+    colors = image.getcolors(PALETTE_MAX_COLORS)
+    if colors is None:
+        return None
+    palette_indices = {bytes(color): palette_index for palette_index, (_, color) in enumerate(colors)}
+    pixels = image.tobytes()
+    pixel_size = len(image.mode)
+    palette_image = Image.frombytes(
+        "P", image.size, bytes(palette_indices[pixels[offset : offset + pixel_size]] for offset in range(0, len(pixels), pixel_size))
+    )
+    palette_image.putpalette(b"".join(bytes(color[:3]) for _, color in colors))
+    if image.mode == "RGBA":
+        palette_image.info["transparency"] = bytes(color[3] for _, color in colors)
+    return palette_image
+
+
+def _write_optimized_png(file_path: Path, tmp_file_path: Path, optimizer: str) -> None:
+    if optimizer == OPTIMIZER_OXIPNG:
+        subprocess.run(["oxipng", *OXIPNG_ARGS, "--out", str(tmp_file_path), str(file_path)], check=True, stdin=subprocess.DEVNULL)
+        return
+    # Pillow keeps the color type, palette, transparency and ICC profile, optimize=True picks the best compression
+    with Image.open(file_path) as image:
+        image.save(tmp_file_path, "PNG", optimize=True)
+        palette_image = _to_palette_image(image)
+        if palette_image is None:
+            return
+        palette_tmp_file_path = tmp_file_path.with_name(f"{tmp_file_path.name}.palette")
+        try:
+            palette_image.save(palette_tmp_file_path, "PNG", optimize=True, icc_profile=image.info.get("icc_profile"))
+            if palette_tmp_file_path.stat().st_size < tmp_file_path.stat().st_size:
+                os.replace(palette_tmp_file_path, tmp_file_path)
+        finally:
+            palette_tmp_file_path.unlink(missing_ok=True)
+
+
+def optimize_png(file_path: Path, optimizer: str) -> Tuple[int, int]:
+    """
+    Losslessly re-encode the PNG in place if that makes it smaller. Returns the file size before and after.
+    """
+    original_size = file_path.stat().st_size
+    tmp_file_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    try:
+        _write_optimized_png(file_path, tmp_file_path, optimizer)
+        # oxipng doesn't write the output if it can't improve the file
+        if not tmp_file_path.exists() or tmp_file_path.stat().st_size >= original_size:
+            return original_size, original_size
+        shutil.copymode(file_path, tmp_file_path)
+        os.replace(tmp_file_path, file_path)
+        return original_size, file_path.stat().st_size
+    finally:
+        tmp_file_path.unlink(missing_ok=True)
+
+
+def _optimize_png_safe(file_path: Path, optimizer: str) -> Tuple[int, int]:
+    # Pillow reports broken PNGs as OSError, ValueError or SyntaxError
+    try:
+        return optimize_png(file_path, optimizer)
+    except (OSError, ValueError, SyntaxError, subprocess.CalledProcessError) as e:
+        logm.warning("Unable to optimize %s (%s)", file_path, e)
+        return 0, 0
+
+
+def optimize_pngs(file_paths: List[Path], optimizer: str, workers: int | None = None) -> OptimizationResult:
+    """
+    Optimize the PNGs in a thread pool. oxipng runs as subprocess and Pillow compresses without holding the GIL, so
+    threads run in parallel.
+    """
+    if not file_paths:
+        return OptimizationResult(0, 0, 0)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(lambda file_path: _optimize_png_safe(file_path, optimizer), file_paths))
+    return OptimizationResult(len(file_paths), sum(original for original, _ in sizes), sum(optimized for _, optimized in sizes))
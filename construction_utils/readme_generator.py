@@ -1,14 +1,32 @@
 # Copyright (C) 2024 twyleg
 import json
 import logging
+import os
 import shutil
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property
 from pathlib import Path
-from glob import glob
-from typing import List, Dict, Any, Tuple
-from os import listdir
+from typing import Callable, Deque, Iterable, Iterator, List, Dict, Any, Set, Tuple
 from jinja2 import FileSystemLoader, Environment
 
-from construction_utils.freecad_exporter import FreecadExporter
+from construction_utils.export_journal import ExportJournal
+from construction_utils.freecad_exporter import (
+    DEFAULT_EXPORT_FORMATS,
+    DEFAULT_PREVIEW_SIZES,
+    DEFAULT_VIEWS,
+    RENDER_BACKEND_AUTO,
+    ExportFailure,
+    FreecadExporter,
+    get_freecad_version,
+    get_preview_output_file_path,
+    write_failure_report,
+)
+from construction_utils.ignore_rules import IgnoreRules
+from construction_utils.render_cache import RenderCache
+from construction_utils.render_history import RenderHistory
+from construction_utils.render_manifest import RenderManifest
+from construction_utils.workspace_index import WorkspaceIndex
 
 FILE_DIR = Path(__file__).parent
 
@@ -26,42 +44,152 @@ class Construction:
 
     FILE_EXTENSIONS_SOURCE = ["FCStd"]
     FILE_EXTENSIONS_IMG = ["jpeg", "jpg", "png"]
-    FILE_EXTENSIONS_3D = ["stl"]
+    FILE_EXTENSIONS_3D = ["stl", "step", "stp"]
     FILE_EXTENSIONS_GCODE = ["gcode", "3mf"]
+    # Lowercase file extension -> subdir files with that extension are listed from
+    # fmt: off
+    FILE_EXTENSION_SUBDIR_NAMES = {
+        extension.lower(): subdir_name
+        for subdir_name, extensions in (
+            (SUBDIR_NAME_SOURCE, FILE_EXTENSIONS_SOURCE),
+            (SUBDIR_NAME_IMG, FILE_EXTENSIONS_IMG),
+            (SUBDIR_NAME_3D, FILE_EXTENSIONS_3D),
+            (SUBDIR_NAME_GCODE, FILE_EXTENSIONS_GCODE)
+        )
+        for extension in extensions
+    }
+    # fmt: on
 
-    def __init__(self, construction_dir_path: Path) -> None:
+    def __init__(self, construction_dir_path: Path, workspace_index: WorkspaceIndex | None = None, workspace_dir_path: Path | None = None) -> None:
+        # Everything else is read on first access and cached, a construction costs nothing until it is looked at
         self.construction_dir_path = construction_dir_path
-        self.construction_relative_dir_path = construction_dir_path.relative_to(construction_dir_path.parent)
-        self.things_data: Dict[str, Any] = self.__read_construction_file()
-        self.filepaths_source: List[Tuple[Path, Path]] = self.__read_filepaths_source()
-        self.filepaths_img: List[Path] = self.__read_filepaths_img()
-        self.filepaths_3d: List[Path] = self.__read_filepaths_3d()
-        self.filepaths_gcode: List[Path] = self.__read_filepaths_gcode()
-        self.filepath_thumbnail_image = self.filepaths_img[0] if self.filepaths_img else None
-
-    def __find_files_by_extension_and_return_relative_path(self, dir: Path, extensions: List[str]) -> List[Path]:
-        files: List[str] = []
-        for extension in extensions:
-            files.extend(glob(str(dir / f"*.{extension}")))
-        files.sort()
-        return [Path(file).relative_to(self.construction_dir_path) for file in files]
+        # Relative to the workspace dir if known, constructions may be nested in category dirs
+        self.construction_relative_dir_path = construction_dir_path.relative_to(workspace_dir_path if workspace_dir_path else construction_dir_path.parent)
+        self._workspace_index = workspace_index
+
+    @cached_property
+    def things_data(self) -> Dict[str, Any]:
+        return self.__read_construction_file()
+
+    @cached_property
+    def preview_views(self) -> List[str]:
+        return self.things_data.get("preview_views", list(DEFAULT_VIEWS))
+
+    @cached_property
+    def export_3d_formats(self) -> List[str]:
+        return self.things_data.get("export_3d_formats", list(DEFAULT_EXPORT_FORMATS))
+
+    @cached_property
+    def filepaths_source(self) -> List[Tuple[Path, Path]]:
+        return self.__read_filepaths_source()
+
+    @cached_property
+    def filepaths_source_previews(self) -> Dict[Path, Dict[str, Path]]:
+        return self.__generate_source_files_view_preview_images()
+
+    @cached_property
+    def filepaths_source_preview_derivatives(self) -> Dict[Path, Dict[str, Dict[int, Path]]]:
+        return self.__generate_source_files_preview_derivatives()
+
+    @cached_property
+    def filepaths_img(self) -> List[Path]:
+        return self.__read_filepaths_img()
+
+    @cached_property
+    def filepaths_3d(self) -> List[Path]:
+        return self.__read_filepaths_3d()
+
+    @cached_property
+    def filepaths_gcode(self) -> List[Path]:
+        return self.__read_filepaths_gcode()
+
+    @cached_property
+    def filepath_thumbnail_image(self) -> Path | None:
+        return self.filepaths_img[0] if self.filepaths_img else None
+
+    @cached_property
+    def filepath_thumbnail_preview(self) -> Path | None:
+        # Constructions without images of their own fall back to the preview of their first source file
+        return self.__thumbnail_preview[0]
+
+    @cached_property
+    def filepaths_thumbnail_preview_derivatives(self) -> Dict[int, Path]:
+        return self.__thumbnail_preview[1]
+
+    def scan(self) -> "Construction":
+        """
+        Read the construction file and list the subdirs right away instead of on first access.
+        """
+        for attribute_name in ("things_data", "filepaths_source", "filepaths_img", "filepaths_3d", "filepaths_gcode"):
+            getattr(self, attribute_name)
+        return self
+
+    def __find_files_in_subdir(self, subdir_name: str) -> List[Path]:
+        """
+        Files of the subdir with one of its extensions (case-insensitive), relative to the construction dir. A single
+        directory listing, which matters on network file systems where every listing is a round trip.
+        """
+        subdir_path = self.construction_dir_path / subdir_name
+        dir_entries: List[Tuple[str, bool]] = []
+        if self._workspace_index is not None:
+            dir_entries = [(entry.name, not entry.is_dir) for entry in self._workspace_index.list_dir(subdir_path)]
+        else:
+            try:
+                with os.scandir(subdir_path) as entries:
+                    dir_entries = [(entry.name, entry.is_file()) for entry in entries]
+            except OSError:
+                return []
+        file_names: List[str] = []
+        for name, is_file in dir_entries:
+            # Hidden files are skipped like by glob, e.g. the temporary files of an export in progress
+            if name.startswith("."):
+                continue
+            extension = os.path.splitext(name)[1][1:].lower()
+            if self.FILE_EXTENSION_SUBDIR_NAMES.get(extension) == subdir_name and is_file:
+                file_names.append(name)
+        file_names.sort()
+        return [Path(subdir_name, file_name) for file_name in file_names]
 
     def __read_construction_file(self) -> Dict[str, Any]:
         construction_file_filepath = self.construction_dir_path / self.FILENAME_CONSTRUCTION_FILE
+        if self._workspace_index is not None:
+            return self._workspace_index.read_construction_file(construction_file_filepath)
         with open(construction_file_filepath, "r") as json_file:
             return json.load(json_file)
 
     def __generate_source_files_preview_images(self, source_files_filepaths: List[Path]) -> List[Path]:
         export_image_filepaths: List[Path] = []
         for source_file_filepath in source_files_filepaths:
-            export_image_filepath = self.construction_dir_path / self.SUBDIR_NAME_IMG / f"previews/{source_file_filepath.stem}.png"
-            export_image_filepaths.append(export_image_filepath.relative_to(self.construction_dir_path))
+            export_image_filepaths.append(Path(self.SUBDIR_NAME_IMG, "previews", f"{source_file_filepath.stem}.png"))
         return export_image_filepaths
 
+    def __generate_source_files_view_preview_images(self) -> Dict[Path, Dict[str, Path]]:
+        return {
+            source_file_filepath: {
+                view: get_preview_output_file_path(preview_image_filepath, view, view_index) for view_index, view in enumerate(self.preview_views)
+            }
+            for source_file_filepath, preview_image_filepath in self.filepaths_source
+        }
+
+    def __generate_source_files_preview_derivatives(self) -> Dict[Path, Dict[str, Dict[int, Path]]]:
+        return {
+            source_file_filepath: {
+                view: {size: get_preview_output_file_path(preview_image_filepath, view, view_index, size) for size in DEFAULT_PREVIEW_SIZES}
+                for view_index, view in enumerate(self.preview_views)
+            }
+            for source_file_filepath, preview_image_filepath in self.filepaths_source
+        }
+
+    @cached_property
+    def __thumbnail_preview(self) -> Tuple[Path | None, Dict[int, Path]]:
+        if self.filepath_thumbnail_image or not self.filepaths_source:
+            return None, {}
+        source_file_filepath = self.filepaths_source[0][0]
+        view = self.preview_views[0]
+        return self.filepaths_source_previews[source_file_filepath][view], self.filepaths_source_preview_derivatives[source_file_filepath][view]
+
     def __read_filepaths_source(self) -> List[Tuple[Path, Path]]:
-        source_files_filepaths = self.__find_files_by_extension_and_return_relative_path(
-            self.construction_dir_path / self.SUBDIR_NAME_SOURCE, self.FILE_EXTENSIONS_SOURCE
-        )
+        source_files_filepaths = self.__find_files_in_subdir(self.SUBDIR_NAME_SOURCE)
         source_file_preview_images_filepaths = self.__generate_source_files_preview_images(source_files_filepaths)
         return [
             (source_file_filepath, source_file_preview_image_filepath)
@@ -69,28 +197,142 @@ class Construction:
         ]
 
     def __read_filepaths_img(self) -> List[Path]:
-        return self.__find_files_by_extension_and_return_relative_path(self.construction_dir_path / self.SUBDIR_NAME_IMG, self.FILE_EXTENSIONS_IMG)
+        return self.__find_files_in_subdir(self.SUBDIR_NAME_IMG)
 
     def __read_filepaths_3d(self) -> List[Path]:
-        return self.__find_files_by_extension_and_return_relative_path(self.construction_dir_path / self.SUBDIR_NAME_3D, self.FILE_EXTENSIONS_3D)
+        return self.__find_files_in_subdir(self.SUBDIR_NAME_3D)
 
     def __read_filepaths_gcode(self) -> List[Path]:
-        return self.__find_files_by_extension_and_return_relative_path(self.construction_dir_path / self.SUBDIR_NAME_GCODE, self.FILE_EXTENSIONS_GCODE)
+        return self.__find_files_in_subdir(self.SUBDIR_NAME_GCODE)
 
 
 class Workspace:
-    def __init__(self, workspace_dir_path: Path) -> None:
+    """
+    Constructions of a workspace dir, discovered while iterating over the workspace. Each construction is discovered
+    (and passed to the scanned callback) once, iterating again or in parallel continues from what was discovered so far.
+
+    Constructions are searched recursively, a dir with a construction file is a construction and not descended into.
+    Dirs ignored by a .gitignore or .constructionignore file and tool dirs like .git or venv are skipped, without looking
+    into them.
+
+    With a scan concurrency above 1, the stats, listings and construction file reads of that many constructions are
+    issued at once by a thread pool and the constructions are scanned completely. This hides the latency of network file
+    systems, where every file system access is a round trip. Constructions are yielded in path order either way.
+
+    With a workspace index, dirs and construction files that didn't change since the index was saved are not read again.
+    """
+
+    DEFAULT_SCAN_CONCURRENCY = 16
+    SKIPPED_DIR_NAMES = {".git", ".logs", ".construction_utils", ".resources", "venv", ".venv", "__pycache__", "node_modules"}
+
+    def __init__(
+        self,
+        workspace_dir_path: Path,
+        construction_scanned_callback: Callable[[Construction], None] | None = None,
+        scan_concurrency: int = 1,
+        workspace_index: WorkspaceIndex | None = None,
+    ) -> None:
         self.workspace_dir_path = workspace_dir_path
-        self.constructions = self.__find_constructions()
+        self._construction_scanned_callback = construction_scanned_callback
+        self._scan_concurrency = max(1, scan_concurrency)
+        self._workspace_index = workspace_index
+        self._discovered_constructions: List[Construction] = []
+        self._construction_discovery = self.__find_constructions()
+
+    def __iter__(self) -> Iterator[Construction]:
+        construction_index = 0
+        while True:
+            if construction_index == len(self._discovered_constructions):
+                construction = next(self._construction_discovery, None)
+                if construction is None:
+                    return
+                self._discovered_constructions.append(construction)
+            yield self._discovered_constructions[construction_index]
+            construction_index += 1
+
+    @property
+    def constructions(self) -> List[Construction]:
+        return list(self)
 
-    def __find_constructions(self) -> List[Construction]:
-        workspace_element_paths = [self.workspace_dir_path / elem for elem in listdir(self.workspace_dir_path)]
-        workspace_element_paths.sort()
-        constructions: List[Construction] = []
-        for workspace_element_path in workspace_element_paths:
-            if workspace_element_path.is_dir() and (workspace_element_path / "construction.json").exists():
-                constructions.append(Construction(workspace_element_path))
-        return constructions
+    @staticmethod
+    def __is_construction_dir(dir_path: Path) -> bool:
+        # A construction file can only exist in a dir, a single stat instead of checking for the dir first
+        return (dir_path / Construction.FILENAME_CONSTRUCTION_FILE).exists()
+
+    def __list_dir(self, dir_path: Path) -> List[Tuple[str, bool]]:
+        if self._workspace_index is not None:
+            return [(entry.name, entry.is_dir) for entry in self._workspace_index.list_dir(dir_path)]
+        try:
+            with os.scandir(dir_path) as entries:
+                return sorted((entry.name, entry.is_dir()) for entry in entries)
+        except OSError as e:
+            logm.warning("Unable to list %s (%s)", dir_path, e)
+            return []
+
+    def __find_construction_dir_paths(self, executor: ThreadPoolExecutor | None) -> Iterator[Path]:
+        visited_dir_ids: Set[Tuple[int, int]] = set()
+
+        def walk(dir_path: Path, relative_dir_path: str, ignore_rules: IgnoreRules) -> Iterator[Path]:
+            # Symlinks may lead into a dir that is already walked, or into one of its parents
+            try:
+                stat = os.stat(dir_path)
+            except OSError:
+                return
+            if (stat.st_dev, stat.st_ino) in visited_dir_ids:
+                return
+            visited_dir_ids.add((stat.st_dev, stat.st_ino))
+
+            entries = self.__list_dir(dir_path)
+            ignore_rules = ignore_rules.extend(dir_path, relative_dir_path, [name for name, is_dir in entries if not is_dir])
+            child_dir_paths: List[Tuple[Path, str]] = []
+            for name, is_dir in entries:
+                child_relative_dir_path = f"{relative_dir_path}/{name}" if relative_dir_path else name
+                if is_dir and name not in self.SKIPPED_DIR_NAMES and not ignore_rules.is_ignored_dir(child_relative_dir_path):
+                    child_dir_paths.append((dir_path / name, child_relative_dir_path))
+
+            # The construction file checks of all child dirs at once, a child dir is either scanned or walked
+            child_dir_path_list = [child_dir_path for child_dir_path, _ in child_dir_paths]
+            is_construction_dirs: Iterable[bool]
+            if executor is not None:
+                is_construction_dirs = executor.map(self.__is_construction_dir, child_dir_path_list)
+            else:
+                is_construction_dirs = map(self.__is_construction_dir, child_dir_path_list)
+            for (child_dir_path, child_relative_dir_path), is_construction_dir in zip(child_dir_paths, is_construction_dirs):
+                if is_construction_dir:
+                    yield child_dir_path
+                else:
+                    yield from walk(child_dir_path, child_relative_dir_path, ignore_rules)
+
+        yield from walk(self.workspace_dir_path, "", IgnoreRules())
+
+    def __scan_construction(self, construction_dir_path: Path) -> Construction:
+        construction = Construction(construction_dir_path, self._workspace_index, self.workspace_dir_path)
+        return construction.scan() if self._scan_concurrency > 1 else construction
+
+    def __scan_constructions(self, executor: ThreadPoolExecutor | None) -> Iterator[Construction]:
+        construction_dir_paths = self.__find_construction_dir_paths(executor)
+        if executor is None:
+            yield from map(self.__scan_construction, construction_dir_paths)
+            return
+        # Bounded read-ahead, results are taken in submission order to keep the order of the construction dirs
+        pending_scans: Deque[Future[Construction]] = deque()
+        for construction_dir_path in construction_dir_paths:
+            pending_scans.append(executor.submit(self.__scan_construction, construction_dir_path))
+            if len(pending_scans) >= 2 * self._scan_concurrency:
+                yield pending_scans.popleft().result()
+        while pending_scans:
+            yield pending_scans.popleft().result()
+
+    def __find_constructions(self) -> Iterator[Construction]:
+        executor = ThreadPoolExecutor(max_workers=self._scan_concurrency, thread_name_prefix="workspace_scan") if self._scan_concurrency > 1 else None
+        try:
+            for construction in self.__scan_constructions(executor):
+                if self._construction_scanned_callback:
+                    self._construction_scanned_callback(construction)
+                yield construction
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
 
 
 class ReadmeGenerator:
@@ -130,23 +372,119 @@ class ConstructionReadmeGenerator(ReadmeGenerator):
         super().__init__(construction.construction_dir_path, FILE_DIR / "resources/templates/template_construction_readme.md.jinja", construction=construction)
 
 
-def generate_readmes_for_workspace(workspace_path: Path) -> None:
-    workspace = Workspace(workspace_path)
+EXPORT_FAILURE_REPORT_FILE_PATH = Path(".construction_utils/export_failures.json")
+
+
+# fmt: off
+def generate_readmes_for_workspace(workspace_path: Path,
+                                   workers: int | None = None,
+                                   render_daemon_socket_path: Path | None = None,
+                                   job_timeout: float | None = FreecadExporter.DEFAULT_JOB_TIMEOUT,
+                                   max_documents_per_worker: int | None = FreecadExporter.DEFAULT_MAX_DOCUMENTS_PER_WORKER,
+                                   max_worker_rss: int | None = FreecadExporter.DEFAULT_MAX_WORKER_RSS,
+                                   render_cache_enabled: bool = True,
+                                   render_cache_dir_path: Path | None = None,
+                                   render_cache_max_size: int = RenderCache.DEFAULT_MAX_SIZE,
+                                   xvfb_servers: int = FreecadExporter.DEFAULT_XVFB_SERVERS,
+                                   render_backend: str = RENDER_BACKEND_AUTO,
+                                   preview_optimization_enabled: bool = True,
+                                   resume: bool = False,
+                                   fast_previews: bool = False,
+                                   scan_concurrency: int = Workspace.DEFAULT_SCAN_CONCURRENCY,
+                                   workspace_index_enabled: bool = False) -> List[ExportFailure]:
+    # fmt: on
+    """
+    Generate the READMEs and export the previews and 3D files of all constructions. Returns the failed export jobs.
+    """
     logm.info("Workspace: %s", workspace_path)
-    logm.info("Number of available constructions: %d", len(workspace.constructions))
 
-    freecad_exporter = FreecadExporter()
-
-    logm.info("Generate construction READMES:")
+    render_manifest = RenderManifest(workspace_path, FreecadExporter.RENDER_PARAMETERS)
+    workspace_index = WorkspaceIndex(workspace_path) if workspace_index_enabled else None
+    render_cache: RenderCache | None = None
+    # The cache key includes the FreeCAD version. It is determined by the first dirty job, a run without any doesn't start
+    # FreeCAD. Fast previews don't start FreeCAD for documents with thumbnail, the cache lookup of every dirty job would.
+    if render_cache_enabled and not fast_previews:
+        render_cache = RenderCache(FreecadExporter.RENDER_PARAMETERS, get_freecad_version, render_cache_dir_path, render_cache_max_size)
+        logm.info("Render cache: %s", render_cache.cache_dir_path)
+    # fmt: off
+    freecad_exporter = FreecadExporter(
+        workers=workers,
+        render_daemon_socket_path=render_daemon_socket_path,
+        render_manifest=render_manifest,
+        render_cache=render_cache,
+        render_history=RenderHistory(workspace_path),
+        export_journal=ExportJournal(workspace_path, resume=resume),
+        job_timeout=job_timeout,
+        max_documents_per_worker=max_documents_per_worker,
+        max_worker_rss=max_worker_rss,
+        xvfb_servers=xvfb_servers,
+        render_backend=render_backend,
+        optimize_previews=preview_optimization_enabled,
+        fast_previews=fast_previews
+    )
+    # fmt: on
+
+    def add_preview_export_jobs(construction: Construction) -> None:
+        # Views and formats are the same for all sources of a construction, an invalid construction file fails the first job
+        try:
+            for source_file_path, preview_file_path in construction.filepaths_source:
+                # fmt: off
+                freecad_exporter.add_export_job(
+                    construction.construction_dir_path / source_file_path,
+                    construction.construction_dir_path / preview_file_path,
+                    views=construction.preview_views,
+                    export_dir_path=construction.construction_dir_path / Construction.SUBDIR_NAME_3D,
+                    export_formats=construction.export_3d_formats
+                )
+                # fmt: on
+        except ValueError as e:
+            logm.error("Skipping exports of %s (%s)", construction.construction_dir_path, e)
+
+    # Export runs in the background: jobs reach FreeCAD as soon as their construction is scanned while the READMEs are
+    # rendered in the meantime. The READMEs only reference the preview paths, they don't need the rendered images.
+    freecad_exporter.start()
+    try:
+        # fmt: off
+        workspace = Workspace(
+            workspace_path,
+            construction_scanned_callback=add_preview_export_jobs,
+            scan_concurrency=scan_concurrency,
+            workspace_index=workspace_index
+        )
+        # fmt: on
+        logm.info("Number of available constructions: %d", len(workspace.constructions))
+
+        logm.info("Generate construction READMES:")
+        for construction in workspace.constructions:
+            logm.info("- %s", construction.construction_dir_path)
+            construction_readme_generator = ConstructionReadmeGenerator(construction)
+            construction_readme_generator.generate()
+
+        logm.info("Generate workspace README: %s", workspace.workspace_dir_path)
+        workspace_readme_generator = WorkspaceReadmeGenerator(workspace)
+        workspace_readme_generator.generate()
+
+        export_failures = freecad_exporter.wait()
+    except BaseException:
+        # Ctrl-C or an error while scanning: don't let the workers render on in the background or block the interrupt
+        freecad_exporter.abort()
+        raise
+
+    # The construction READMEs were rendered before the export finished. List newly exported 3D files as well.
+    exported_artifact_file_paths = {artifact_file_path.absolute() for artifact_file_path in freecad_exporter.get_exported_artifacts()}
     for construction in workspace.constructions:
-        logm.info("- %s", construction.construction_dir_path)
-        construction_readme_generator = ConstructionReadmeGenerator(construction)
-        construction_readme_generator.generate()
-        for source_file_path, preview_file_path in construction.filepaths_source:
-            freecad_exporter.add_export_job(construction.construction_dir_path / source_file_path, construction.construction_dir_path / preview_file_path)
-
-    freecad_exporter.export()
-
-    logm.info("Generate workspace README: %s", workspace.workspace_dir_path)
-    workspace_readme_generator = WorkspaceReadmeGenerator(workspace)
-    workspace_readme_generator.generate()
+        listed_artifact_file_paths = {(construction.construction_dir_path / file_path).absolute() for file_path in construction.filepaths_3d}
+        construction_dir_path = construction.construction_dir_path.absolute()
+        if any(path.is_relative_to(construction_dir_path) and path not in listed_artifact_file_paths for path in exported_artifact_file_paths):
+            logm.info("Regenerate construction README with new 3D files: %s", construction.construction_dir_path)
+            ConstructionReadmeGenerator(Construction(construction.construction_dir_path, workspace_index, workspace_path)).generate()
+    if workspace_index is not None:
+        workspace_index.save()
+
+    export_failure_report_file_path = workspace_path / EXPORT_FAILURE_REPORT_FILE_PATH
+    if export_failures:
+        write_failure_report(export_failures, export_failure_report_file_path)
+        logm.warning("%d export job(s) failed, see report: %s", len(export_failures), export_failure_report_file_path)
+    else:
+        export_failure_report_file_path.unlink(missing_ok=True)
+    return export_failures
@@ -0,0 +1,135 @@
+# Copyright (C) 2024 twyleg
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+
+logm = logging.getLogger(__name__)
+
+
+def get_default_render_cache_dir_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if cache_home:
+        return Path(cache_home) / "construction_utils/renders"
+    return Path.home() / ".cache/construction_utils/renders"
+
+
+class RenderCache:
+    """
+    User-level, content-addressed store of rendered previews shared by all workspaces.
+
+    Entries are keyed by the sha256 of the source document, the render parameters, the FreeCAD version (given as callable,
+    it is determined on the first lookup only) and the variant of the output (export script version, view, size), so identical parts in different constructions are rendered only
+    once. The cache is bounded by size and evicts the least recently used entries first. Concurrent runs share it safely:
+    lookups and stores hold a shared lock on the cache, eviction an exclusive one.
+    """
+
+    DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+    LOCK_FILE_NAME = ".lock"
+
+    # fmt: off
+    def __init__(self,
+                 render_parameters: Dict[str, Any],
+                 freecad_version: str | Callable[[], str],
+                 cache_dir_path: Path | None = None,
+                 max_size: int = DEFAULT_MAX_SIZE) -> None:
+        # fmt: on
+        self.cache_dir_path = cache_dir_path if cache_dir_path else get_default_render_cache_dir_path()
+        self.max_size = max_size
+        self._render_parameters = render_parameters
+        self._freecad_version = freecad_version
+        self._key_prefix: str | None = None
+        self._key_prefix_lock = threading.Lock()
+        self.cache_dir_path.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def __lock(self, operation: int) -> Iterator[None]:
+        with open(self.cache_dir_path / self.LOCK_FILE_NAME, "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __get_key_prefix(self) -> str:
+        # A callable FreeCAD version is only determined by the first key, which can mean starting FreeCAD
+        with self._key_prefix_lock:
+            if self._key_prefix is None:
+                freecad_version = self._freecad_version() if callable(self._freecad_version) else self._freecad_version
+                key_parameters = {"render_parameters": self._render_parameters, "freecad_version": freecad_version}
+                self._key_prefix = hashlib.sha256(json.dumps(key_parameters, sort_keys=True).encode("utf-8")).hexdigest()
+            return self._key_prefix
+
+    def key(self, input_sha256: str, variant: str) -> str:
+        return hashlib.sha256(f"{self.__get_key_prefix()}:{input_sha256}:{variant}".encode("utf-8")).hexdigest()
+
+    def __entry_file_path(self, key: str) -> Path:
+        return self.cache_dir_path / key[:2] / f"{key}.png"
+
+    @staticmethod
+    def __link_or_copy(src_file_path: Path, dst_file_path: Path) -> None:
+        dst_file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dst_file_path = dst_file_path.with_name(f".{dst_file_path.name}.{os.getpid()}.tmp")
+        tmp_dst_file_path.unlink(missing_ok=True)
+        try:
+            os.link(src_file_path, tmp_dst_file_path)
+        except OSError:
+            # Different file system or no hardlink support
+            shutil.copyfile(src_file_path, tmp_dst_file_path)
+        os.replace(tmp_dst_file_path, dst_file_path)
+
+    def restore(self, outputs: List[Tuple[str, Path]]) -> bool:
+        """
+        Restore all (key, output file) pairs from the cache. Nothing is restored unless every output is cached.
+        """
+        with self.__lock(fcntl.LOCK_SH):
+            entry_file_paths = [self.__entry_file_path(key) for key, _ in outputs]
+            if not all(entry_file_path.exists() for entry_file_path in entry_file_paths):
+                return False
+            for entry_file_path, (_, output_file_path) in zip(entry_file_paths, outputs):
+                # The mtime serves as last access time for the LRU eviction
+                os.utime(entry_file_path)
+                self.__link_or_copy(entry_file_path, output_file_path)
+            return True
+
+    def store(self, key: str, output_file_path: Path) -> None:
+        entry_file_path = self.__entry_file_path(key)
+        with self.__lock(fcntl.LOCK_SH):
+            entry_file_path.parent.mkdir(parents=True, exist_ok=True)
+            # Copy instead of link, so later renders over the output can't alter the cache entry
+            tmp_entry_file_path = entry_file_path.with_name(f".{entry_file_path.name}.{os.getpid()}.tmp")
+            shutil.copyfile(output_file_path, tmp_entry_file_path)
+            os.replace(tmp_entry_file_path, entry_file_path)
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the cache fits its size cap. Returns the number of removed entries.
+        """
+        with self.__lock(fcntl.LOCK_EX):
+            entries: List[Tuple[float, int, str]] = []
+            for shard_dir_entry in os.scandir(self.cache_dir_path):
+                if not shard_dir_entry.is_dir():
+                    continue
+                for entry in os.scandir(shard_dir_entry.path):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            cache_size = sum(size for _, size, _ in entries)
+            evicted_count = 0
+            for _, size, entry_file_path in sorted(entries):
+                if cache_size <= self.max_size:
+                    break
+                os.unlink(entry_file_path)
+                cache_size -= size
+                evicted_count += 1
+
+        if evicted_count:
+            logm.info("Evicted %d render cache entries (%s)", evicted_count, self.cache_dir_path)
+        return evicted_count
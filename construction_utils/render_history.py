@@ -0,0 +1,95 @@
+# Copyright (C) 2024 twyleg
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+
+logm = logging.getLogger(__name__)
+
+
+class RenderHistory:
+    """
+    Persistent record of how long each input took to export, used to schedule expensive documents first and to estimate
+    the total export time.
+
+    Inputs without a recorded duration are estimated from their file size, at the rate observed for the recorded inputs
+    (or a conservative default rate as long as nothing is recorded). Paths are stored relative to the history's base dir.
+    """
+
+    HISTORY_VERSION = 1
+    DEFAULT_HISTORY_FILE_PATH = Path(".construction_utils/render_history.json")
+    # Rough FreeCAD figures for a first run: a few seconds to open and render any document, plus time that grows with its size
+    DEFAULT_BASE_DURATION = 2.0
+    DEFAULT_DURATION_PER_MIB = 4.0
+    # Weight of a new measurement against the recorded duration, smooths out noise from busy machines
+    SMOOTHING_FACTOR = 0.5
+
+    def __init__(self, base_dir_path: Path, history_file_path: Path | None = None) -> None:
+        self.base_dir_path = base_dir_path
+        self.history_file_path = history_file_path if history_file_path else base_dir_path / self.DEFAULT_HISTORY_FILE_PATH
+        self._entries: Dict[str, Dict[str, Any]] = self.__load()
+        self._duration_per_mib = self.__compute_duration_per_mib()
+
+    def __load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.history_file_path, "r") as history_file:
+                content = json.load(history_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logm.warning("Unable to read render history %s (%s) - estimating export times from file sizes", self.history_file_path, e)
+            return {}
+
+        if content.get("version") != self.HISTORY_VERSION:
+            return {}
+        return content.get("durations", {})
+
+    def __key(self, file_path: Path) -> str:
+        try:
+            return file_path.absolute().relative_to(self.base_dir_path.absolute()).as_posix()
+        except ValueError:
+            return file_path.absolute().as_posix()
+
+    def __compute_duration_per_mib(self) -> float:
+        total_size = sum(entry["input_size"] for entry in self._entries.values())
+        total_duration = sum(max(0.0, entry["duration"] - self.DEFAULT_BASE_DURATION) for entry in self._entries.values())
+        if total_size <= 0 or total_duration <= 0:
+            return self.DEFAULT_DURATION_PER_MIB
+        return total_duration / (total_size / (1024 * 1024))
+
+    @classmethod
+    def estimate_from_size(cls, input_size: int, duration_per_mib: float = DEFAULT_DURATION_PER_MIB) -> float:
+        return cls.DEFAULT_BASE_DURATION + duration_per_mib * input_size / (1024 * 1024)
+
+    def estimate(self, input_file_path: Path) -> float:
+        """
+        Expected export duration of the input in seconds: the recorded one if available, otherwise derived from its size.
+        """
+        entry = self._entries.get(self.__key(input_file_path))
+        if entry is not None:
+            return entry["duration"]
+        try:
+            input_size = input_file_path.stat().st_size
+        except OSError:
+            input_size = 0
+        return self.estimate_from_size(input_size, self._duration_per_mib)
+
+    def record(self, input_file_path: Path, duration: float) -> None:
+        key = self.__key(input_file_path)
+        entry = self._entries.get(key)
+        if entry is not None:
+            duration = self.SMOOTHING_FACTOR * duration + (1.0 - self.SMOOTHING_FACTOR) * entry["duration"]
+        try:
+            input_size = input_file_path.stat().st_size
+        except OSError:
+            return
+        self._entries[key] = {"duration": round(duration, 3), "input_size": input_size}
+
+    def save(self) -> None:
+        self.history_file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_history_file_path = self.history_file_path.with_name(f".{self.history_file_path.name}.{os.getpid()}.tmp")
+        with open(tmp_history_file_path, "w") as history_file:
+            json.dump({"version": self.HISTORY_VERSION, "durations": dict(sorted(self._entries.items()))}, history_file, indent=4)
+        os.replace(tmp_history_file_path, self.history_file_path)
@@ -0,0 +1,174 @@
+# Copyright (C) 2024 twyleg
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from construction_utils.fcstd import compute_fcstd_fingerprint
+
+logm = logging.getLogger(__name__)
+
+
+def compute_file_sha256(file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as file:
+        while read_bytes := file.readinto(buffer):
+            sha256.update(view[:read_bytes])
+    return sha256.hexdigest()
+
+
+def compute_input_fingerprint(input_file_path: Path) -> str:
+    """
+    Hash of what an input renders to: the semantic fingerprint of FreeCAD documents, which stays the same when only GUI
+    state like the camera changed, and the plain sha256 of anything else (or of documents that can't be read as such).
+    """
+    if input_file_path.suffix.lower() == ".fcstd":
+        fcstd_fingerprint = compute_fcstd_fingerprint(input_file_path)
+        if fcstd_fingerprint is not None:
+            return fcstd_fingerprint
+    return compute_file_sha256(input_file_path)
+
+
+class RenderManifest:
+    """
+    Persistent record of the inputs every preview was rendered from.
+
+    A preview is dirty only when the fingerprint of its input (semantic hash of the source file, render parameters and
+    export script version) differs from the recorded one. Unlike file modification times, the fingerprint survives a fresh
+    clone, a checkout or a CI cache restore. Paths are stored relative to the manifest's base dir so the manifest can be
+    committed together with the workspace.
+
+    Derived exports (STL/STEP per body) are recorded per input instead of per output, since the files a document
+    produces are only known once it was exported.
+    """
+
+    MANIFEST_VERSION = 1
+    DEFAULT_MANIFEST_FILE_PATH = Path(".construction_utils/renders.json")
+
+    def __init__(self, base_dir_path: Path, render_parameters: Dict[str, Any], manifest_file_path: Path | None = None) -> None:
+        self.base_dir_path = base_dir_path
+        self.manifest_file_path = manifest_file_path if manifest_file_path else base_dir_path / self.DEFAULT_MANIFEST_FILE_PATH
+        self._render_parameters_digest = hashlib.sha256(json.dumps(render_parameters, sort_keys=True).encode("utf-8")).hexdigest()
+        content = self.__load()
+        self._entries: Dict[str, Dict[str, Any]] = content.get("renders", {})
+        self._exports: Dict[str, Dict[str, Any]] = content.get("exports", {})
+        # Stat cache of the inputs, seeded from the recorded renders for manifests written before it was kept
+        # fmt: off
+        self._inputs: Dict[str, Dict[str, Any]] = {
+            entry["input"]: {"size": entry["input_size"], "mtime_ns": entry["input_mtime_ns"], "sha256": entry["input_sha256"]}
+            for entry in self._entries.values()
+        }
+        # fmt: on
+        self._inputs.update(content.get("inputs", {}))
+        self._used_input_keys: Set[str] = set()
+
+    def __load(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_file_path, "r") as manifest_file:
+                content = json.load(manifest_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logm.warning("Unable to read render manifest %s (%s) - treating all previews as dirty", self.manifest_file_path, e)
+            return {}
+
+        if content.get("version") != self.MANIFEST_VERSION:
+            logm.info("Render manifest version changed - treating all previews as dirty")
+            return {}
+        return content
+
+    def __key(self, file_path: Path) -> str:
+        try:
+            return file_path.absolute().relative_to(self.base_dir_path.absolute()).as_posix()
+        except ValueError:
+            return file_path.absolute().as_posix()
+
+    def __path(self, key: str) -> Path:
+        return self.base_dir_path / key
+
+    def compute_input_sha256(self, input_file_path: Path) -> str:
+        """
+        Fingerprint of the input, reused while its size and mtime are unchanged (comparable to git's stat cache), which
+        spares unzipping and canonicalizing unchanged FreeCAD documents on every run. Inputs that were never rendered,
+        e.g. because their export failed, are cached as well.
+        """
+        key = self.__key(input_file_path)
+        stat = input_file_path.stat()
+        self._used_input_keys.add(key)
+        cached_input = self._inputs.get(key)
+        if cached_input and cached_input["size"] == stat.st_size and cached_input["mtime_ns"] == stat.st_mtime_ns:
+            return cached_input["sha256"]
+        input_sha256 = compute_input_fingerprint(input_file_path)
+        self._inputs[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": input_sha256}
+        return input_sha256
+
+    def fingerprint(self, input_sha256: str, script_version: str) -> str:
+        return hashlib.sha256(f"{input_sha256}:{self._render_parameters_digest}:{script_version}".encode("utf-8")).hexdigest()
+
+    def is_dirty(self, input_file_path: Path, output_file_path: Path, fingerprint: str) -> bool:
+        entry = self._entries.get(self.__key(output_file_path))
+        if entry is None or not output_file_path.exists():
+            return True
+        return entry["input"] != self.__key(input_file_path) or entry["fingerprint"] != fingerprint
+
+    def update(self, input_file_path: Path, output_file_path: Path, input_sha256: str, fingerprint: str) -> None:
+        stat = input_file_path.stat()
+        self._inputs[self.__key(input_file_path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": input_sha256}
+        self._used_input_keys.add(self.__key(input_file_path))
+        self._entries[self.__key(output_file_path)] = {
+            "input": self.__key(input_file_path),
+            "input_size": stat.st_size,
+            "input_mtime_ns": stat.st_mtime_ns,
+            "input_sha256": input_sha256,
+            "fingerprint": fingerprint,
+        }
+
+    def remove(self, output_file_path: Path) -> None:
+        """
+        Forget the preview, it is dirty until recorded again.
+        """
+        self._entries.pop(self.__key(output_file_path), None)
+
+    def is_export_dirty(self, input_file_path: Path, fingerprint: str) -> bool:
+        entry = self._exports.get(self.__key(input_file_path))
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return True
+        return not all(self.__path(output).exists() for output in entry["outputs"])
+
+    def update_export(self, input_file_path: Path, output_file_paths: List[Path], input_sha256: str, fingerprint: str) -> List[Path]:
+        """
+        Record the files exported from the input. Returns the files recorded for the input before that were not exported
+        again (e.g. because a body got renamed or removed).
+        """
+        input_key = self.__key(input_file_path)
+        output_keys = [self.__key(output_file_path) for output_file_path in output_file_paths]
+        previous_entry = self._exports.get(input_key)
+        self._exports[input_key] = {"input_sha256": input_sha256, "fingerprint": fingerprint, "outputs": sorted(output_keys)}
+        if previous_entry is None:
+            return []
+        return [self.__path(output) for output in previous_entry["outputs"] if output not in output_keys]
+
+    def save(self) -> None:
+        # Inputs neither looked at by this run nor referenced by a record were removed from the workspace
+        input_keys = self._used_input_keys | {entry["input"] for entry in self._entries.values()} | set(self._exports)
+        inputs = {key: cached_input for key, cached_input in self._inputs.items() if key in input_keys}
+        self.manifest_file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_manifest_file_path = self.manifest_file_path.with_name(f".{self.manifest_file_path.name}.{os.getpid()}.tmp")
+        with open(tmp_manifest_file_path, "w") as manifest_file:
+            # fmt: off
+            json.dump(
+                {
+                    "version": self.MANIFEST_VERSION,
+                    "renders": dict(sorted(self._entries.items())),
+                    "exports": dict(sorted(self._exports.items())),
+                    "inputs": dict(sorted(inputs.items()))
+                },
+                manifest_file,
+                indent=4
+            )
+            # fmt: on
+        os.replace(tmp_manifest_file_path, self.manifest_file_path)
@@ -4,10 +4,42 @@ Copyright (C) 2024 twyleg
 FreeCAD image export script.
 
 Input: .FCStd file
-Output: Isometric, Orthographic view in PNG format
+Output: Orthographic views (isometric by default) in PNG format, optionally STL/STEP files of every body
 
 Usage:
-    freecad freecad_export_image.py --pass <input_file_path_0>[:<output_dir/[output_filename.png]] [<input_file_path_1...]
+    freecad freecad_export_image.py --pass [--views=<view>[,<view>...]] [--sizes=<size>[,<size>...]] [--export-formats=<format>[,<format>...]] [--export-dir=<dir>] <input_file_path_0>[:<output_dir/[output_filename.png]] [<input_file_path_1...]
+    freecad freecad_export_image.py --pass [--max-documents=<count>] [--max-rss=<MiB>] --jobs-file=<jobs_file_path>
+    freecad freecad_export_image.py --pass --serve <socket_path> [--max-documents=<count>] [--max-rss=<MiB>]
+    FreeCADCmd freecad_export_image.py --pass [...]
+    FreeCADCmd freecad_export_image.py --pass --probe
+
+Backends:
+    Run by the freecad GUI, the views are rendered through the active 3D view (requires an X server, e.g. Xvfb). Run by
+    FreeCADCmd, the scene is built from the shapes of the visible objects (colors and visibility from the document's
+    GuiDocument.xml) and rendered with Coin's SoOffscreenRenderer, without GUI and without X server where the OpenGL
+    setup allows that. --probe checks whether offscreen rendering works and reports {"event": "probe", "ok": ...}.
+
+Options:
+    --views applies to all following input files and may be repeated. Available views: axo (default), front, rear, top,
+    bottom, left, right. All views of a document are rendered from a single open of that document. The first view is
+    written to the output file, every further view next to it with the view name as suffix (example_0-front.png).
+    --sizes applies to all following input files as well. Every view is rendered once at full size (1000x1000) and
+    additionally downscaled to each of the given sizes, written with the size as suffix (example_0-200.png,
+    example_0-front-200.png). No derivatives are written by default.
+    --export-formats and --export-dir apply to all following input files as well. Every body (root object with a solid
+    shape) of the document is exported in each of the given formats (stl, step) to the export dir (default: next to the
+    input file), named after the document and the body label (example_0-Body.stl). Nothing is exported by default.
+    --jobs-file reads the jobs, including their options, from a JSON file in the format of a server mode request (see
+    below). Unlike <input>:<output> arguments, this works for paths containing colons and for any number of jobs.
+    --max-documents and --max-rss bound the memory of a batch: FreeCAD doesn't free everything when a document is
+    closed. Once the given number of documents is exported or the resident memory of the process exceeds the given
+    size, the script reports {"event": "recycled", ...} and exits without exporting the remaining jobs, which the caller
+    passes to a fresh process. In server mode the limits count all requests, and the daemon exits with status 75 once
+    one is reached so that it gets restarted.
+
+Outputs:
+    Every preview and exported file is written to a hidden temporary file next to it (.example_0.tmp.png) and renamed
+    into place once complete. An interrupted export therefore never leaves a partially written output behind.
 
 Examples:
 - Single input file:
@@ -28,13 +60,61 @@ Examples:
         -source/example_0.FCStd -> source/example_0.png
         -source/example_1.FCStd -> output_1/example_1.png
         -source/example_2.FCStd -> output_2/example_output_2.png
+
+- Multiple views:
+    Command: freecad freecad_export_image.py --pass --views=axo,front,top source/example_0.FCStd:output/
+    Results:
+        -source/example_0.FCStd -> output/example_0.png, output/example_0-front.png, output/example_0-top.png
+
+- Downscaled derivatives:
+    Command: freecad freecad_export_image.py --pass --sizes=200,400 source/example_0.FCStd:output/
+    Results:
+        -source/example_0.FCStd -> output/example_0.png, output/example_0-200.png, output/example_0-400.png
+
+- Preview and STL export of every body:
+    Command: freecad freecad_export_image.py --pass --export-formats=stl --export-dir=3d/ source/example_0.FCStd:output/
+    Results:
+        -source/example_0.FCStd -> output/example_0.png, 3d/example_0-Body.stl, 3d/example_0-Body001.stl
+
+- Jobs file:
+    Command: freecad freecad_export_image.py --pass --jobs-file=/run/user/1000/construction_utils/jobs_1234.json
+    Jobs file: {"jobs": [["/abs/source/example_0.FCStd", "/abs/output/", ["axo"], [200, 400], "/abs/3d/", ["stl"]]]}
+    Results:
+        -/abs/source/example_0.FCStd -> /abs/output/example_0.png, /abs/output/example_0-200.png, ..., /abs/3d/example_0-Body.stl
+
+- Server mode (render daemon):
+    Command: freecad freecad_export_image.py --pass --serve /run/user/1000/construction_utils/freecad_render_daemon.sock
+    Listens on the given unix socket. Every connection sends one JSON line request and receives the job events:
+        Request: {"jobs": [["/abs/source/example_0.FCStd", "/abs/output/", ["axo", "front"], [200, 400], "/abs/3d/", ["stl"]], ["/abs/source/example_1.FCStd", null]]}
+        Response: Job events (see below), followed by a final {"event": "finished"}
+    A request of {"command": "shutdown"} stops the server. A "recycled" event before "finished" announces that the server
+    stops listening and exits to get restarted, the jobs after the reported one were not exported. The server refuses
+    to start if another one is listening on the socket already.
+
+Job events:
+    Progress is reported as one JSON line per job event, written to the process stdout (batch mode) or to the socket
+    connection (server mode). "job" is the index of the job in the order it was passed, times are in seconds.
+        {"event": "started", "job": 0, "input": "...", "time": 1718000000.0}
+        {"event": "rendered", "job": 0, "input": "...", "output": "...", "outputs": ["...", ...], "artifacts": ["...", ...], "time": 1718000001.2, "duration": 1.2}
+        {"event": "failed", "job": 1, "input": "...", "error": "...", "time": 1718000001.5, "duration": 0.3}
+        {"event": "recycled", "job": 1, "documents": 2, "rss": 1073741824}
 """
 
+import json
+import os
+import re
+import socket
 import sys
-from typing import List, Tuple, Union
+import time
+import zipfile
+from contextlib import contextmanager, suppress
+from typing import Dict, Iterator, List, NamedTuple, TextIO, Tuple, Union
+from xml.etree import ElementTree
 
 import FreeCADGui as Gui  # type: ignore
 import FreeCAD  # type: ignore
+import Mesh  # type: ignore
+from PySide import QtCore, QtGui  # type: ignore
 
 from pathlib import Path
 
@@ -49,49 +129,518 @@ def get_script_args() -> List[str]:
     return list_split(sys.argv, "--pass")[1]
 
 
-def get_input_output_file_paths_pairs(args: List[str]) -> List[Tuple[Path, Union[Path, None]]]:
-    input_output_file_paths_pairs: List[Tuple[Path, Union[Path, None]]] = []
+VIEW_COMMANDS = {
+    "axo": "ViewAxo",
+    "front": "ViewFront",
+    "rear": "ViewRear",
+    "top": "ViewTop",
+    "bottom": "ViewBottom",
+    "left": "ViewLeft",
+    "right": "ViewRight",
+}
+# Viewing direction and up vector of every view, matching the standard views of the FreeCAD GUI
+VIEW_DIRECTIONS = {
+    "axo": ((-1.0, 1.0, -1.0), (0.0, 0.0, 1.0)),
+    "front": ((0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+    "rear": ((0.0, -1.0, 0.0), (0.0, 0.0, 1.0)),
+    "top": ((0.0, 0.0, -1.0), (0.0, 1.0, 0.0)),
+    "bottom": ((0.0, 0.0, 1.0), (0.0, 1.0, 0.0)),
+    "left": ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    "right": ((-1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+}
+DEFAULT_SHAPE_COLOR = (0.8, 0.8, 0.8)
+DEFAULT_VIEWS = ["axo"]
+DEFAULT_SIZES: List[int] = []
+FULL_SIZE = 1000
+EXPORT_FORMATS = ["stl", "step"]
+# EX_TEMPFAIL, tells the caller to restart the render daemon
+EXIT_CODE_RECYCLED = 75
+
+
+class Job(NamedTuple):
+    input_file_path: Path
+    output_file_path: Union[Path, None]
+    views: List[str]
+    sizes: List[int]
+    export_dir_path: Union[Path, None]
+    export_formats: List[str]
+
+
+def parse_job_requests(job_requests: List[list]) -> List[Job]:
+    """
+    Jobs in the JSON format of the jobs file and the server mode: [input, output or null, views, sizes, export dir or
+    null, export formats], everything after the output is optional.
+    """
+    jobs: List[Job] = []
+    for input_file_arg, output_file_arg, *options in job_requests:
+        views = options[0] if len(options) > 0 else DEFAULT_VIEWS
+        sizes = options[1] if len(options) > 1 else DEFAULT_SIZES
+        export_dir_arg = options[2] if len(options) > 2 else None
+        export_formats = options[3] if len(options) > 3 else []
+        # fmt: off
+        jobs.append(Job(
+            Path(input_file_arg),
+            Path(output_file_arg) if output_file_arg else None,
+            views,
+            sizes,
+            Path(export_dir_arg) if export_dir_arg else None,
+            export_formats
+        ))
+        # fmt: on
+    return jobs
+
+
+def get_jobs(args: List[str]) -> List[Job]:
+    jobs: List[Job] = []
+    views = DEFAULT_VIEWS
+    sizes = DEFAULT_SIZES
+    export_dir_path: Union[Path, None] = None
+    export_formats: List[str] = []
     for arg in args:
-        if ":" in arg:
+        if arg.startswith("--views="):
+            views = arg[len("--views=") :].split(",")
+        elif arg.startswith("--sizes="):
+            sizes = [int(size) for size in arg[len("--sizes=") :].split(",") if size]
+        elif arg.startswith("--export-formats="):
+            export_formats = [export_format for export_format in arg[len("--export-formats=") :].split(",") if export_format]
+        elif arg.startswith("--export-dir="):
+            export_dir_path = Path(arg[len("--export-dir=") :])
+        elif arg.startswith("--max-documents=") or arg.startswith("--max-rss="):
+            continue
+        elif arg.startswith("--jobs-file="):
+            with open(arg[len("--jobs-file=") :], "r", encoding="utf-8") as jobs_file:
+                jobs.extend(parse_job_requests(json.load(jobs_file)["jobs"]))
+        elif ":" in arg:
             splitted_arg = arg.split(":")
             input_file_path = Path(splitted_arg[0])
             output_file_path = Path(splitted_arg[1])
-            input_output_file_paths_pairs.append((input_file_path, output_file_path))
+            jobs.append(Job(input_file_path, output_file_path, views, sizes, export_dir_path, export_formats))
         else:
             input_file_path = Path(arg)
             output_file_path = None
-            input_output_file_paths_pairs.append((input_file_path, output_file_path))
-    return input_output_file_paths_pairs
+            jobs.append(Job(input_file_path, output_file_path, views, sizes, export_dir_path, export_formats))
+    return jobs
 
 
-print(f"sys.argv: {sys.argv}")
+def get_recycle_limits(args: List[str]) -> Tuple[Union[int, None], Union[int, None]]:
+    max_documents: Union[int, None] = None
+    max_rss: Union[int, None] = None
+    for arg in args:
+        if arg.startswith("--max-documents="):
+            max_documents = int(arg[len("--max-documents=") :])
+        elif arg.startswith("--max-rss="):
+            max_rss = int(arg[len("--max-rss=") :]) * 1024 * 1024
+    return max_documents, max_rss
 
-script_args = get_script_args()
-input_output_file_path_pairs = get_input_output_file_paths_pairs(script_args)
 
-for input_output_file_path_pair in input_output_file_path_pairs:
+def get_rss() -> Union[int, None]:
+    try:
+        with open("/proc/self/status", "r") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
 
-    input_file_path = input_output_file_path_pair[0]
-    output_file_path = input_output_file_path_pair[1]
 
+def resolve_output_file_path(input_file_path: Path, output_file_path: Union[Path, None]) -> Path:
     if output_file_path is None:
-        output_file_path = input_file_path.parent / f"{input_file_path.stem}.png"
+        return input_file_path.parent / f"{input_file_path.stem}.png"
     elif output_file_path.suffix:
         output_file_path.parent.mkdir(parents=True, exist_ok=True)
+        return output_file_path
     else:
         output_file_path.mkdir(parents=True, exist_ok=True)
-        output_file_path = output_file_path / f"{input_file_path.stem}.png"
+        return output_file_path / f"{input_file_path.stem}.png"
 
-    print(f"Exporting PNG:  {input_file_path} -> {output_file_path}")
 
-    doc = FreeCAD.openDocument(str(input_file_path))
+def get_preview_output_file_path(output_file_path: Path, view: str, view_index: int, size: Union[int, None] = None) -> Path:
+    suffixes = ([view] if view_index > 0 else []) + ([str(size)] if size is not None else [])
+    if not suffixes:
+        return output_file_path
+    return output_file_path.with_name(f"{output_file_path.stem}-{'-'.join(suffixes)}{output_file_path.suffix}")
 
-    Gui.SendMsgToActiveView("OrthographicCamera")
-    Gui.SendMsgToActiveView("ViewAxo")
 
+def get_tmp_output_file_path(output_file_path: Path) -> Path:
+    # Same dir (and file system) as the output, so the rename is atomic. The suffix is kept, FreeCAD picks the format by it.
+    return output_file_path.with_name(f".{output_file_path.stem}.tmp{output_file_path.suffix}")
+
+
+@contextmanager
+def atomic_output(output_file_path: Path) -> Iterator[Path]:
+    tmp_output_file_path = get_tmp_output_file_path(output_file_path)
+    try:
+        yield tmp_output_file_path
+        os.replace(tmp_output_file_path, output_file_path)
+    finally:
+        tmp_output_file_path.unlink(missing_ok=True)
+
+
+def save_derivatives(output_file_path: Path, view_name: str, view_index: int, sizes: List[int]) -> List[Path]:
+    # Downscaling the full size render is much cheaper than rendering the scene again and smooth scaling gives a
+    # cleaner result than a low resolution render.
+    image = QtGui.QImage(str(get_preview_output_file_path(output_file_path, view_name, view_index)))
+    derivative_output_file_paths: List[Path] = []
+    for size in sizes:
+        derivative_output_file_path = get_preview_output_file_path(output_file_path, view_name, view_index, size)
+        derivative = image.scaled(size, size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        with atomic_output(derivative_output_file_path) as tmp_output_file_path:
+            if not derivative.save(str(tmp_output_file_path)):
+                raise IOError(f"Unable to write {derivative_output_file_path}")
+        derivative_output_file_paths.append(derivative_output_file_path)
+    return derivative_output_file_paths
+
+
+def export_images(input_file_path: Path, output_file_path: Path, views: List[str], sizes: List[int]) -> List[Path]:
+    Gui.SendMsgToActiveView("OrthographicCamera")
     view = Gui.ActiveDocument.ActiveView
-    view.saveImage(str(output_file_path), 1000, 1000, "White")
 
-    FreeCAD.closeDocument(doc.Name)
+    preview_output_file_paths: List[Path] = []
+    for view_index, view_name in enumerate(views):
+        view_output_file_path = get_preview_output_file_path(output_file_path, view_name, view_index)
+        print(f"Exporting PNG ({view_name}):  {input_file_path} -> {view_output_file_path}")
+
+        Gui.SendMsgToActiveView(VIEW_COMMANDS[view_name])
+        Gui.SendMsgToActiveView("ViewFit")
+        with atomic_output(view_output_file_path) as tmp_output_file_path:
+            view.saveImage(str(tmp_output_file_path), FULL_SIZE, FULL_SIZE, "White")
+        preview_output_file_paths.append(view_output_file_path)
+        preview_output_file_paths.extend(save_derivatives(output_file_path, view_name, view_index, sizes))
+    return preview_output_file_paths
+
+
+def read_view_properties(input_file_path: Path) -> Dict[str, Tuple[bool, Tuple[float, float, float]]]:
+    """
+    Visibility and shape color of every object as stored by the GUI. Without GUI, FreeCAD doesn't load them itself.
+    """
+    try:
+        with zipfile.ZipFile(input_file_path) as fcstd_file:
+            gui_document = ElementTree.fromstring(fcstd_file.read("GuiDocument.xml"))
+    except (KeyError, OSError, zipfile.BadZipFile, ElementTree.ParseError):
+        return {}
+
+    view_properties: Dict[str, Tuple[bool, Tuple[float, float, float]]] = {}
+    for view_provider in gui_document.iter("ViewProvider"):
+        visibility = True
+        color = DEFAULT_SHAPE_COLOR
+        for view_provider_property in view_provider.iter("Property"):
+            if view_provider_property.get("name") == "Visibility":
+                bool_element = view_provider_property.find("Bool")
+                visibility = bool_element is not None and bool_element.get("value") == "true"
+            elif view_provider_property.get("name") == "ShapeColor":
+                color_element = view_provider_property.find("PropertyColor")
+                if color_element is not None:
+                    packed_color = int(color_element.get("value", "0"))
+                    color = (((packed_color >> 24) & 0xFF) / 255.0, ((packed_color >> 16) & 0xFF) / 255.0, ((packed_color >> 8) & 0xFF) / 255.0)
+        view_properties[view_provider.get("name", "")] = (visibility, color)
+    return view_properties
+
+
+def build_offscreen_scene(doc, input_file_path: Path):
+    from pivy import coin  # type: ignore
+
+    view_properties = read_view_properties(input_file_path)
+    root_objects = set(obj.Name for obj in doc.RootObjects)
+    scene = coin.SoSeparator()
+    for obj in doc.Objects:
+        visibility, color = view_properties.get(obj.Name, (obj.Name in root_objects, DEFAULT_SHAPE_COLOR))
+        if not visibility or not hasattr(obj, "Shape") or obj.Shape.isNull():
+            continue
+        shape_input = coin.SoInput()
+        shape_input.setBuffer(obj.Shape.writeInventor())
+        shape_node = coin.SoDB.readAll(shape_input)
+        if shape_node is None:
+            continue
+        material = coin.SoMaterial()
+        material.diffuseColor.setValue(coin.SbColor(*color))
+        separator = coin.SoSeparator()
+        separator.addChild(material)
+        separator.addChild(shape_node)
+        scene.addChild(separator)
+    return scene
+
+
+def get_camera_orientation(view_name: str):
+    from pivy import coin  # type: ignore
+
+    direction, up = (FreeCAD.Vector(*vector) for vector in VIEW_DIRECTIONS[view_name])
+    # The camera looks along its local -z axis with y as up vector
+    z_axis = (direction * -1).normalize()
+    x_axis = up.cross(z_axis).normalize()
+    y_axis = z_axis.cross(x_axis)
+    # fmt: off
+    matrix = FreeCAD.Matrix(
+        x_axis.x, y_axis.x, z_axis.x, 0,
+        x_axis.y, y_axis.y, z_axis.y, 0,
+        x_axis.z, y_axis.z, z_axis.z, 0,
+        0, 0, 0, 1
+    )
+    # fmt: on
+    return coin.SbRotation(*FreeCAD.Rotation(matrix).Q)
+
+
+def render_offscreen(scene, view_name: str, output_file_path: Union[Path, None], size: int = FULL_SIZE) -> None:
+    from pivy import coin  # type: ignore
+
+    camera = coin.SoOrthographicCamera()
+    camera.orientation.setValue(get_camera_orientation(view_name))
+    # Headlight
+    light = coin.SoDirectionalLight()
+    light.direction.setValue(coin.SbVec3f(*VIEW_DIRECTIONS[view_name][0]))
+
+    root = coin.SoSeparator()
+    root.addChild(camera)
+    root.addChild(light)
+    root.addChild(scene)
+
+    viewport = coin.SbViewportRegion(size, size)
+    camera.viewAll(scene, viewport)
+    renderer = coin.SoOffscreenRenderer(viewport)
+    renderer.setBackgroundColor(coin.SbColor(1.0, 1.0, 1.0))
+    if not renderer.render(root):
+        raise RuntimeError("Offscreen rendering failed, no OpenGL context available")
+    if output_file_path is None:
+        return
+
+    # OpenGL rows start at the bottom
+    image = QtGui.QImage(renderer.getBuffer(), size, size, size * 3, QtGui.QImage.Format_RGB888).mirrored()
+    with atomic_output(output_file_path) as tmp_output_file_path:
+        if not image.save(str(tmp_output_file_path)):
+            raise IOError(f"Unable to write {output_file_path}")
+
+
+def export_images_offscreen(doc, input_file_path: Path, output_file_path: Path, views: List[str], sizes: List[int]) -> List[Path]:
+    scene = build_offscreen_scene(doc, input_file_path)
+
+    preview_output_file_paths: List[Path] = []
+    for view_index, view_name in enumerate(views):
+        view_output_file_path = get_preview_output_file_path(output_file_path, view_name, view_index)
+        print(f"Exporting PNG ({view_name}, offscreen):  {input_file_path} -> {view_output_file_path}")
+
+        render_offscreen(scene, view_name, view_output_file_path)
+        preview_output_file_paths.append(view_output_file_path)
+        preview_output_file_paths.extend(save_derivatives(output_file_path, view_name, view_index, sizes))
+    return preview_output_file_paths
+
+
+def probe_offscreen_rendering(event_stream: TextIO) -> None:
+    from pivy import coin  # type: ignore
+
+    try:
+        scene = coin.SoSeparator()
+        scene.addChild(coin.SoCube())
+        render_offscreen(scene, "axo", None, size=64)
+    except Exception as e:
+        emit_event(event_stream, "probe", ok=False, error=repr(e))
+    else:
+        emit_event(event_stream, "probe", ok=True)
+
+
+def get_body_file_name(body) -> str:
+    label = re.sub(r"[^A-Za-z0-9._-]+", "_", body.Label).strip("_")
+    return label if label else body.Name
+
+
+def find_bodies(doc) -> List:
+    # Root objects are the top of the dependency tree, e.g. a PartDesign body but not the features it consists of
+    return [obj for obj in doc.RootObjects if hasattr(obj, "Shape") and not obj.Shape.isNull() and obj.Shape.Solids]
+
+
+def export_artifacts(doc, input_file_path: Path, export_dir_path: Path, export_formats: List[str]) -> List[Path]:
+    export_dir_path.mkdir(parents=True, exist_ok=True)
+    artifact_file_paths: List[Path] = []
+    for body in find_bodies(doc):
+        for export_format in export_formats:
+            artifact_file_path = export_dir_path / f"{input_file_path.stem}-{get_body_file_name(body)}.{export_format}"
+            print(f"Exporting {export_format.upper()}:  {input_file_path} ({body.Label}) -> {artifact_file_path}")
+            with atomic_output(artifact_file_path) as tmp_artifact_file_path:
+                if export_format == "stl":
+                    Mesh.export([body], str(tmp_artifact_file_path))
+                else:
+                    body.Shape.exportStep(str(tmp_artifact_file_path))
+            artifact_file_paths.append(artifact_file_path)
+    return artifact_file_paths
+
+
+def export_document(job: Job, output_file_path: Path) -> Tuple[List[Path], List[Path]]:
+    unknown_views = [view for view in job.views if view not in VIEW_COMMANDS]
+    if unknown_views:
+        raise ValueError(f"Unknown views: {unknown_views}")
+    unknown_export_formats = [export_format for export_format in job.export_formats if export_format not in EXPORT_FORMATS]
+    if unknown_export_formats:
+        raise ValueError(f"Unknown export formats: {unknown_export_formats}")
+
+    # Previews and exports share one open (and recompute) of the document
+    doc = FreeCAD.openDocument(str(job.input_file_path))
+    try:
+        if FreeCAD.GuiUp:
+            preview_output_file_paths = export_images(job.input_file_path, output_file_path, job.views, job.sizes)
+        else:
+            preview_output_file_paths = export_images_offscreen(doc, job.input_file_path, output_file_path, job.views, job.sizes)
+        artifact_file_paths: List[Path] = []
+        if job.export_formats:
+            export_dir_path = job.export_dir_path if job.export_dir_path else job.input_file_path.parent
+            artifact_file_paths = export_artifacts(doc, job.input_file_path, export_dir_path, job.export_formats)
+        return preview_output_file_paths, artifact_file_paths
+    finally:
+        FreeCAD.closeDocument(doc.Name)
+
+
+def emit_event(stream: TextIO, event: str, **fields) -> None:
+    stream.write(json.dumps({"event": event, **fields}) + "\n")
+    stream.flush()
+
+
+def is_recycle_due(document_count: int, max_documents: Union[int, None], max_rss: Union[int, None], rss: Union[int, None]) -> bool:
+    return (max_documents is not None and document_count >= max_documents) or (max_rss is not None and rss is not None and rss > max_rss)
+
+
+def export_jobs(
+    jobs: List[Job], event_stream: TextIO, max_documents: Union[int, None] = None, max_rss: Union[int, None] = None, document_count: int = 0
+) -> int:
+    """
+    Export the jobs until a recycle limit is reached, document_count being the documents the process exported before.
+    Returns the number of jobs that were exported.
+    """
+    for job_index, job in enumerate(jobs):
+        if job_index > 0 and (max_documents is not None or max_rss is not None):
+            rss = get_rss()
+            if is_recycle_due(document_count + job_index, max_documents, max_rss, rss):
+                emit_event(event_stream, "recycled", job=job_index - 1, documents=document_count + job_index, rss=rss)
+                return job_index
+
+        input_file_path = job.input_file_path
+        start_time = time.monotonic()
+        emit_event(event_stream, "started", job=job_index, input=str(input_file_path), time=time.time())
+        try:
+            output_file_path = resolve_output_file_path(input_file_path, job.output_file_path)
+            preview_output_file_paths, artifact_file_paths = export_document(job, output_file_path)
+        except Exception as e:
+            duration = time.monotonic() - start_time
+            emit_event(event_stream, "failed", job=job_index, input=str(input_file_path), error=repr(e), time=time.time(), duration=duration)
+        else:
+            duration = time.monotonic() - start_time
+            # fmt: off
+            emit_event(
+                event_stream,
+                "rendered",
+                job=job_index,
+                input=str(input_file_path),
+                output=str(output_file_path),
+                outputs=[str(path) for path in preview_output_file_paths],
+                artifacts=[str(path) for path in artifact_file_paths],
+                time=time.time(),
+                duration=duration
+            )
+            # fmt: on
+    return len(jobs)
+
+
+class Server(NamedTuple):
+    socket: socket.socket
+    socket_path: Path
+    max_documents: Union[int, None]
+    max_rss: Union[int, None]
+
+
+def stop_listening(server: Server) -> None:
+    server.socket.close()
+    server.socket_path.unlink(missing_ok=True)
+
+
+def handle_connection(connection: socket.socket, server: Server, document_count: int) -> Tuple[Union[str, None], int]:
+    """
+    Serve one request. Returns why the server stops ("shutdown", "recycled" or None to keep serving) and the number of
+    documents exported so far.
+    """
+    with connection, connection.makefile("rw", encoding="utf-8") as stream:
+        request_line = stream.readline()
+        if not request_line:
+            return None, document_count
+        request = json.loads(request_line)
+
+        if request.get("command") == "shutdown":
+            emit_event(stream, "finished")
+            return "shutdown", document_count
+
+        jobs = parse_job_requests(request.get("jobs", []))
+        exported_job_count = export_jobs(jobs, stream, server.max_documents, server.max_rss, document_count)
+        document_count += exported_job_count
+        recycled = exported_job_count < len(jobs)
+        if not recycled and jobs and (server.max_documents is not None or server.max_rss is not None):
+            rss = get_rss()
+            if is_recycle_due(document_count, server.max_documents, server.max_rss, rss):
+                emit_event(stream, "recycled", job=len(jobs) - 1, documents=document_count, rss=rss)
+                recycled = True
+        if not recycled:
+            emit_event(stream, "finished")
+            return None, document_count
+
+        # Before the client is told, so it doesn't connect again before the restart
+        stop_listening(server)
+        with suppress(OSError):
+            emit_event(stream, "finished")
+        return "recycled", document_count
+
+
+def is_socket_listening(socket_path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+            return True
+        except OSError:
+            return False
+
+
+def serve(socket_path: Path, max_documents: Union[int, None] = None, max_rss: Union[int, None] = None) -> bool:
+    """
+    Serve requests until shut down or a recycle limit is reached. Returns whether the daemon got recycled.
+    """
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if is_socket_listening(socket_path):
+        print(f"Render daemon already running: {socket_path}")
+        return False
+    # Left behind by a daemon that was killed
+    socket_path.unlink(missing_ok=True)
+
+    server = Server(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), socket_path, max_documents, max_rss)
+    server.socket.bind(str(socket_path))
+    os.chmod(socket_path, 0o600)
+    server.socket.listen()
+    print(f"Render daemon listening: {socket_path}")
+
+    stop_reason: Union[str, None] = None
+    document_count = 0
+    try:
+        while stop_reason is None:
+            connection, _ = server.socket.accept()
+            try:
+                stop_reason, document_count = handle_connection(connection, server, document_count)
+            except (OSError, ValueError) as e:
+                print(f"Render daemon connection error: {e!r}")
+    finally:
+        if stop_reason != "recycled":
+            stop_listening(server)
+    print(f"Render daemon stopped ({stop_reason}) after {document_count} document(s)")
+    return stop_reason == "recycled"
+
+
+print(f"sys.argv: {sys.argv}")
+
+script_args = get_script_args()
+
+if script_args[:1] == ["--serve"]:
+    if serve(Path(script_args[1]), *get_recycle_limits(script_args[2:])):
+        # Without FreeCAD's cleanup, the point of recycling is to free its memory
+        sys.stdout.flush()
+        os._exit(EXIT_CODE_RECYCLED)
+elif script_args[:1] == ["--probe"]:
+    probe_offscreen_rendering(sys.__stdout__ or sys.stdout)
+else:
+    # FreeCAD redirects sys.stdout to its report view, the original stdout is the pipe read by the exporter
+    export_jobs(get_jobs(script_args), sys.__stdout__ or sys.stdout, *get_recycle_limits(script_args))
 
-Gui.doCommand("exit()")
+# FreeCADCmd exits by itself once the script is done
+if FreeCAD.GuiUp:
+    Gui.doCommand("exit()")
@@ -0,0 +1,35 @@
+# Copyright (C) 2024 twyleg
+import os
+import stat
+from pathlib import Path
+
+
+def get_runtime_dir_path() -> Path:
+    """
+    Dir of the render daemon socket, the jobs files and the Xvfb state.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "construction_utils"
+    return Path(f"/tmp/construction_utils-{os.getuid()}")
+
+
+def check_private_dir(dir_path: Path) -> None:
+    dir_stat = os.lstat(dir_path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() or stat.S_IMODE(dir_stat.st_mode) & 0o077:
+        raise PermissionError(f"{dir_path} must be a dir (no symlink) owned by uid {os.getuid()} with mode 0700")
+
+
+def create_private_dir(dir_path: Path) -> Path:
+    """
+    Create a dir only the current user has access to, or check that an existing one is. The runtime dir falls back to
+    /tmp, where another user could have created it beforehand to read the jobs files, take over the daemon socket or
+    plant an Xvfb state pointing at their own X server.
+    """
+    dir_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    dir_stat = os.lstat(dir_path)
+    if stat.S_ISDIR(dir_stat.st_mode) and dir_stat.st_uid == os.getuid() and not stat.S_IMODE(dir_stat.st_mode) & 0o022:
+        # Readable by others (created by an earlier version), but nobody else could have put anything into it
+        os.chmod(dir_path, 0o700)
+    check_private_dir(dir_path)
+    return dir_path
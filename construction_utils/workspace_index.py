@@ -0,0 +1,210 @@
+# Copyright (C) 2024 twyleg
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+logm = logging.getLogger(__name__)
+
+
+class IndexedDirEntry(NamedTuple):
+    name: str
+    is_dir: bool
+    size: int | None
+    mtime_ns: int | None
+
+
+class WorkspaceIndex:
+    """
+        Persistent index of a workspace: the listings of the dirs a scan looked at (with size and modification time of every
+        file) and the parsed construction files.
+
+        A dir is only listed again when its modification time changed, which is the case whenever an entry was added, removed
+        or renamed in it. Files written in place don't change the modification time of their dir, so sizes and modification
+        times are those from when the dir was last listed. Construction files are edited in place and therefore
+        checked by their own size and modification time. An unchanged workspace is opened with one stat per dir and
+        construction file, without listing a dir or reading a file.
+
+        Changes are kept in memory and written by save(). Paths are stored relative to the workspace dir. Dirs and construction
+    files the run didn't look at (removed, renamed or ignored since) are dropped by save().
+    """
+
+    INDEX_VERSION = 2
+    DEFAULT_INDEX_FILE_PATH = Path(".construction_utils/index.sqlite")
+    # A dir modified this recently might change again within the resolution of its modification time without the
+    # modification time changing. Its listing is used but not trusted on the next run.
+    RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+
+    def __init__(self, workspace_dir_path: Path, index_file_path: Path | None = None) -> None:
+        self.workspace_dir_path = workspace_dir_path
+        self.index_file_path = index_file_path if index_file_path else workspace_dir_path / self.DEFAULT_INDEX_FILE_PATH
+        self._absolute_workspace_dir_path = os.path.abspath(workspace_dir_path)
+        self._absolute_workspace_dir_prefix = os.path.join(self._absolute_workspace_dir_path, "")
+        self._listings: Dict[str, Tuple[int | None, List[IndexedDirEntry]]] = {}
+        self._construction_files: Dict[str, Tuple[int, int | None, str]] = {}
+        self._changed_listing_keys: Set[str] = set()
+        self._changed_construction_file_keys: Set[str] = set()
+        self._visited_listing_keys: Set[str] = set()
+        self._visited_construction_file_keys: Set[str] = set()
+        self._lock = threading.Lock()
+        self.__load()
+
+    def __load(self) -> None:
+        if not self.index_file_path.exists():
+            return
+        try:
+            with closing(sqlite3.connect(self.index_file_path)) as connection:
+                version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+                if version is None or int(version[0]) != self.INDEX_VERSION:
+                    raise ValueError(f"index version {version[0] if version else None}, expected {self.INDEX_VERSION}")
+                directories = connection.execute("SELECT path, mtime_ns FROM directories").fetchall()
+                files = connection.execute("SELECT directory, name, is_dir, size, mtime_ns FROM files ORDER BY directory, name").fetchall()
+                construction_files = connection.execute("SELECT path, size, mtime_ns, things_data FROM construction_files").fetchall()
+        except (sqlite3.Error, ValueError) as e:
+            # The index only caches what is on disk, start over with a new one
+            logm.warning("Unable to read workspace index %s (%s) - scanning the whole workspace", self.index_file_path, e)
+            self.index_file_path.unlink(missing_ok=True)
+            return
+        self._listings = {path: (mtime_ns, []) for path, mtime_ns in directories}
+        for directory, name, is_dir, size, mtime_ns in files:
+            if directory in self._listings:
+                self._listings[directory][1].append(IndexedDirEntry(name, bool(is_dir), size, mtime_ns))
+        self._construction_files = {path: (size, mtime_ns, things_data) for path, size, mtime_ns, things_data in construction_files}
+
+    def __key(self, path: Path) -> str:
+        # String operations instead of Path.relative_to(), keys are computed for every dir and file of a scan
+        absolute_path = os.path.abspath(path)
+        if absolute_path == self._absolute_workspace_dir_path:
+            return "."
+        if absolute_path.startswith(self._absolute_workspace_dir_prefix):
+            absolute_path = absolute_path[len(self._absolute_workspace_dir_prefix) :]
+        return absolute_path.replace(os.sep, "/")
+
+    @classmethod
+    def __trusted_mtime_ns(cls, mtime_ns: int) -> int | None:
+        return mtime_ns if time.time_ns() - mtime_ns > cls.RACY_INTERVAL_NS else None
+
+    @staticmethod
+    def __list_dir(dir_path: Path) -> List[IndexedDirEntry]:
+        entries: List[IndexedDirEntry] = []
+        with os.scandir(dir_path) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.is_dir():
+                    entries.append(IndexedDirEntry(dir_entry.name, True, None, None))
+                    continue
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    # Removed while listing, or a broken symlink
+                    continue
+                entries.append(IndexedDirEntry(dir_entry.name, False, stat.st_size, stat.st_mtime_ns))
+        entries.sort()
+        return entries
+
+    def list_dir(self, dir_path: Path) -> List[IndexedDirEntry]:
+        """
+        Entries of the dir sorted by name, listed again only if the dir was modified since it was last listed. Empty if
+        the dir doesn't exist.
+        """
+        key = self.__key(dir_path)
+        with self._lock:
+            self._visited_listing_keys.add(key)
+            mtime_ns, entries = self._listings.get(key, (None, []))
+        try:
+            stat = os.stat(dir_path)
+            if stat.st_mtime_ns == mtime_ns:
+                return entries
+            entries = self.__list_dir(dir_path)
+        except OSError:
+            with self._lock:
+                if self._listings.pop(key, None) is not None:
+                    self._changed_listing_keys.add(key)
+            return []
+        with self._lock:
+            self._listings[key] = (self.__trusted_mtime_ns(stat.st_mtime_ns), entries)
+            self._changed_listing_keys.add(key)
+        return entries
+
+    def read_construction_file(self, construction_file_path: Path) -> Dict[str, Any]:
+        """
+        Parsed construction file, read again only if its size or modification time changed since it was last read.
+        """
+        key = self.__key(construction_file_path)
+        stat = os.stat(construction_file_path)
+        with self._lock:
+            self._visited_construction_file_keys.add(key)
+            construction_file = self._construction_files.get(key)
+        if construction_file is not None and construction_file[0] == stat.st_size and construction_file[1] == stat.st_mtime_ns:
+            return json.loads(construction_file[2])
+        with open(construction_file_path, "r") as json_file:
+            things_data = json.load(json_file)
+        with self._lock:
+            self._construction_files[key] = (stat.st_size, self.__trusted_mtime_ns(stat.st_mtime_ns), json.dumps(things_data))
+            self._changed_construction_file_keys.add(key)
+        return things_data
+
+    def save(self) -> None:
+        """
+        Write the changes of this run and drop the dirs and construction files it didn't visit. Call it after a full scan.
+        """
+        with self._lock:
+            for key in set(self._listings) - self._visited_listing_keys:
+                del self._listings[key]
+                self._changed_listing_keys.add(key)
+            for key in set(self._construction_files) - self._visited_construction_file_keys:
+                del self._construction_files[key]
+                self._changed_construction_file_keys.add(key)
+            changed_listings = {key: self._listings.get(key) for key in self._changed_listing_keys}
+            changed_construction_files = {key: self._construction_files.get(key) for key in self._changed_construction_file_keys}
+            self._changed_listing_keys.clear()
+            self._changed_construction_file_keys.clear()
+            self._visited_listing_keys.clear()
+            self._visited_construction_file_keys.clear()
+        try:
+            self.index_file_path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(sqlite3.connect(self.index_file_path)) as connection:
+                with connection:
+                    self.__create_schema(connection)
+                    for key, listing in changed_listings.items():
+                        connection.execute("DELETE FROM files WHERE directory = ?", (key,))
+                        if listing is None:
+                            connection.execute("DELETE FROM directories WHERE path = ?", (key,))
+                            continue
+                        connection.execute("INSERT OR REPLACE INTO directories (path, mtime_ns) VALUES (?, ?)", (key, listing[0]))
+                        # fmt: off
+                        connection.executemany(
+                            "INSERT INTO files (directory, name, is_dir, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                            [(key, *entry) for entry in listing[1]]
+                        )
+                        # fmt: on
+                    for key, construction_file in changed_construction_files.items():
+                        if construction_file is None:
+                            connection.execute("DELETE FROM construction_files WHERE path = ?", (key,))
+                            continue
+                        # fmt: off
+                        connection.execute(
+                            "INSERT OR REPLACE INTO construction_files (path, size, mtime_ns, things_data) VALUES (?, ?, ?, ?)",
+                            (key, *construction_file)
+                        )
+                        # fmt: on
+        except sqlite3.Error as e:
+            logm.warning("Unable to write workspace index %s (%s)", self.index_file_path, e)
+
+    def __create_schema(self, connection: sqlite3.Connection) -> None:
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime_ns INTEGER)")
+        # fmt: off
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(directory TEXT NOT NULL, name TEXT NOT NULL, is_dir INTEGER NOT NULL, size INTEGER, mtime_ns INTEGER, PRIMARY KEY (directory, name))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS construction_files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER, things_data TEXT NOT NULL)"
+        )
+        # fmt: on
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(self.INDEX_VERSION),))
@@ -0,0 +1,232 @@
+# Copyright (C) 2024 twyleg
+import fcntl
+import json
+import logging
+import os
+import secrets
+import select
+import signal
+import struct
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import which
+from typing import Any, Dict, Iterator, List
+
+from construction_utils.runtime_dir import create_private_dir, get_runtime_dir_path
+
+
+logm = logging.getLogger(__name__)
+
+
+# Xauthority entry that matches any host and display
+XAUTH_FAMILY_WILD = 0xFFFF
+XAUTH_COOKIE_NAME = b"MIT-MAGIC-COOKIE-1"
+
+
+def get_default_xvfb_state_dir_path() -> Path:
+    return get_runtime_dir_path() / "xvfb"
+
+
+def write_xauthority_file(xauthority_file_path: Path, cookie: bytes) -> None:
+    """
+    Xauthority file (the format xauth writes) with a single MIT-MAGIC-COOKIE-1 entry for any display. Xvfb loads it with
+    -auth and then only accepts clients with the cookie, which FreeCAD finds through XAUTHORITY.
+    """
+    entry = struct.pack(">H", XAUTH_FAMILY_WILD)
+    for field in (b"", b"", XAUTH_COOKIE_NAME, cookie):
+        entry += struct.pack(">H", len(field)) + field
+    tmp_xauthority_file_path = xauthority_file_path.with_name(f".{xauthority_file_path.name}.{os.getpid()}.tmp")
+    with os.fdopen(os.open(tmp_xauthority_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as xauthority_file:
+        xauthority_file.write(entry)
+    os.replace(tmp_xauthority_file_path, xauthority_file_path)
+
+
+def get_software_gl_environment(render_threads: int) -> Dict[str, str]:
+    """
+    Mesa settings for predictable rendering on machines without GPU: always the llvmpipe software rasterizer with a
+    fixed number of threads, even if a (vendor) GL driver is installed.
+    """
+    # fmt: off
+    return {
+        "LIBGL_ALWAYS_SOFTWARE": "1",
+        "GALLIUM_DRIVER": "llvmpipe",
+        "LP_NUM_THREADS": str(render_threads),
+        "__GLX_VENDOR_LIBRARY_NAME": "mesa",
+    }
+    # fmt: on
+
+
+class XvfbStartupError(Exception):
+    pass
+
+
+class XvfbManager:
+    """
+    Small fixed set of Xvfb servers shared by all FreeCAD workers.
+
+    Compared to xvfb-run, which starts an X server (probing for a free display) for every FreeCAD process, the servers
+    are started once and reused by later runs: their displays and pids are recorded in a state dir, and a server that
+    is still alive is picked up again instead of starting a new one. stop() shuts them down.
+    """
+
+    SCREEN = "1280x1024x24"
+    STARTUP_TIMEOUT = 10.0
+    STATE_FILE_NAME = "servers.json"
+    LOCK_FILE_NAME = ".lock"
+    XAUTHORITY_FILE_NAME = "xauthority"
+
+    def __init__(self, server_count: int = 1, render_threads: int = 1, state_dir_path: Path | None = None) -> None:
+        self.server_count = max(1, server_count)
+        self.render_threads = max(1, render_threads)
+        self.state_dir_path = state_dir_path if state_dir_path else get_default_xvfb_state_dir_path()
+        self.xauthority_file_path = self.state_dir_path / self.XAUTHORITY_FILE_NAME
+        self._displays: List[str] = []
+
+    @staticmethod
+    def is_available() -> bool:
+        return which("Xvfb") is not None
+
+    @property
+    def displays(self) -> List[str]:
+        return self._displays
+
+    def get_environment(self, display: str) -> Dict[str, str]:
+        return {"DISPLAY": display, "XAUTHORITY": str(self.xauthority_file_path), **get_software_gl_environment(self.render_threads)}
+
+    @contextmanager
+    def __lock(self) -> Iterator[None]:
+        try:
+            if self.state_dir_path == get_default_xvfb_state_dir_path():
+                create_private_dir(self.state_dir_path.parent)
+            create_private_dir(self.state_dir_path)
+        except OSError as e:
+            raise XvfbStartupError(f"Unusable Xvfb state dir ({e})") from e
+        with open(self.state_dir_path / self.LOCK_FILE_NAME, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __read_state(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.state_dir_path / self.STATE_FILE_NAME, "r") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return []
+
+    def __write_state(self, servers: List[Dict[str, Any]]) -> None:
+        tmp_state_file_path = self.state_dir_path / f".{self.STATE_FILE_NAME}.{os.getpid()}.tmp"
+        with open(tmp_state_file_path, "w") as state_file:
+            json.dump(servers, state_file, indent=4)
+        os.replace(tmp_state_file_path, self.state_dir_path / self.STATE_FILE_NAME)
+
+    @staticmethod
+    def __is_alive(server: Dict[str, Any]) -> bool:
+        # The pid alone could have been reused by another process since the server was recorded
+        try:
+            cmdline = Path(f"/proc/{server['pid']}/cmdline").read_bytes().split(b"\0")
+        except OSError:
+            return False
+        if not any(os.path.basename(arg) == b"Xvfb" for arg in cmdline[:2]):
+            return False
+        return Path(f"/tmp/.X11-unix/X{server['display'].lstrip(':')}").exists()
+
+    @staticmethod
+    def __kill(server: Dict[str, Any]) -> None:
+        try:
+            os.kill(server["pid"], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def __ensure_xauthority_file(self) -> None:
+        # Kept between runs, the running servers were started with its cookie
+        if not self.xauthority_file_path.exists():
+            write_xauthority_file(self.xauthority_file_path, secrets.token_bytes(16))
+
+    def __start_server(self) -> Dict[str, Any]:
+        read_fd, write_fd = os.pipe()
+        try:
+            # -displayfd lets Xvfb pick a free display itself and report it, no probing and no races between servers
+            # fmt: off
+            process = subprocess.Popen(
+                [
+                    "Xvfb", "-displayfd", str(write_fd), "-screen", "0", self.SCREEN, "-nolisten", "tcp", "-auth", str(self.xauthority_file_path),
+                    "+extension", "GLX", "-noreset"
+                ],
+                pass_fds=(write_fd,),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                env={**os.environ, **get_software_gl_environment(self.render_threads)},
+                # Detached, so the server outlives this run and can be reused by the next one
+                start_new_session=True
+            )
+            # fmt: on
+        except OSError as e:
+            os.close(read_fd)
+            raise XvfbStartupError(f"Unable to start Xvfb: {e}") from e
+        finally:
+            os.close(write_fd)
+
+        with os.fdopen(read_fd, "rb") as display_pipe:
+            output = b""
+            deadline = time.monotonic() + self.STARTUP_TIMEOUT
+            while not output.endswith(b"\n"):
+                readable, _, _ = select.select([display_pipe], [], [], max(0.0, deadline - time.monotonic()))
+                chunk = display_pipe.read1(64) if readable else b""
+                if not chunk:
+                    process.kill()
+                    raise XvfbStartupError(f"Xvfb did not report a display within {self.STARTUP_TIMEOUT}s")
+                output += chunk
+
+        # fmt: off
+        server = {
+            "display": f":{int(output)}", "pid": process.pid, "screen": self.SCREEN, "render_threads": self.render_threads, "xauthority": str(self.xauthority_file_path)
+        }
+        # fmt: on
+        logm.info("Started Xvfb %s (pid %d)", server["display"], server["pid"])
+        return server
+
+    def start(self) -> List[str]:
+        """
+        Make sure server_count servers are running and return their displays.
+        """
+        with self.__lock():
+            self.__ensure_xauthority_file()
+            servers = []
+            for server in self.__read_state():
+                if not self.__is_alive(server):
+                    continue
+                if server.get("xauthority") != str(self.xauthority_file_path):
+                    # Started by an earlier version without access control, any local user could connect to it
+                    logm.info("Stopping Xvfb %s (pid %d) without access control", server["display"], server["pid"])
+                    self.__kill(server)
+                    continue
+                servers.append(server)
+            reused_server_count = len(servers)
+            try:
+                while len(servers) < self.server_count:
+                    servers.append(self.__start_server())
+            finally:
+                self.__write_state(servers)
+
+        if reused_server_count:
+            logm.info("Reusing %d running Xvfb server(s)", min(reused_server_count, self.server_count))
+        self._displays = [server["display"] for server in servers[: self.server_count]]
+        return self._displays
+
+    def stop(self) -> int:
+        """
+        Stop all recorded servers, including those started by earlier runs. Returns the number of stopped servers.
+        """
+        with self.__lock():
+            servers = [server for server in self.__read_state() if self.__is_alive(server)]
+            for server in servers:
+                logm.info("Stopping Xvfb %s (pid %d)", server["display"], server["pid"])
+                self.__kill(server)
+            self.__write_state([])
+        self._displays = []
+        return len(servers)
@@ -29,8 +29,12 @@ setup(
     include_package_data=True,
     install_requires=[
         "simple-python-app~=0.4.0",
-        "jinja2~=3.1.4"
+        "jinja2~=3.1.4",
+        "pathspec>=0.12.1"
     ],
+    extras_require={
+        "optimize": ["Pillow>=9.0"],
+    },
     entry_points={
         "console_scripts": [
             "construction_utils = construction_utils.main:main",
@@ -0,0 +1,108 @@
+# Copyright (C) 2024 twyleg
+import os
+import signal
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+from xml.etree import ElementTree
+
+# Run as FreeCADCmd, the console FreeCAD without GUI
+GuiUp = 0 if os.environ.get("FAKE_FREECAD_CONSOLE") else 1
+
+BODY_TYPES = ("PartDesign::Body", "Part::Feature")
+
+
+class Shape:
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.Solids = [label]
+
+    def isNull(self) -> bool:
+        return False
+
+    def writeInventor(self) -> str:
+        return f'#Inventor V2.1 ascii\n\nSeparator {{ Label {{ label "{self.label}" }} }}\n'
+
+    def exportStep(self, file_path: str) -> None:
+        with open(file_path, "w") as step_file:
+            step_file.write(f"ISO-10303-21;\nHEADER;\nFILE_NAME('{self.label}');\nENDSEC;\nDATA;\nENDSEC;\nEND-ISO-10303-21;\n")
+
+
+class Vector:
+    def __init__(self, x: float = 0.0, y: float = 0.0, z: float = 0.0) -> None:
+        self.x, self.y, self.z = x, y, z
+
+    def __mul__(self, factor: float) -> "Vector":
+        return Vector(self.x * factor, self.y * factor, self.z * factor)
+
+    def cross(self, other: "Vector") -> "Vector":
+        return Vector(self.y * other.z - self.z * other.y, self.z * other.x - self.x * other.z, self.x * other.y - self.y * other.x)
+
+    def normalize(self) -> "Vector":
+        length = (self.x**2 + self.y**2 + self.z**2) ** 0.5
+        return self * (1.0 / length) if length else self
+
+
+class Matrix:
+    def __init__(self, *values: float) -> None:
+        self.values = values
+
+
+class Rotation:
+    def __init__(self, matrix: Matrix) -> None:
+        # Only passed on to the camera, which the fake renderer ignores
+        self.Q = (0.0, 0.0, 0.0, 1.0)
+
+
+class DocumentObject:
+    def __init__(self, name: str, label: str) -> None:
+        self.Name = name
+        self.Label = label
+        self.Shape = Shape(label)
+
+
+class Document:
+    def __init__(self, name: str, objects: List[DocumentObject]) -> None:
+        self.Name = name
+        self.Objects = objects
+        self.RootObjects = objects
+
+
+_documents: Dict[str, Document] = {}
+
+
+def _read_bodies(file_path: str) -> List[DocumentObject]:
+    with zipfile.ZipFile(file_path) as fcstd_file:
+        document = ElementTree.fromstring(fcstd_file.read("Document.xml"))
+
+    body_names = [obj.get("name", "") for objects in document.iter("Objects") for obj in objects if obj.get("type") in BODY_TYPES]
+    labels: Dict[str, str] = {}
+    for object_data in document.iter("ObjectData"):
+        for obj in object_data:
+            for obj_property in obj.iter("Property"):
+                string_element = obj_property.find("String")
+                if obj_property.get("name") == "Label" and string_element is not None:
+                    labels[obj.get("name", "")] = string_element.get("value", "")
+    return [DocumentObject(name, labels.get(name, name)) for name in body_names]
+
+
+def openDocument(file_path: str) -> Document:
+    delay = float(os.environ.get("FAKE_FREECAD_DOCUMENT_DELAY", "0"))
+    delay += float(os.environ.get("FAKE_FREECAD_DELAY_PER_MIB", "0")) * os.path.getsize(file_path) / (1024 * 1024)
+    time.sleep(delay)
+    file_name = Path(file_path).name
+    if file_name == os.environ.get("FAKE_FREECAD_HANG_ON"):
+        time.sleep(24 * 60 * 60)
+    if file_name == os.environ.get("FAKE_FREECAD_CRASH_ON"):
+        # Like a segfault of FreeCAD in the middle of a document
+        os.kill(os.getpid(), signal.SIGSEGV)
+
+    name = Path(file_path).stem
+    document = Document(name, _read_bodies(file_path))
+    _documents[name] = document
+    return document
+
+
+def closeDocument(name: str) -> None:
+    del _documents[name]
@@ -0,0 +1,26 @@
+# Copyright (C) 2024 twyleg
+import sys
+
+from PySide import QtGui
+
+
+class View3D:
+    def saveImage(self, file_path: str, width: int, height: int, background: str) -> None:
+        QtGui.QImage(width, height, QtGui.QImage.Format_RGB888).save(file_path)
+
+
+class GuiDocument:
+    def __init__(self) -> None:
+        self.ActiveView = View3D()
+
+
+ActiveDocument = GuiDocument()
+
+
+def SendMsgToActiveView(message: str) -> None:
+    pass
+
+
+def doCommand(command: str) -> None:
+    if command == "exit()":
+        sys.exit(0)
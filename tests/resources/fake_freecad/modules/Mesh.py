@@ -0,0 +1,8 @@
+# Copyright (C) 2024 twyleg
+from typing import Any, List
+
+
+def export(objects: List[Any], file_path: str) -> None:
+    with open(file_path, "w") as stl_file:
+        for obj in objects:
+            stl_file.write(f"solid {obj.Label}\nendsolid {obj.Label}\n")
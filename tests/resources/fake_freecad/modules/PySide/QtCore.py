@@ -0,0 +1,6 @@
+# Copyright (C) 2024 twyleg
+
+
+class Qt:
+    KeepAspectRatio = 1
+    SmoothTransformation = 1
@@ -0,0 +1,54 @@
+# Copyright (C) 2024 twyleg
+import struct
+import zlib
+from typing import Any
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+class QImage:
+    """
+    Blank white image that is written as valid RGB PNG. Only tracks the size, which is all the export script relies on.
+    """
+
+    Format_RGB888 = 13
+
+    def __init__(self, *args: Any) -> None:
+        if len(args) == 1:
+            # QImage(file_path): only the size of the PNG is read
+            with open(args[0], "rb") as png_file:
+                header = png_file.read(24)
+            if header[:8] != PNG_SIGNATURE:
+                raise ValueError(f"Not a PNG file: {args[0]}")
+            self.width, self.height = struct.unpack(">II", header[16:24])
+        else:
+            # QImage(width, height, format) or QImage(buffer, width, height, bytes_per_line, format)
+            self.width, self.height = args[:2] if isinstance(args[0], int) else args[1:3]
+
+    def scaled(self, width: int, height: int, aspect_ratio_mode: int = 0, transformation_mode: int = 0) -> "QImage":
+        scale = min(width / self.width, height / self.height)
+        return QImage(max(1, round(self.width * scale)), max(1, round(self.height * scale)), self.Format_RGB888)
+
+    def mirrored(self) -> "QImage":
+        return self
+
+    def save(self, file_path: str) -> bool:
+        row = b"\x00" + b"\xff" * (self.width * 3)
+        # fmt: off
+        png = b"".join([
+            PNG_SIGNATURE,
+            _png_chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)),
+            _png_chunk(b"IDAT", zlib.compress(row * self.height)),
+            _png_chunk(b"IEND", b"")
+        ])
+        # fmt: on
+        try:
+            with open(file_path, "wb") as png_file:
+                png_file.write(png)
+        except OSError:
+            return False
+        return True
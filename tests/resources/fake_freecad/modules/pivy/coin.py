@@ -0,0 +1,99 @@
+# Copyright (C) 2024 twyleg
+import os
+from typing import Any, List
+
+
+class _Field:
+    def __init__(self) -> None:
+        self.value: Any = None
+
+    def setValue(self, *args: Any) -> None:
+        self.value = args
+
+
+class _Value:
+    def __init__(self, *args: Any) -> None:
+        self.args = args
+
+
+class SbColor(_Value):
+    pass
+
+
+class SbVec3f(_Value):
+    pass
+
+
+class SbRotation(_Value):
+    pass
+
+
+class SbViewportRegion:
+    def __init__(self, width: int, height: int) -> None:
+        self.width, self.height = width, height
+
+
+class SoNode:
+    def __init__(self) -> None:
+        self.children: List["SoNode"] = []
+
+    def addChild(self, child: "SoNode") -> None:
+        self.children.append(child)
+
+
+class SoSeparator(SoNode):
+    pass
+
+
+class SoCube(SoNode):
+    pass
+
+
+class SoMaterial(SoNode):
+    def __init__(self) -> None:
+        super().__init__()
+        self.diffuseColor = _Field()
+
+
+class SoDirectionalLight(SoNode):
+    def __init__(self) -> None:
+        super().__init__()
+        self.direction = _Field()
+
+
+class SoOrthographicCamera(SoNode):
+    def __init__(self) -> None:
+        super().__init__()
+        self.orientation = _Field()
+
+    def viewAll(self, scene: SoNode, viewport: SbViewportRegion) -> None:
+        pass
+
+
+class SoInput:
+    def setBuffer(self, buffer: str) -> None:
+        self.buffer = buffer
+
+
+class SoDB:
+    @staticmethod
+    def readAll(scene_input: SoInput) -> SoSeparator:
+        return SoSeparator()
+
+
+class SoOffscreenRenderer:
+    """
+    Fails like Coin does without an OpenGL context if FAKE_FREECAD_OFFSCREEN_UNAVAILABLE is set, renders a blank image otherwise.
+    """
+
+    def __init__(self, viewport: SbViewportRegion) -> None:
+        self.viewport = viewport
+
+    def setBackgroundColor(self, color: SbColor) -> None:
+        pass
+
+    def render(self, root: SoNode) -> bool:
+        return not os.environ.get("FAKE_FREECAD_OFFSCREEN_UNAVAILABLE")
+
+    def getBuffer(self) -> bytes:
+        return b"\xff" * (self.viewport.width * self.viewport.height * 3)
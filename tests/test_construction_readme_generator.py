@@ -1,12 +1,16 @@
 # Copyright (C) 2024 twyleg
+import json
 import shutil
+import subprocess
+import time
 
 import pytest
 
 import logging
 from pathlib import Path
 
-from construction_utils.readme_generator import Construction, Workspace, ConstructionReadmeGenerator, WorkspaceReadmeGenerator
+from construction_utils.freecad_exporter import RENDER_BACKEND_GUI
+from construction_utils.readme_generator import Construction, Workspace, ConstructionReadmeGenerator, WorkspaceReadmeGenerator, generate_readmes_for_workspace
 
 #
 # General naming convention for unit tests:
@@ -15,6 +19,7 @@ from construction_utils.readme_generator import Construction, Workspace, Constru
 
 
 FILE_DIR = Path(__file__).parent
+FAKE_FREECAD_FILE_PATH = FILE_DIR / "resources/fake_freecad/freecad"
 
 
 @pytest.fixture(autouse=True)
@@ -47,6 +52,128 @@ class TestConstructionReader:
         assert len(construction.filepaths_3d) == 3
         assert len(construction.filepaths_gcode) == 1
 
+        assert construction.preview_views == ["axo"]
+        assert construction.export_3d_formats == ["stl"]
+        assert construction.filepaths_source_previews[Path("source/example_part_a.FCStd")] == {"axo": Path("img/previews/example_part_a.png")}
+        assert construction.filepaths_source_preview_derivatives[Path("source/example_part_a.FCStd")] == {
+            "axo": {200: Path("img/previews/example_part_a-200.png"), 400: Path("img/previews/example_part_a-400.png")}
+        }
+
+    def test_ConstructionWithPreviewViews_ReadConstruction_ViewPreviewsAvailable(self, caplog, workspace):
+        construction_file_path = workspace / "construction_a/construction.json"
+        things_data = json.loads(construction_file_path.read_text())
+        things_data["preview_views"] = ["axo", "front", "top"]
+        construction_file_path.write_text(json.dumps(things_data))
+
+        construction = Construction(workspace / "construction_a")
+
+        assert construction.filepaths_source_previews[Path("source/example_part_a.FCStd")] == {
+            "axo": Path("img/previews/example_part_a.png"),
+            "front": Path("img/previews/example_part_a-front.png"),
+            "top": Path("img/previews/example_part_a-top.png"),
+        }
+
+    def test_FilesWithUppercaseExtensionsAndHiddenFiles_ReadConstruction_OnlyVisibleFilesOfKnownTypesListed(self, caplog, workspace):
+        shutil.copy(workspace / "construction_a/source/example_part_a.FCStd", workspace / "construction_a/source/example_part_d.fcstd")
+        (workspace / "construction_a/img/03-example_img.JPG").write_bytes(b"jpg")
+        (workspace / "construction_a/img/.04-example_img.tmp.png").write_bytes(b"png")
+        (workspace / "construction_a/img/notes.txt").write_text("notes")
+        (workspace / "construction_a/3d/directory.stl").mkdir()
+
+        construction = Construction(workspace / "construction_a")
+
+        assert [file_path for file_path, _ in construction.filepaths_source] == [
+            Path("source/example_part_a.FCStd"),
+            Path("source/example_part_b.FCStd"),
+            Path("source/example_part_c.FCStd"),
+            Path("source/example_part_d.fcstd"),
+        ]
+        assert construction.filepaths_img == [
+            Path("img/00-example_img.png"),
+            Path("img/01-example_img.png"),
+            Path("img/02-example_img.png"),
+            Path("img/03-example_img.JPG"),
+        ]
+        assert len(construction.filepaths_3d) == 3
+
+    def test_ConstructionWithInvalidConstructionFile_ReadFilePaths_ConstructionFileNotRead(self, caplog, workspace):
+        (workspace / "construction_a/construction.json").write_text("{invalid")
+
+        construction = Construction(workspace / "construction_a")
+
+        assert len(construction.filepaths_img) == 3
+        assert "things_data" not in vars(construction)
+        assert "filepaths_3d" not in vars(construction)
+        with pytest.raises(json.JSONDecodeError):
+            construction.things_data
+
+
+class TestWorkspace:
+    def test_ValidConstructionWorkspace_IterateTwice_EachConstructionScannedOnce(self, caplog, workspace):
+        scanned_constructions = []
+        construction_workspace = Workspace(workspace, construction_scanned_callback=scanned_constructions.append)
+
+        assert scanned_constructions == []
+        first_construction = next(iter(construction_workspace))
+        assert scanned_constructions == [first_construction]
+
+        constructions = list(construction_workspace)
+        assert constructions[0] is first_construction
+        assert constructions == construction_workspace.constructions == scanned_constructions
+        assert [construction.construction_relative_dir_path for construction in constructions] == [
+            Path("construction_a"),
+            Path("construction_b"),
+            Path("construction_c"),
+        ]
+
+    def test_ManyConstructions_IterateWithScanConcurrency_ConstructionsScannedInNameOrder(self, caplog, workspace):
+        for index in range(20):
+            shutil.copytree(workspace / "construction_b", workspace / f"construction_d_{19 - index:02d}")
+        (workspace / "no_construction").mkdir()
+        (workspace / "readme_notes.txt").write_text("notes")
+        scanned_constructions = []
+
+        construction_workspace = Workspace(workspace, construction_scanned_callback=scanned_constructions.append, scan_concurrency=4)
+        constructions = construction_workspace.constructions
+
+        assert constructions == scanned_constructions
+        assert [construction.construction_relative_dir_path for construction in constructions] == [
+            construction.construction_relative_dir_path for construction in Workspace(workspace)
+        ]
+        assert len(constructions) == 23
+        assert constructions[3].construction_relative_dir_path == Path("construction_d_00")
+        assert all("things_data" in vars(construction) and "filepaths_gcode" in vars(construction) for construction in constructions)
+
+    @pytest.mark.parametrize("scan_concurrency", [1, 4])
+    def test_NestedWorkspaceWithIgnoreFiles_IterateWorkspace_ConstructionsOfNotIgnoredDirsFound(self, caplog, workspace, scan_concurrency):
+        construction_template_dir_path = workspace / "construction_b"
+        for construction_dir_name in [
+            "household/kitchen/spice_rack",
+            "household/lamp",
+            "household/lamp/nested_construction",
+            "household/wip_chair",
+            "printer_parts/spool_holder",
+            "archive/old_construction",
+            ".git/construction",
+            "venv/construction",
+            ".logs/construction",
+        ]:
+            shutil.copytree(construction_template_dir_path, workspace / construction_dir_name)
+        (workspace / ".gitignore").write_text("/archive/\n")
+        (workspace / "household/.constructionignore").write_text("wip_*\n")
+
+        constructions = Workspace(workspace, scan_concurrency=scan_concurrency).constructions
+
+        assert [construction.construction_relative_dir_path for construction in constructions] == [
+            Path("construction_a"),
+            Path("construction_b"),
+            Path("construction_c"),
+            Path("household/kitchen/spice_rack"),
+            Path("household/lamp"),
+            Path("printer_parts/spool_holder"),
+        ]
+        assert constructions[4].construction_dir_path == workspace / "household/lamp"
+
 
 class TestConstructionReadmeGenerator:
     def test_ValidConstructionWorkspace_GenerateConstructionReadme_ReadmeGenerated(self, caplog, workspace):
@@ -57,9 +184,113 @@ class TestConstructionReadmeGenerator:
 
 
 class TestWorkspaceReadmeGenerator:
+    def test_ConstructionInCategoryDir_GenerateWorkspaceReadme_ConstructionLinkedByRelativePath(self, caplog, workspace):
+        shutil.move(workspace / "construction_b", workspace / "household/construction_b")
+
+        WorkspaceReadmeGenerator(Workspace(workspace)).generate()
+
+        readme = (workspace / "README.md").read_text()
+        assert 'href="household/construction_b/README.md"' in readme
+        assert 'src="household/construction_b/img/' in readme
+
     def test_ValidConstructionWorkspace_GenerateWorkspaceReadme_ReadmeGenerated(self, caplog, workspace):
         construction_workspace = Workspace(workspace)
         construction_workspace_readme_generator = WorkspaceReadmeGenerator(construction_workspace)
         construction_workspace_readme_generator.generate()
         for construction in construction_workspace.constructions:
             print(construction.construction_dir_path)
+
+    def test_ConstructionWithoutImages_GenerateWorkspaceReadme_PreviewUsedAsThumbnail(self, caplog, workspace):
+        for image_file_path in (workspace / "construction_a/img").glob("*.png"):
+            image_file_path.unlink()
+
+        construction_workspace = Workspace(workspace)
+        WorkspaceReadmeGenerator(construction_workspace).generate()
+
+        readme = (workspace / "README.md").read_text()
+        assert 'src="construction_a/img/previews/example_part_a-400.png"' in readme
+        assert "construction_a/img/previews/example_part_a.png 2x" in readme
+
+
+class TestGenerateReadmesForWorkspace:
+    def test_ExportWithHangingFreecad_InterruptDuringGeneration_WorkersKilledAndInterruptRaised(self, caplog, tmp_path, workspace, monkeypatch):
+        monkeypatch.setenv("FREECAD_EXECUTABLE", str(FAKE_FREECAD_FILE_PATH))
+        monkeypatch.setenv("FAKE_FREECAD_DOCUMENT_DELAY", "3600")
+        started_processes = []
+
+        class RecordingPopen(subprocess.Popen):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                started_processes.append(self)
+
+        def interrupt(workspace_readme_generator):
+            # Ctrl-C once FreeCAD is busy with the first document
+            deadline = time.monotonic() + 30.0
+            while not started_processes and time.monotonic() < deadline:
+                time.sleep(0.05)
+            raise KeyboardInterrupt()
+
+        monkeypatch.setattr(subprocess, "Popen", RecordingPopen)
+        monkeypatch.setattr(WorkspaceReadmeGenerator, "generate", interrupt)
+
+        start_time = time.monotonic()
+        with pytest.raises(KeyboardInterrupt):
+            # fmt: off
+            generate_readmes_for_workspace(
+                workspace,
+                workers=1,
+                render_daemon_socket_path=tmp_path / "no_daemon.sock",
+                render_cache_enabled=False,
+                xvfb_servers=0,
+                render_backend=RENDER_BACKEND_GUI
+            )
+            # fmt: on
+
+        assert time.monotonic() - start_time < 30.0
+        assert len(started_processes) == 1
+        assert started_processes[0].wait(timeout=10.0) == -9
+        assert "Export aborted, killed 1 FreeCAD worker(s)" in caplog.text
+        assert "respawning worker" not in caplog.text
+
+    def test_FreecadCrashingOnOneDocument_GenerateReadmesForWorkspace_FailureReturnedAndReported(self, caplog, tmp_path, workspace, monkeypatch):
+        monkeypatch.setenv("FREECAD_EXECUTABLE", str(FAKE_FREECAD_FILE_PATH))
+        monkeypatch.setenv("FAKE_FREECAD_CRASH_ON", "example_part_c.FCStd")
+
+        # fmt: off
+        export_failures = generate_readmes_for_workspace(
+            workspace,
+            workers=1,
+            render_daemon_socket_path=tmp_path / "no_daemon.sock",
+            render_cache_enabled=False,
+            xvfb_servers=0,
+            render_backend=RENDER_BACKEND_GUI
+        )
+        # fmt: on
+
+        assert {failure.job.input_file_path.name for failure in export_failures} == {"example_part_c.FCStd"}
+        assert len(json.loads((workspace / ".construction_utils/export_failures.json").read_text())["failures"]) == len(export_failures)
+        assert (workspace / "construction_a/img/previews/example_part_a.png").exists()
+
+    def test_ConstructionFileWithInvalidViews_GenerateReadmesForWorkspace_OnlyThatConstructionSkipped(self, caplog, tmp_path, workspace, monkeypatch):
+        monkeypatch.setenv("FREECAD_EXECUTABLE", str(FAKE_FREECAD_FILE_PATH))
+        things_data = json.loads((workspace / "construction_b/construction.json").read_text())
+        things_data["preview_views"] = ["axo", "isometric"]
+        (workspace / "construction_b/construction.json").write_text(json.dumps(things_data))
+
+        # fmt: off
+        export_failures = generate_readmes_for_workspace(
+            workspace,
+            workers=1,
+            render_daemon_socket_path=tmp_path / "no_daemon.sock",
+            render_cache_enabled=False,
+            xvfb_servers=0,
+            render_backend=RENDER_BACKEND_GUI
+        )
+        # fmt: on
+
+        assert export_failures == []
+        assert f"Skipping exports of {workspace / 'construction_b'} (Invalid preview views" in caplog.text
+        assert not (workspace / "construction_b/img/previews").exists()
+        assert (workspace / "construction_a/img/previews/example_part_a.png").exists()
+        assert (workspace / "construction_c/img/previews/example_part_a.png").exists()
+        assert (workspace / "README.md").exists()
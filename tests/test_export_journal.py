@@ -0,0 +1,68 @@
+# Copyright (C) 2024 twyleg
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.export_journal import ExportJournal
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+class TestExportJournal:
+    def test_RecordedJob_Resume_ArtifactsReturned(self, tmp_path):
+        (tmp_path / "part.FCStd").write_bytes(b"x" * 1024)
+        export_journal = ExportJournal(tmp_path)
+        export_journal.record("job_a", tmp_path / "part.FCStd", [tmp_path / "3d/part-Body.stl"])
+        export_journal.close()
+
+        resumed_export_journal = ExportJournal(tmp_path, resume=True)
+        assert resumed_export_journal.get_finished_artifacts("job_a", tmp_path / "part.FCStd") == [tmp_path / "3d/part-Body.stl"]
+        assert resumed_export_journal.get_finished_artifacts("job_b", tmp_path / "part.FCStd") is None
+        assert ExportJournal(tmp_path).get_finished_artifacts("job_a", tmp_path / "part.FCStd") is None
+
+    def test_RecordedJob_ModifyInputAndResume_JobNotFinished(self, tmp_path):
+        (tmp_path / "part.FCStd").write_bytes(b"x" * 1024)
+        export_journal = ExportJournal(tmp_path)
+        export_journal.record("job_a", tmp_path / "part.FCStd", [])
+        export_journal.close()
+
+        (tmp_path / "part.FCStd").write_bytes(b"y" * 2048)
+        assert ExportJournal(tmp_path, resume=True).get_finished_artifacts("job_a", tmp_path / "part.FCStd") is None
+
+    def test_TornLastLine_ResumeAndRecord_AllCompleteEntriesKept(self, tmp_path):
+        (tmp_path / "part.FCStd").write_bytes(b"x" * 1024)
+        export_journal = ExportJournal(tmp_path)
+        export_journal.record("job_a", tmp_path / "part.FCStd", [])
+        export_journal.close()
+        with open(export_journal.journal_file_path, "a") as journal_file:
+            journal_file.write('{"job": "job_b", "inp')
+
+        resumed_export_journal = ExportJournal(tmp_path, resume=True)
+        resumed_export_journal.record("job_c", tmp_path / "part.FCStd", [])
+        resumed_export_journal.close()
+
+        reloaded_export_journal = ExportJournal(tmp_path, resume=True)
+        assert reloaded_export_journal.get_finished_artifacts("job_a", tmp_path / "part.FCStd") == []
+        assert reloaded_export_journal.get_finished_artifacts("job_b", tmp_path / "part.FCStd") is None
+        assert reloaded_export_journal.get_finished_artifacts("job_c", tmp_path / "part.FCStd") == []
+
+    def test_RecordedJob_Remove_JournalFileRemoved(self, tmp_path):
+        (tmp_path / "part.FCStd").write_bytes(b"x" * 1024)
+        export_journal = ExportJournal(tmp_path)
+        export_journal.record("job_a", tmp_path / "part.FCStd", [])
+        export_journal.remove()
+
+        assert not export_journal.journal_file_path.exists()
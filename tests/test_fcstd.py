@@ -0,0 +1,123 @@
+# Copyright (C) 2024 twyleg
+import pytest
+
+import logging
+import shutil
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+
+from construction_utils.fcstd import THUMBNAIL_ENTRY_NAME, compute_fcstd_fingerprint, read_fcstd_thumbnail
+from construction_utils.png_optimizer import PNG_SIGNATURE
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+def create_rgba_png(width: int, height: int, pixels: bytes) -> bytes:
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    image_data = b"".join(b"\x00" + pixels[y * width * 4 : (y + 1) * width * 4] for y in range(height))
+    # fmt: off
+    return b"".join([
+        PNG_SIGNATURE,
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(image_data)),
+        chunk(b"IEND", b"")
+    ])
+    # fmt: on
+
+
+def rewrite_fcstd(fcstd_file_path: Path, output_file_path: Path, entry_name: str, old: bytes, new: bytes) -> None:
+    with zipfile.ZipFile(fcstd_file_path) as fcstd_file, zipfile.ZipFile(output_file_path, "w", zipfile.ZIP_DEFLATED) as output_file:
+        for name in fcstd_file.namelist():
+            content = fcstd_file.read(name)
+            if name == entry_name:
+                assert old in content
+                content = content.replace(old, new, 1)
+            output_file.writestr(name, content)
+
+
+class TestFcstd:
+    def test_DocumentWithThumbnail_ReadThumbnail_EmbeddedPngReturned(self, tmp_path):
+        thumbnail = create_rgba_png(2, 2, bytes([255, 0, 0, 255] * 4))
+        shutil.copy(FILE_DIR / "resources/src/example_part_a.FCStd", tmp_path / "part.FCStd")
+        with zipfile.ZipFile(tmp_path / "part.FCStd", "a") as fcstd_file:
+            fcstd_file.writestr(THUMBNAIL_ENTRY_NAME, thumbnail)
+
+        assert read_fcstd_thumbnail(tmp_path / "part.FCStd") == thumbnail
+
+    def test_DocumentWithoutThumbnail_ReadThumbnail_NoneReturned(self):
+        assert read_fcstd_thumbnail(FILE_DIR / "resources/src/example_part_a.FCStd") is None
+
+    def test_InvalidDocument_ReadThumbnail_NoneReturned(self, tmp_path):
+        (tmp_path / "broken.FCStd").write_text("not a FreeCAD document")
+        assert read_fcstd_thumbnail(tmp_path / "broken.FCStd") is None
+
+    def test_DocumentSavedWithOtherCameraAndDate_ComputeFingerprint_FingerprintUnchanged(self, tmp_path):
+        fcstd_file_path = FILE_DIR / "resources/src/example_part_a.FCStd"
+        rewrite_fcstd(fcstd_file_path, tmp_path / "camera.FCStd", "GuiDocument.xml", b"OrthographicCamera {", b"PerspectiveCamera {")
+        rewrite_fcstd(tmp_path / "camera.FCStd", tmp_path / "saved.FCStd", "Document.xml", b"2024-08-13T11:01:55Z", b"2026-01-01T00:00:00Z")
+        with zipfile.ZipFile(tmp_path / "saved.FCStd", "a") as fcstd_file:
+            fcstd_file.writestr(THUMBNAIL_ENTRY_NAME, create_rgba_png(1, 1, bytes(4)))
+
+        assert compute_fcstd_fingerprint(tmp_path / "saved.FCStd") == compute_fcstd_fingerprint(fcstd_file_path)
+
+    def test_DocumentWithChangedVisibility_ComputeFingerprint_FingerprintChanged(self, tmp_path):
+        fcstd_file_path = FILE_DIR / "resources/src/example_part_a.FCStd"
+        with zipfile.ZipFile(fcstd_file_path) as fcstd_file:
+            gui_document_xml = fcstd_file.read("GuiDocument.xml")
+        visible = b'<Property name="Visibility" type="App::PropertyBool" status="1">\n                    <Bool value="true"/>'
+        assert visible in gui_document_xml
+        rewrite_fcstd(fcstd_file_path, tmp_path / "hidden.FCStd", "GuiDocument.xml", visible, visible.replace(b"true", b"false"))
+
+        assert compute_fcstd_fingerprint(tmp_path / "hidden.FCStd") != compute_fcstd_fingerprint(fcstd_file_path)
+
+    def test_DocumentWithChangedGeometry_ComputeFingerprint_FingerprintChanged(self, tmp_path):
+        fcstd_file_path = FILE_DIR / "resources/src/example_part_a.FCStd"
+        rewrite_fcstd(fcstd_file_path, tmp_path / "changed.FCStd", "PartShape.brp", b"1", b"2")
+
+        assert compute_fcstd_fingerprint(tmp_path / "changed.FCStd") != compute_fcstd_fingerprint(fcstd_file_path)
+
+    def test_InvalidDocument_ComputeFingerprint_NoneReturned(self, tmp_path):
+        (tmp_path / "broken.FCStd").write_text("not a FreeCAD document")
+        assert compute_fcstd_fingerprint(tmp_path / "broken.FCStd") is None
+
+    def test_DocumentWithCorruptCompressedEntry_ComputeFingerprint_NoneReturned(self, tmp_path):
+        with zipfile.ZipFile(tmp_path / "corrupt.FCStd", "w", zipfile.ZIP_DEFLATED) as fcstd_file:
+            fcstd_file.writestr("Document.xml", "<Document/>")
+            fcstd_file.writestr("PartShape.brp", bytes(range(256)) * 64)
+        content = bytearray((tmp_path / "corrupt.FCStd").read_bytes())
+        with zipfile.ZipFile(tmp_path / "corrupt.FCStd") as fcstd_file:
+            entry = fcstd_file.getinfo("PartShape.brp")
+        # Garbage in the middle of the deflate stream of the entry
+        data_offset = entry.header_offset + 30 + len(entry.filename) + len(entry.extra)
+        content[data_offset + 2 : data_offset + 10] = bytes([0xFF] * 8)
+        (tmp_path / "corrupt.FCStd").write_bytes(bytes(content))
+
+        assert compute_fcstd_fingerprint(tmp_path / "corrupt.FCStd") is None
+
+    def test_DocumentWithUnsupportedCompression_ComputeFingerprint_NoneReturned(self, tmp_path):
+        with zipfile.ZipFile(tmp_path / "unsupported.FCStd", "w", zipfile.ZIP_STORED) as fcstd_file:
+            fcstd_file.writestr("Document.xml", "<Document/>")
+            fcstd_file.writestr("PartShape.brp", b"brep")
+        # Compression method 99 (AE-x encryption) in the local and the central directory header
+        content = (tmp_path / "unsupported.FCStd").read_bytes()
+        content = content.replace(b"PK\x03\x04\x14\x00\x00\x00\x00\x00", b"PK\x03\x04\x14\x00\x00\x00\x63\x00")
+        content = content.replace(b"PK\x01\x02\x14\x03\x14\x00\x00\x00\x00\x00", b"PK\x01\x02\x14\x03\x14\x00\x00\x00\x63\x00")
+        (tmp_path / "unsupported.FCStd").write_bytes(content)
+
+        assert compute_fcstd_fingerprint(tmp_path / "unsupported.FCStd") is None
@@ -3,13 +3,46 @@ import shutil
 
 import pytest
 
+import json
 import logging
+import os
+import socket
+import struct
+import subprocess
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, List
 
-from construction_utils.freecad_exporter import FreecadExporter
+from construction_utils.export_journal import ExportJournal
+from construction_utils.fcstd import THUMBNAIL_ENTRY_NAME
+from construction_utils.freecad_exporter import (
+    RENDER_BACKEND_AUTO,
+    RENDER_BACKEND_GUI,
+    RENDER_DAEMON_EXIT_CODE_RECYCLED,
+    FreecadExporter,
+    ExportFailure,
+    ExportJob,
+    ExportProgress,
+    create_freecad_command,
+    get_available_cpu_count,
+    is_offscreen_backend_available,
+    log_png_optimizer_missing,
+    is_render_daemon_running,
+    parse_job_event,
+    run_render_daemon,
+    stop_render_daemon,
+)
+from construction_utils.png_optimizer import PNG_SIGNATURE, get_png_optimizer
+from construction_utils.render_cache import RenderCache
+from construction_utils.render_manifest import RenderManifest
 
 
 FILE_DIR = Path(__file__).parent
+FAKE_FREECAD_FILE_PATH = FILE_DIR / "resources/fake_freecad/freecad"
+FAKE_FREECAD_CMD_DIR_PATH = FILE_DIR / "resources/fake_freecad/console"
 
 
 @pytest.fixture
@@ -20,6 +53,48 @@ def workspace(tmp_path):
     return tmp_path
 
 
+@pytest.fixture
+def fake_freecad(monkeypatch):
+    monkeypatch.setenv("FREECAD_EXECUTABLE", str(FAKE_FREECAD_FILE_PATH))
+    return FAKE_FREECAD_FILE_PATH
+
+
+@pytest.fixture
+def fake_freecad_cmd(monkeypatch, tmp_path, fake_freecad):
+    # FreeCADCmd on the PATH, the probe result cached in the test's tmp dir instead of the user's cache
+    monkeypatch.setenv("PATH", f"{FAKE_FREECAD_CMD_DIR_PATH}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr("construction_utils.freecad_exporter.get_offscreen_probe_file_path", lambda: tmp_path / "offscreen_probe.json")
+    is_offscreen_backend_available.cache_clear()
+    yield FAKE_FREECAD_CMD_DIR_PATH / "FreeCADCmd"
+    is_offscreen_backend_available.cache_clear()
+
+
+def read_png_size(file_path: Path) -> tuple[int, int]:
+    header = file_path.read_bytes()[:24]
+    assert header[:8] == PNG_SIGNATURE
+    return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+
+
+def create_rgba_png(width: int, height: int, pixels: bytes) -> bytes:
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    image_data = b"".join(b"\x00" + pixels[y * width * 4 : (y + 1) * width * 4] for y in range(height))
+    # fmt: off
+    return b"".join([
+        PNG_SIGNATURE,
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(image_data)),
+        chunk(b"IEND", b"")
+    ])
+    # fmt: on
+
+
+def create_fake_freecad_exporter(tmp_path: Path, **kwargs) -> FreecadExporter:
+    # No render daemon, X server or FreeCADCmd probe, the fake FreeCAD renders headless anyway
+    return FreecadExporter(render_daemon_socket_path=tmp_path / "no_daemon.sock", xvfb_servers=0, render_backend=RENDER_BACKEND_GUI, **kwargs)
+
+
 class TestConstructionReadmeGenerator:
 
     def file_exists(self, file_path: Path) -> bool:
@@ -36,3 +111,642 @@ class TestConstructionReadmeGenerator:
         assert self.file_exists(workspace / "src/example_part_a.png")
         assert self.file_exists(workspace / "output_b/example_part_b.png")
         assert self.file_exists(workspace / "output_c/example_output_part_c.png")
+
+
+class TestAvailableCpuCount:
+    def test_AnySystem_GetAvailableCpuCount_WithinAffinityMask(self):
+        cpu_count = get_available_cpu_count()
+        assert 1 <= cpu_count <= len(os.sched_getaffinity(0))
+
+    def test_CgroupQuotaBelowAffinity_GetAvailableCpuCount_QuotaRespected(self, monkeypatch):
+        monkeypatch.setattr("construction_utils.freecad_exporter._read_cgroup_cpu_limit", lambda: 1)
+        assert get_available_cpu_count() == 1
+
+
+class TestExportProgress:
+    def test_EventLines_ParseJobEvent_OnlyJobEventsParsed(self):
+        assert parse_job_event('{"event": "started", "job": 0, "input": "a.FCStd", "time": 0.0}\n') == {
+            "event": "started",
+            "job": 0,
+            "input": "a.FCStd",
+            "time": 0.0,
+        }
+        assert parse_job_event("Exporting PNG:  a.FCStd -> a.png\n") is None
+        assert parse_job_event('{"event": truncated\n') is None
+
+    def test_RenderedAndFailedEvents_HandleEvents_CountsAndEtaUpdated(self):
+        job_a = ExportJob(Path("a.FCStd"))
+        job_b = ExportJob(Path("b.FCStd"), Path("b.png"))
+        progress = ExportProgress(job_count=4)
+        progress.handle_event("worker 0", {"event": "started", "job": 0, "input": "a.FCStd", "time": 0.0}, job_a)
+        progress.handle_event("worker 0", {"event": "rendered", "job": 0, "input": "a.FCStd", "output": "a.png", "time": 1.0, "duration": 1.0}, job_a)
+        progress.handle_event("worker 1", {"event": "failed", "job": 0, "input": "b.FCStd", "error": "error", "time": 1.0, "duration": 1.0}, job_b)
+
+        assert progress.rendered_count == 1
+        assert progress.failed_count == 1
+        assert progress.failures == [ExportFailure(job_b, ExportFailure.REASON_FAILED, "error")]
+        assert progress.eta() is not None
+
+    def test_JobsWithEstimatedDurations_Eta_RemainingWorkSpreadAcrossWorkers(self):
+        job_a = ExportJob(Path("a.FCStd"))
+        job_b = ExportJob(Path("b.FCStd"))
+        job_c = ExportJob(Path("c.FCStd"))
+        progress = ExportProgress(worker_count=2)
+        progress.add_job(job_a, 10.0)
+        progress.add_job(job_b, 4.0)
+        progress.add_job(job_c, 2.0)
+        assert progress.eta() == 10.0
+
+        # Renders take twice as long as estimated, the ETA is corrected accordingly
+        progress.handle_event("worker 0", {"event": "rendered", "job": 0, "input": "b.FCStd", "output": "b.png", "time": 8.0, "duration": 8.0}, job_b)
+        assert progress.eta() == 20.0
+
+
+class TestOffscreenBackend:
+    def test_OffscreenRenderingWorks_ExportWithAutoBackend_OffscreenBackendSelected(self, caplog, tmp_path, workspace, fake_freecad_cmd):
+        freecad_exporter = FreecadExporter(render_daemon_socket_path=tmp_path / "no_daemon.sock", xvfb_servers=0, render_backend=RENDER_BACKEND_AUTO, workers=1)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/", sizes=[200])
+
+        assert freecad_exporter.export() == []
+        assert "Probing offscreen render backend" in caplog.text
+        assert "Offscreen render backend - rendering without FreeCAD GUI and X server." in caplog.text
+        assert "Exporting PNG (axo, offscreen)" in caplog.text
+        assert read_png_size(workspace / "output/example_part_a.png") == (1000, 1000)
+        assert read_png_size(workspace / "output/example_part_a-200.png") == (200, 200)
+
+    def test_OffscreenRenderingFails_ExportWithAutoBackend_FallbackToGuiBackend(self, caplog, tmp_path, workspace, fake_freecad_cmd, monkeypatch):
+        monkeypatch.setenv("FAKE_FREECAD_OFFSCREEN_UNAVAILABLE", "1")
+        freecad_exporter = FreecadExporter(render_daemon_socket_path=tmp_path / "no_daemon.sock", xvfb_servers=0, render_backend=RENDER_BACKEND_AUTO, workers=1)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+
+        assert freecad_exporter.export() == []
+        assert "Offscreen render backend not available: RuntimeError('Offscreen rendering failed, no OpenGL context available')" in caplog.text
+        assert "Offscreen render backend - rendering" not in caplog.text
+        assert "Exporting PNG (axo):" in caplog.text
+        assert read_png_size(workspace / "output/example_part_a.png") == (1000, 1000)
+
+    def test_CachedProbeResult_CheckOffscreenBackend_NotProbedAgain(self, caplog, tmp_path, fake_freecad_cmd, monkeypatch):
+        assert is_offscreen_backend_available()
+        assert (tmp_path / "offscreen_probe.json").exists()
+        is_offscreen_backend_available.cache_clear()
+
+        # Would fail if probed again
+        monkeypatch.setenv("FAKE_FREECAD_OFFSCREEN_UNAVAILABLE", "1")
+        assert is_offscreen_backend_available()
+        assert caplog.text.count("Probing offscreen render backend") == 1
+
+
+class TestJobDistribution:
+    def test_PendingJobsWithKnownCosts_TakeJobShare_LongestJobFirstAndSharesBalanced(self, tmp_path):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=2)
+        estimated_durations = {ExportJob(Path(f"part_{duration}.FCStd")): float(duration) for duration in (3, 8, 1, 5, 7, 2, 6, 4)}
+        freecad_exporter._estimated_durations.update(estimated_durations)
+        freecad_exporter._pending_jobs.extend(estimated_durations)
+
+        taken_jobs = freecad_exporter._FreecadExporter__take_job_share(2)  # type: ignore[attr-defined]
+        remaining_jobs = list(freecad_exporter._pending_jobs)
+
+        # Dealt most expensive first: 8, 5, 4, 1 to the taken share and 7, 6, 3, 2 to the other one
+        assert [estimated_durations[job] for job in taken_jobs] == [8.0, 5.0, 4.0, 1.0]
+        assert [estimated_durations[job] for job in remaining_jobs] == [7.0, 6.0, 3.0, 2.0]
+        assert sum(estimated_durations[job] for job in taken_jobs) == sum(estimated_durations[job] for job in remaining_jobs)
+
+    def test_JobsArrivingWhileOtherWorkersBusy_TakeJobs_OneShareTakenPerWorker(self, tmp_path):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=3)
+        freecad_exporter.JOB_COLLECTION_TIME = 0.0
+        estimated_durations = {ExportJob(Path(f"part_{duration}.FCStd")): float(duration) for duration in (6, 5, 4, 3, 2, 1, 7)}
+        freecad_exporter._estimated_durations.update(estimated_durations)
+
+        # A single worker idle, the two others still busy with earlier jobs
+        freecad_exporter._pending_jobs.extend(list(estimated_durations)[:6])
+        first_taken_jobs = freecad_exporter._FreecadExporter__take_jobs()  # type: ignore[attr-defined]
+        # Another job comes in before the busy workers are done
+        freecad_exporter._pending_jobs.append(list(estimated_durations)[6])
+        second_taken_jobs = freecad_exporter._FreecadExporter__take_jobs()  # type: ignore[attr-defined]
+        remaining_jobs = list(freecad_exporter._pending_jobs)
+
+        assert [estimated_durations[job] for job in first_taken_jobs] == [6.0, 1.0]
+        assert [estimated_durations[job] for job in second_taken_jobs] == [7.0]
+        assert sorted(estimated_durations[job] for job in remaining_jobs) == [2.0, 3.0, 4.0, 5.0]
+
+
+class TestExportJob:
+    def test_JobWithMultipleViews_GetPreviewOutputFilePaths_FirstViewIsOutputFile(self):
+        export_job = ExportJob(Path("source/part.FCStd"), Path("img/previews/"), ("axo", "front", "top"), ())
+        assert export_job.preview_output_file_paths() == {
+            ("axo", None): Path("img/previews/part.png"),
+            ("front", None): Path("img/previews/part-front.png"),
+            ("top", None): Path("img/previews/part-top.png"),
+        }
+
+    def test_JobWithSizes_GetPreviewOutputFilePaths_DerivativesSuffixedWithSize(self):
+        export_job = ExportJob(Path("source/part.FCStd"), Path("img/previews/"), ("axo", "front"), (200, 400))
+        assert export_job.preview_output_file_paths() == {
+            ("axo", None): Path("img/previews/part.png"),
+            ("axo", 200): Path("img/previews/part-200.png"),
+            ("axo", 400): Path("img/previews/part-400.png"),
+            ("front", None): Path("img/previews/part-front.png"),
+            ("front", 200): Path("img/previews/part-front-200.png"),
+            ("front", 400): Path("img/previews/part-front-400.png"),
+        }
+
+    def test_InvalidSize_AddExportJob_ValueErrorRaised(self, workspace):
+        freecad_exporter = FreecadExporter()
+        with pytest.raises(ValueError):
+            freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", sizes=[200, 1000])
+
+    def test_UnknownView_AddExportJob_ValueErrorRaised(self, workspace):
+        freecad_exporter = FreecadExporter()
+        with pytest.raises(ValueError):
+            freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", views=["isometric"])
+
+    def test_UnknownRenderBackend_CreateExporter_ValueErrorRaised(self):
+        with pytest.raises(ValueError):
+            FreecadExporter(render_backend="opengl")
+
+    def test_ZeroWorkers_CreateExporter_ValueErrorRaised(self):
+        with pytest.raises(ValueError):
+            FreecadExporter(workers=0)
+
+
+class TestFakeFreecad:
+    def test_ValidSourceFiles_ExportWithViewsAndSizes_ValidPngsWritten(self, tmp_path, workspace, fake_freecad):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=2)
+        for part in ("a", "b", "c"):
+            freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/", views=["axo", "front"], sizes=[200])
+
+        assert freecad_exporter.export() == []
+
+        for part in ("a", "b", "c"):
+            assert read_png_size(workspace / f"output/example_part_{part}.png") == (1000, 1000)
+            assert read_png_size(workspace / f"output/example_part_{part}-200.png") == (200, 200)
+            assert read_png_size(workspace / f"output/example_part_{part}-front.png") == (1000, 1000)
+            assert read_png_size(workspace / f"output/example_part_{part}-front-200.png") == (200, 200)
+
+    @pytest.mark.skipif(get_png_optimizer() is None, reason="Neither oxipng nor Pillow is installed")
+    def test_ValidSourceFile_ExportWithPreviewOptimization_PreviewsReencodedLosslessly(self, caplog, tmp_path, workspace, fake_freecad):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/", sizes=[200])
+
+        assert freecad_exporter.export() == []
+        assert "Optimized 2 preview(s)" in caplog.text
+        assert read_png_size(workspace / "output/example_part_a.png") == (1000, 1000)
+
+    def test_NoPngOptimizerInstalled_ExportWithPreviewOptimization_PreviewsKeptAsRendered(self, caplog, tmp_path, workspace, fake_freecad, monkeypatch):
+        monkeypatch.setattr("construction_utils.freecad_exporter.get_png_optimizer", lambda: None)
+        log_png_optimizer_missing.cache_clear()
+        for source_file_name in ("example_part_a.FCStd", "example_part_b.FCStd"):
+            freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+            freecad_exporter.add_export_job(workspace / "src" / source_file_name, workspace / "output/", sizes=[200])
+            assert freecad_exporter.export() == []
+
+        warnings = [record for record in caplog.records if record.levelno == logging.WARNING and "Not optimizing previews" in record.getMessage()]
+        assert len(warnings) == 1
+        assert read_png_size(workspace / "output/example_part_a.png") == (1000, 1000)
+
+    def test_ValidSourceFile_ExportWithStlFormat_BodiesExported(self, tmp_path, workspace, fake_freecad):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/", export_dir_path=workspace / "3d", export_formats=["stl"])
+
+        assert freecad_exporter.export() == []
+        assert freecad_exporter.get_exported_artifacts() == [workspace / "3d/example_part_a-Body.stl"]
+        assert (workspace / "3d/example_part_a-Body.stl").exists()
+
+    def test_SourceFileInPathWithColon_Export_PngWritten(self, tmp_path, workspace, fake_freecad):
+        (workspace / "src:v2").mkdir()
+        (workspace / "src/example_part_a.FCStd").rename(workspace / "src:v2/example_part_a.FCStd")
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+        freecad_exporter.add_export_job(workspace / "src:v2/example_part_a.FCStd", workspace / "output:v2/", sizes=[200])
+
+        assert freecad_exporter.export() == []
+        assert read_png_size(workspace / "output:v2/example_part_a.png") == (1000, 1000)
+        assert read_png_size(workspace / "output:v2/example_part_a-200.png") == (200, 200)
+
+    def test_DocumentLimitPerWorker_Export_WorkerRecycledAndAllJobsExported(self, caplog, tmp_path, workspace, fake_freecad):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, max_documents_per_worker=2, max_worker_rss=None)
+        for part in ("a", "b", "c"):
+            freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+        assert freecad_exporter.export() == []
+        assert caplog.text.count("Recycling after 2 document(s)") == 1
+        for part in ("a", "b", "c"):
+            assert (workspace / f"output/example_part_{part}.png").exists()
+
+    def test_RssLimitBelowFreecadMemory_Export_WorkerRecycledAfterEveryDocument(self, caplog, tmp_path, workspace, fake_freecad):
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, max_documents_per_worker=None, max_worker_rss=1)
+        for part in ("a", "b", "c"):
+            freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+        assert freecad_exporter.export() == []
+        assert caplog.text.count("Recycling after 1 document(s)") == 2
+        for part in ("a", "b", "c"):
+            assert (workspace / f"output/example_part_{part}.png").exists()
+
+    def test_DocumentWithAndWithoutThumbnail_ExportWithFastPreviews_OnlyDocumentWithoutThumbnailRendered(self, caplog, tmp_path, workspace, fake_freecad):
+        thumbnail = create_rgba_png(2, 2, bytes([255, 0, 0, 255] * 4))
+        with zipfile.ZipFile(workspace / "src/example_part_a.FCStd", "a") as fcstd_file:
+            fcstd_file.writestr(THUMBNAIL_ENTRY_NAME, thumbnail)
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, fast_previews=True)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/", sizes=[200], export_formats=["stl"])
+        freecad_exporter.add_export_job(workspace / "src/example_part_b.FCStd", workspace / "output/", sizes=[200])
+
+        assert freecad_exporter.export() == []
+        assert (workspace / "output/example_part_a.png").read_bytes() == thumbnail
+        assert (workspace / "output/example_part_a-200.png").read_bytes() == thumbnail
+        assert read_png_size(workspace / "output/example_part_b.png") == (1000, 1000)
+        assert "Exported 1/1 job(s)" in caplog.text
+        assert freecad_exporter.get_exported_artifacts() == []
+
+    def test_FastPreviewsFromThumbnail_RegularExportWithoutManifest_PreviewsRendered(self, caplog, tmp_path, workspace, fake_freecad):
+        thumbnail = create_rgba_png(2, 2, bytes([255, 0, 0, 255] * 4))
+        with zipfile.ZipFile(workspace / "src/example_part_a.FCStd", "a") as fcstd_file:
+            fcstd_file.writestr(THUMBNAIL_ENTRY_NAME, thumbnail)
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, fast_previews=True)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/", sizes=[200])
+        assert freecad_exporter.export() == []
+        assert (workspace / "output/example_part_a-200.png").read_bytes() == thumbnail
+
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/", sizes=[200])
+        assert freecad_exporter.export() == []
+
+        assert read_png_size(workspace / "output/example_part_a.png") == (1000, 1000)
+        assert read_png_size(workspace / "output/example_part_a-200.png") == (200, 200)
+
+    def test_RenderedDocumentChangedAndReverted_RegularExportAfterFastPreviews_PreviewsRenderedAgain(self, caplog, tmp_path, workspace, fake_freecad):
+        source_file_path = workspace / "src/example_part_a.FCStd"
+        original_content = source_file_path.read_bytes()
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, render_manifest=RenderManifest(workspace, FreecadExporter.RENDER_PARAMETERS))
+        freecad_exporter.add_export_job(source_file_path, workspace / "output/")
+        assert freecad_exporter.export() == []
+
+        # Edited and saved with thumbnail, previewed from the thumbnail, then the edit is reverted
+        thumbnail = create_rgba_png(2, 2, bytes([255, 0, 0, 255] * 4))
+        with zipfile.ZipFile(source_file_path, "a") as fcstd_file:
+            fcstd_file.writestr(THUMBNAIL_ENTRY_NAME, thumbnail)
+            fcstd_file.writestr("Extra.brp", b"extra geometry")
+        freecad_exporter = create_fake_freecad_exporter(
+            tmp_path, workers=1, render_manifest=RenderManifest(workspace, FreecadExporter.RENDER_PARAMETERS), fast_previews=True
+        )
+        freecad_exporter.add_export_job(source_file_path, workspace / "output/")
+        assert freecad_exporter.export() == []
+        assert (workspace / "output/example_part_a.png").read_bytes() == thumbnail
+        source_file_path.write_bytes(original_content)
+
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, render_manifest=RenderManifest(workspace, FreecadExporter.RENDER_PARAMETERS))
+        freecad_exporter.add_export_job(source_file_path, workspace / "output/")
+        assert freecad_exporter.export() == []
+
+        assert read_png_size(workspace / "output/example_part_a.png") == (1000, 1000)
+
+    def test_DocumentWithThumbnail_ExportWithFastPreviews_FreecadNotStarted(self, caplog, tmp_path, workspace, monkeypatch):
+        monkeypatch.setenv("FREECAD_EXECUTABLE", str(tmp_path / "missing_freecad"))
+        with zipfile.ZipFile(workspace / "src/example_part_a.FCStd", "a") as fcstd_file:
+            fcstd_file.writestr(THUMBNAIL_ENTRY_NAME, create_rgba_png(1, 1, bytes(4)))
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, fast_previews=True)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+
+        assert freecad_exporter.export() == []
+        assert "Running FreeCAD export script" not in caplog.text
+        assert (workspace / "output/example_part_a.png").exists()
+
+    def test_RenderedInOtherWorkspace_ExportWithSharedRenderCache_RestoredWithoutFreecadAndRegenerationKeepsCacheEntry(
+        self, caplog, tmp_path, workspace, fake_freecad, monkeypatch
+    ):
+        source_file_path = workspace / "src/example_part_a.FCStd"
+        freecad_exporter = create_fake_freecad_exporter(
+            tmp_path, workers=1, render_cache=RenderCache(FreecadExporter.RENDER_PARAMETERS, "fake", tmp_path / "cache")
+        )
+        freecad_exporter.add_export_job(source_file_path, workspace / "output/")
+        assert freecad_exporter.export() == []
+        rendered = (workspace / "output/example_part_a.png").read_bytes()
+
+        # Second run for another output dir, any FreeCAD start would fail
+        monkeypatch.setenv("FREECAD_EXECUTABLE", str(tmp_path / "missing_freecad"))
+        caplog.clear()
+        freecad_exporter = create_fake_freecad_exporter(
+            tmp_path, workers=1, render_cache=RenderCache(FreecadExporter.RENDER_PARAMETERS, "fake", tmp_path / "cache")
+        )
+        freecad_exporter.add_export_job(source_file_path, workspace / "other_output/")
+        assert freecad_exporter.export() == []
+        assert "Restored from render cache: " in caplog.text
+        assert "Running FreeCAD export script" not in caplog.text
+        restored_file_path = workspace / "other_output/example_part_a.png"
+        assert restored_file_path.read_bytes() == rendered
+        assert restored_file_path.stat().st_nlink > 1
+
+        # Keep the restored inode, the cache replaces its entry after the regeneration
+        cache_entry_file_path = tmp_path / "cache_entry.png"
+        os.link(restored_file_path, cache_entry_file_path)
+        cache_entry_stat = cache_entry_file_path.stat()
+        monkeypatch.setenv("FREECAD_EXECUTABLE", str(fake_freecad))
+        freecad_exporter = create_fake_freecad_exporter(
+            tmp_path, workers=1, render_cache=RenderCache(FreecadExporter.RENDER_PARAMETERS, "fake", tmp_path / "cache")
+        )
+        freecad_exporter.add_export_job(source_file_path, workspace / "other_output/", force=True)
+        assert freecad_exporter.export() == []
+
+        assert restored_file_path.stat().st_ino != cache_entry_stat.st_ino
+        assert cache_entry_file_path.stat().st_mtime_ns == cache_entry_stat.st_mtime_ns
+        assert cache_entry_file_path.read_bytes() == rendered
+
+    def test_DocumentSavedWithOtherCamera_ExportWithRenderManifest_NotRenderedAgain(self, caplog, tmp_path, workspace, fake_freecad):
+        source_file_path = workspace / "src/example_part_a.FCStd"
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, render_manifest=RenderManifest(workspace, FreecadExporter.RENDER_PARAMETERS))
+        freecad_exporter.add_export_job(source_file_path, workspace / "output/")
+        assert freecad_exporter.export() == []
+
+        with zipfile.ZipFile(source_file_path) as fcstd_file:
+            entries = {name: fcstd_file.read(name) for name in fcstd_file.namelist()}
+        entries["GuiDocument.xml"] = entries["GuiDocument.xml"].replace(b"OrthographicCamera {", b"PerspectiveCamera {")
+        with zipfile.ZipFile(source_file_path, "w", zipfile.ZIP_DEFLATED) as fcstd_file:
+            for name, content in entries.items():
+                fcstd_file.writestr(name, content)
+        os.utime(source_file_path, (time.time() + 10, time.time() + 10))
+        caplog.clear()
+
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, render_manifest=RenderManifest(workspace, FreecadExporter.RENDER_PARAMETERS))
+        freecad_exporter.add_export_job(source_file_path, workspace / "output/")
+        assert freecad_exporter.export() == []
+        assert "No FreeCAD export jobs available." in caplog.text
+
+    def test_FailingDirtyCheck_Export_FailureReportedAndOtherJobsExported(self, caplog, tmp_path, workspace, fake_freecad, monkeypatch):
+        compute_input_sha256 = RenderManifest.compute_input_sha256
+
+        def fail_for_part_b(render_manifest, input_file_path):
+            if input_file_path.name == "example_part_b.FCStd":
+                raise RuntimeError("corrupt document")
+            return compute_input_sha256(render_manifest, input_file_path)
+
+        monkeypatch.setattr(RenderManifest, "compute_input_sha256", fail_for_part_b)
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, render_manifest=RenderManifest(workspace, FreecadExporter.RENDER_PARAMETERS))
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+        freecad_exporter.add_export_job(workspace / "src/example_part_b.FCStd", workspace / "output/")
+
+        failures = freecad_exporter.wait()
+
+        assert [(failure.job.input_file_path, failure.reason) for failure in failures] == [
+            (workspace / "src/example_part_b.FCStd", ExportFailure.REASON_FAILED)
+        ]
+        assert "corrupt document" in failures[0].detail
+        assert (workspace / "output/example_part_a.png").exists()
+
+    def test_InvalidSourceFile_Export_FailureReported(self, tmp_path, workspace, fake_freecad):
+        (workspace / "src/broken.FCStd").write_text("not a FreeCAD document")
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+        freecad_exporter.add_export_job(workspace / "src/broken.FCStd", workspace / "output/")
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+
+        failures = freecad_exporter.export()
+
+        assert [(failure.job.input_file_path, failure.reason) for failure in failures] == [(workspace / "src/broken.FCStd", ExportFailure.REASON_FAILED)]
+        assert (workspace / "output/example_part_a.png").exists()
+
+    def test_InterruptedExport_ResumeWithJournal_OnlyUnfinishedJobsExported(self, caplog, tmp_path, workspace, fake_freecad):
+        (workspace / "src/broken.FCStd").write_text("not a FreeCAD document")
+        source_file_paths = [workspace / "src/example_part_a.FCStd", workspace / "src/broken.FCStd", workspace / "src/example_part_b.FCStd"]
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, export_journal=ExportJournal(workspace))
+        for source_file_path in source_file_paths:
+            freecad_exporter.add_export_job(source_file_path, workspace / "output/", force=True, export_dir_path=workspace / "3d", export_formats=["stl"])
+        assert len(freecad_exporter.export()) == 1
+        output_mtimes = {path: path.stat().st_mtime_ns for path in (workspace / "output").iterdir()}
+        caplog.clear()
+
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, export_journal=ExportJournal(workspace, resume=True))
+        for source_file_path in source_file_paths:
+            freecad_exporter.add_export_job(source_file_path, workspace / "output/", force=True, export_dir_path=workspace / "3d", export_formats=["stl"])
+        failures = freecad_exporter.export()
+
+        assert [failure.job.input_file_path for failure in failures] == [workspace / "src/broken.FCStd"]
+        assert "Skipped 2 job(s) finished by the interrupted export" in caplog.text
+        assert {path: path.stat().st_mtime_ns for path in (workspace / "output").iterdir()} == output_mtimes
+        assert sorted(freecad_exporter.get_exported_artifacts()) == [workspace / "3d/example_part_a-Body.stl", workspace / "3d/example_part_b-Body.stl"]
+        # Only written by the atomic rename, no temporary files left behind
+        assert not [path for path in (workspace / "output").iterdir() if path.name.startswith(".")]
+
+    def test_HangingDocument_Export_WorkerKilledAndRemainingJobsExported(self, caplog, tmp_path, workspace, fake_freecad, monkeypatch):
+        monkeypatch.setenv("FAKE_FREECAD_HANG_ON", "example_part_b.FCStd")
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, job_timeout=1.0)
+        for part in ("a", "b", "c"):
+            freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+        start_time = time.monotonic()
+        failures = freecad_exporter.export()
+
+        assert [(failure.job.input_file_path, failure.reason) for failure in failures] == [
+            (workspace / "src/example_part_b.FCStd", ExportFailure.REASON_TIMEOUT)
+        ]
+        assert time.monotonic() - start_time < 30.0
+        assert "respawning worker for 1 remaining job(s)" in caplog.text
+        assert (workspace / "output/example_part_a.png").exists()
+        assert not (workspace / "output/example_part_b.png").exists()
+        assert (workspace / "output/example_part_c.png").exists()
+
+    def test_DocumentCrashingFreecad_Export_CrashReportedAndRemainingJobsExported(self, caplog, tmp_path, workspace, fake_freecad, monkeypatch):
+        monkeypatch.setenv("FAKE_FREECAD_CRASH_ON", "example_part_b.FCStd")
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1)
+        for part in ("a", "b", "c"):
+            freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+        failures = freecad_exporter.export()
+
+        assert [(failure.job.input_file_path, failure.reason) for failure in failures] == [
+            (workspace / "src/example_part_b.FCStd", ExportFailure.REASON_CRASHED)
+        ]
+        assert "return code -11" in failures[0].detail
+        assert (workspace / "output/example_part_a.png").exists()
+        assert (workspace / "output/example_part_c.png").exists()
+
+    def test_FreecadStartupExceedingTimeout_Export_AllJobsReportedAsStartupFailed(self, caplog, tmp_path, workspace, fake_freecad, monkeypatch):
+        monkeypatch.setenv("FAKE_FREECAD_STARTUP_DELAY", "60")
+        freecad_exporter = create_fake_freecad_exporter(tmp_path, workers=1, startup_timeout=1.0)
+        for part in ("a", "b"):
+            freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+        failures = freecad_exporter.export()
+
+        assert [failure.reason for failure in failures] == [ExportFailure.REASON_STARTUP_FAILED] * 2
+        assert "No progress within 1.0s" in failures[0].detail
+
+    def test_RunningRenderDaemon_Export_JobsExportedByDaemon(self, caplog, tmp_path, workspace, fake_freecad):
+        socket_path = tmp_path / "daemon.sock"
+        daemon_process = subprocess.Popen(create_freecad_command(["--serve", str(socket_path)], xvfb_run=False))
+        try:
+            deadline = time.monotonic() + 30.0
+            while not socket_path.exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+            freecad_exporter = FreecadExporter(render_daemon_socket_path=socket_path, xvfb_servers=0, render_backend=RENDER_BACKEND_GUI)
+            freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+            freecad_exporter.add_export_job(workspace / "src/example_part_b.FCStd", workspace / "output/")
+
+            assert freecad_exporter.export() == []
+            assert "Sending 2 export job(s) to render daemon" in caplog.text
+            assert "Exporting with up to" not in caplog.text
+            assert (workspace / "output/example_part_a.png").exists()
+            assert (workspace / "output/example_part_b.png").exists()
+        finally:
+            stop_render_daemon(socket_path)
+            daemon_process.wait(timeout=30.0)
+
+
+def start_fake_render_daemon(socket_path: Path, *args: str, env: Dict[str, str] | None = None) -> subprocess.Popen:
+    daemon_process = subprocess.Popen(create_freecad_command(["--serve", str(socket_path), *args], xvfb_run=False), env=env)
+    deadline = time.monotonic() + 30.0
+    while not is_render_daemon_running(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return daemon_process
+
+
+def send_render_daemon_request(socket_path: Path, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        with client.makefile("rw", encoding="utf-8") as stream:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            return [json.loads(line) for line in stream]
+
+
+class TestRenderDaemon:
+    def test_RunningRenderDaemon_SendJobsAndShutdown_JobEventsFinishedAndDaemonStopped(self, tmp_path, workspace, fake_freecad):
+        socket_path = tmp_path / "daemon.sock"
+        daemon_process = start_fake_render_daemon(socket_path)
+        try:
+            jobs = [[str(workspace / f"src/example_part_{part}.FCStd"), str(workspace / "output/")] for part in ("a", "b")]
+            events = send_render_daemon_request(socket_path, {"jobs": jobs})
+
+            assert [(event["event"], event.get("job")) for event in events] == [
+                ("started", 0),
+                ("rendered", 0),
+                ("started", 1),
+                ("rendered", 1),
+                ("finished", None),
+            ]
+            assert (workspace / "output/example_part_b.png").exists()
+            assert send_render_daemon_request(socket_path, {"command": "shutdown"}) == [{"event": "finished"}]
+            assert daemon_process.wait(timeout=30.0) == 0
+            assert not socket_path.exists()
+        finally:
+            stop_render_daemon(socket_path)
+            daemon_process.kill()
+
+    def test_RenderDaemonWithDocumentLimit_SendRequests_LimitCountedAcrossRequestsAndDaemonExitsForRestart(self, tmp_path, workspace, fake_freecad):
+        socket_path = tmp_path / "daemon.sock"
+        daemon_process = start_fake_render_daemon(socket_path, "--max-documents=2")
+        try:
+            jobs = [[str(workspace / f"src/example_part_{part}.FCStd"), str(workspace / "output/")] for part in ("a", "b", "c")]
+            first_events = send_render_daemon_request(socket_path, {"jobs": jobs[:1]})
+            second_events = send_render_daemon_request(socket_path, {"jobs": jobs[1:]})
+
+            assert [event["event"] for event in first_events] == ["started", "rendered", "finished"]
+            assert [event["event"] for event in second_events] == ["started", "rendered", "recycled", "finished"]
+            assert (second_events[2]["job"], second_events[2]["documents"]) == (0, 2)
+            assert daemon_process.wait(timeout=30.0) == RENDER_DAEMON_EXIT_CODE_RECYCLED
+            assert not socket_path.exists()
+            assert not (workspace / "output/example_part_c.png").exists()
+        finally:
+            daemon_process.kill()
+
+    def test_RenderDaemonWithDocumentLimit_Export_DaemonRestartedAndAllJobsExportedByDaemon(self, caplog, tmp_path, workspace, fake_freecad, monkeypatch):
+        monkeypatch.setattr("construction_utils.freecad_exporter.XvfbManager.is_available", lambda: False)
+        monkeypatch.setattr("construction_utils.freecad_exporter.which", lambda name: None)
+        socket_path = tmp_path / "daemon.sock"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            render_daemon = executor.submit(run_render_daemon, socket_path, RENDER_BACKEND_GUI, 1, None)
+            try:
+                deadline = time.monotonic() + 30.0
+                while not is_render_daemon_running(socket_path) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+
+                freecad_exporter = FreecadExporter(render_daemon_socket_path=socket_path, xvfb_servers=0, render_backend=RENDER_BACKEND_GUI)
+                for part in ("a", "b", "c"):
+                    freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+                assert freecad_exporter.export() == []
+                assert caplog.text.count("Render daemon restarts after 1 document(s)") == 3
+                assert "local workers" not in caplog.text
+                for part in ("a", "b", "c"):
+                    assert (workspace / f"output/example_part_{part}.png").exists()
+            finally:
+                deadline = time.monotonic() + 30.0
+                while not stop_render_daemon(socket_path) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            assert render_daemon.result(timeout=30.0) == 0
+        # Logged by the daemon once the recycled FreeCAD exited, which may be after the export returned
+        assert caplog.text.count("Restarting render daemon") == 3
+
+    def test_RunningRenderDaemon_ExportLargeBatch_LocalWorkersExportNextToDaemon(self, caplog, tmp_path, workspace, fake_freecad):
+        socket_path = tmp_path / "daemon.sock"
+        daemon_process = start_fake_render_daemon(socket_path)
+        try:
+            freecad_exporter = FreecadExporter(workers=2, render_daemon_socket_path=socket_path, xvfb_servers=0, render_backend=RENDER_BACKEND_GUI)
+            job_count = FreecadExporter.RENDER_DAEMON_ONLY_JOB_COUNT + 4
+            for job_index in range(job_count):
+                freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / f"output_{job_index}/")
+
+            assert freecad_exporter.export() == []
+            assert f"Sending {job_count // 2} export job(s) to render daemon" in caplog.text
+            assert "Exporting with up to 2 FreeCAD worker(s)" in caplog.text
+            for job_index in range(job_count):
+                assert (workspace / f"output_{job_index}/example_part_a.png").exists()
+        finally:
+            stop_render_daemon(socket_path)
+            daemon_process.wait(timeout=30.0)
+
+    def test_RunningRenderDaemon_StartSecondDaemon_RefusedAndFirstDaemonKeepsServing(self, caplog, tmp_path, fake_freecad):
+        socket_path = tmp_path / "daemon.sock"
+        daemon_process = start_fake_render_daemon(socket_path)
+        try:
+            assert run_render_daemon(socket_path, RENDER_BACKEND_GUI) == 1
+            assert "Render daemon already running" in caplog.text
+            # Started directly, the export script refuses as well instead of taking over the socket
+            result = subprocess.run(
+                create_freecad_command(["--serve", str(socket_path)], xvfb_run=False), stdout=subprocess.PIPE, encoding="utf-8", timeout=30.0
+            )
+            assert f"Render daemon already running: {socket_path}" in result.stdout
+
+            assert stop_render_daemon(socket_path)
+            assert daemon_process.wait(timeout=30.0) == 0
+        finally:
+            daemon_process.kill()
+
+    def test_NoRenderDaemon_Export_LocalWorkersSpawned(self, caplog, tmp_path, workspace, fake_freecad):
+        freecad_exporter = FreecadExporter(workers=1, render_daemon_socket_path=tmp_path / "no_daemon.sock", xvfb_servers=0, render_backend=RENDER_BACKEND_GUI)
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+
+        assert freecad_exporter.export() == []
+        assert "Render daemon available" not in caplog.text
+        assert "Exporting with up to 1 FreeCAD worker(s)" in caplog.text
+        assert (workspace / "output/example_part_a.png").exists()
+
+    def test_RenderDaemonCrashingDuringRequest_Export_RemainingJobsExportedByLocalWorkers(self, caplog, tmp_path, workspace, fake_freecad):
+        socket_path = tmp_path / "daemon.sock"
+        daemon_process = start_fake_render_daemon(socket_path, env={**os.environ, "FAKE_FREECAD_CRASH_ON": "example_part_b.FCStd"})
+        try:
+            freecad_exporter = FreecadExporter(workers=1, render_daemon_socket_path=socket_path, xvfb_servers=0, render_backend=RENDER_BACKEND_GUI)
+            for part in ("a", "b", "c"):
+                freecad_exporter.add_export_job(workspace / f"src/example_part_{part}.FCStd", workspace / "output/")
+
+            failures = freecad_exporter.export()
+
+            assert [(failure.job.input_file_path, failure.reason) for failure in failures] == [
+                (workspace / "src/example_part_b.FCStd", ExportFailure.REASON_CRASHED)
+            ]
+            assert "Render daemon closed the connection unexpectedly" in failures[0].detail
+            assert "Exporting with up to 1 FreeCAD worker(s)" in caplog.text
+            assert (workspace / "output/example_part_a.png").exists()
+            assert (workspace / "output/example_part_c.png").exists()
+        finally:
+            daemon_process.kill()
+
+    def test_DaemonSocketInDirWritableByOthers_Export_DaemonNotUsed(self, caplog, tmp_path, workspace, fake_freecad):
+        (tmp_path / "shared").mkdir()
+        os.chmod(tmp_path / "shared", 0o777)
+        freecad_exporter = FreecadExporter(
+            workers=1, render_daemon_socket_path=tmp_path / "shared/daemon.sock", xvfb_servers=0, render_backend=RENDER_BACKEND_GUI
+        )
+        freecad_exporter.add_export_job(workspace / "src/example_part_a.FCStd", workspace / "output/")
+
+        assert freecad_exporter.export() == []
+        assert "Not using render daemon" in caplog.text
+        assert (workspace / "output/example_part_a.png").exists()
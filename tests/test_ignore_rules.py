@@ -0,0 +1,58 @@
+# Copyright (C) 2024 twyleg
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.ignore_rules import IgnoreRules
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+class TestIgnoreRules:
+    def test_NoIgnoreFiles_Extend_NothingIgnored(self, caplog, tmp_path):
+        ignore_rules = IgnoreRules().extend(tmp_path, "", ["README.md"])
+
+        assert not ignore_rules.is_ignored_dir("build")
+
+    def test_GitignoreWithPatterns_IsIgnoredDir_GitSemanticsApplied(self, caplog, tmp_path):
+        (tmp_path / ".gitignore").write_text("# Comment\nbuild/\n/archive\ndrafts/**/old\n*.bak\n!keep.bak\n")
+
+        ignore_rules = IgnoreRules().extend(tmp_path, "", [".gitignore"])
+
+        assert ignore_rules.is_ignored_dir("build")
+        assert ignore_rules.is_ignored_dir("household/build")
+        assert ignore_rules.is_ignored_dir("archive")
+        assert not ignore_rules.is_ignored_dir("household/archive")
+        assert ignore_rules.is_ignored_dir("drafts/a/b/old")
+        assert ignore_rules.is_ignored_dir("household/lamp.bak")
+        assert not ignore_rules.is_ignored_dir("household/keep.bak")
+        assert not ignore_rules.is_ignored_dir("household")
+
+    def test_NestedIgnoreFiles_IsIgnoredDir_DeeperAndConstructionignorePatternsTakePrecedence(self, caplog, tmp_path):
+        (tmp_path / ".gitignore").write_text("wip_*\n")
+        (tmp_path / ".constructionignore").write_text("!wip_shared\nprinter_parts/\n")
+        (tmp_path / "household").mkdir()
+        (tmp_path / "household/.gitignore").write_text("!wip_lamp\nwip_shared\n")
+
+        ignore_rules = IgnoreRules().extend(tmp_path, "", [".gitignore", ".constructionignore"])
+        household_ignore_rules = ignore_rules.extend(tmp_path / "household", "household", [".gitignore"])
+
+        assert ignore_rules.is_ignored_dir("wip_table")
+        assert not ignore_rules.is_ignored_dir("wip_shared")
+        assert ignore_rules.is_ignored_dir("printer_parts")
+        assert not household_ignore_rules.is_ignored_dir("household/wip_lamp")
+        assert household_ignore_rules.is_ignored_dir("household/wip_shared")
+        assert household_ignore_rules.is_ignored_dir("household/wip_chair")
@@ -0,0 +1,69 @@
+# Copyright (C) 2024 twyleg
+import argparse
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.main import Application, non_negative_int, positive_float, positive_int
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+class TestArgumentTypes:
+    @pytest.mark.parametrize("value, expected", [("1", 1), ("8", 8)])
+    def test_PositiveValue_PositiveInt_ValueReturned(self, value, expected):
+        assert positive_int(value) == expected
+
+    @pytest.mark.parametrize("value", ["0", "-1"])
+    def test_NotPositiveValue_PositiveInt_ArgumentTypeErrorRaised(self, value):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+
+    @pytest.mark.parametrize("value, expected", [("0", 0), ("2", 2)])
+    def test_NonNegativeValue_NonNegativeInt_ValueReturned(self, value, expected):
+        assert non_negative_int(value) == expected
+
+    def test_NegativeValue_NonNegativeInt_ArgumentTypeErrorRaised(self):
+        with pytest.raises(argparse.ArgumentTypeError):
+            non_negative_int("-1")
+
+    @pytest.mark.parametrize("value, expected", [("0.5", 0.5), ("600", 600.0)])
+    def test_PositiveValue_PositiveFloat_ValueReturned(self, value, expected):
+        assert positive_float(value) == expected
+
+    @pytest.mark.parametrize("value", ["0", "-1.5", "nan", "inf"])
+    def test_NotPositiveOrNotFiniteValue_PositiveFloat_ArgumentTypeErrorRaised(self, value):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_float(value)
+
+
+class TestApplication:
+    @pytest.mark.parametrize("export_failures, expected_exit_code", [([], 0), (["failure"], 1)])
+    def test_ExportResult_GenerateDocs_ExitCodeReflectsFailures(self, tmp_path, monkeypatch, export_failures, expected_exit_code):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr("construction_utils.main.generate_readmes_for_workspace", lambda *args, **kwargs: export_failures)
+
+        assert Application().start(["generate_docs"]) == expected_exit_code
+
+    @pytest.mark.parametrize("argument", ["--job-timeout=0", "--xvfb-servers=-1", "--render-cache-size=0", "--worker-max-documents=-1"])
+    def test_InvalidArgument_GenerateDocs_RejectedBeforeGeneration(self, tmp_path, monkeypatch, argument):
+        monkeypatch.chdir(tmp_path)
+        generated = []
+        monkeypatch.setattr("construction_utils.main.generate_readmes_for_workspace", lambda *args, **kwargs: generated.append(args))
+
+        assert Application().start(["generate_docs", argument]) != 0
+        assert not generated
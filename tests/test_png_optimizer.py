@@ -0,0 +1,150 @@
+# Copyright (C) 2024 twyleg
+import importlib.util
+import shutil
+import struct
+import zlib
+from io import BytesIO
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.png_optimizer import OPTIMIZER_OXIPNG, OPTIMIZER_PILLOW, PNG_SIGNATURE, get_png_optimizer, optimize_png, optimize_pngs
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+# fmt: off
+OPTIMIZERS = [
+    pytest.param(OPTIMIZER_OXIPNG, marks=pytest.mark.skipif(shutil.which("oxipng") is None, reason="oxipng is not installed")),
+    pytest.param(OPTIMIZER_PILLOW, marks=pytest.mark.skipif(importlib.util.find_spec("PIL") is None, reason="Pillow is not installed")),
+]
+# fmt: on
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+def chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def create_rgba_png(width: int, height: int, pixels: bytes) -> bytes:
+    """
+    Deliberately wasteful encoder: RGBA without filters, stored instead of deflated, with an ancillary chunk.
+    """
+    image_data = b"".join(b"\x00" + pixels[y * width * 4 : (y + 1) * width * 4] for y in range(height))
+    # fmt: off
+    return b"".join([
+        PNG_SIGNATURE,
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)),
+        chunk(b"tEXt", b"Software\x00FreeCAD"),
+        chunk(b"IDAT", zlib.compress(image_data, 0)),
+        chunk(b"IEND", b"")
+    ])
+    # fmt: on
+
+
+def create_preview_pixels(width: int, height: int, colors: list[bytes]) -> bytes:
+    # White background with a "part" in the center
+    return b"".join(
+        colors[(x + y * width) % len(colors)] if width // 4 < x < width * 3 // 4 and height // 4 < y < height * 3 // 4 else b"\xff\xff\xff\xff"
+        for y in range(height)
+        for x in range(width)
+    )
+
+
+def read_rgba_pixels(data: bytes) -> bytes:
+    image_module = pytest.importorskip("PIL.Image")
+    with image_module.open(BytesIO(data)) as image:
+        return image.convert("RGBA").tobytes()
+
+
+class TestPngOptimizer:
+    def test_OxipngOnPath_GetPngOptimizer_OxipngPreferred(self, monkeypatch):
+        monkeypatch.setattr("construction_utils.png_optimizer.shutil.which", lambda name: f"/usr/bin/{name}")
+        assert get_png_optimizer() == OPTIMIZER_OXIPNG
+
+    def test_NeitherOxipngNorPillow_GetPngOptimizer_NoneReturned(self, monkeypatch):
+        monkeypatch.setattr("construction_utils.png_optimizer.shutil.which", lambda name: None)
+        monkeypatch.setattr("construction_utils.png_optimizer.Image", None)
+        assert get_png_optimizer() is None
+
+    @pytest.mark.parametrize("optimizer", OPTIMIZERS)
+    def test_BloatedPng_OptimizePng_SmallerAndPixelsUnchanged(self, tmp_path, optimizer):
+        pixels = create_preview_pixels(40, 30, [b"\x80\x80\x80\xff", b"\x20\x40\x60\xff", b"\x20\x40\x60\x80"])
+        original_data = create_rgba_png(40, 30, pixels)
+        (tmp_path / "preview.png").write_bytes(original_data)
+
+        original_size, optimized_size = optimize_png(tmp_path / "preview.png", optimizer)
+
+        optimized_data = (tmp_path / "preview.png").read_bytes()
+        assert (original_size, optimized_size) == (len(original_data), len(optimized_data))
+        assert optimized_size < original_size
+        assert [file_path.name for file_path in tmp_path.iterdir()] == ["preview.png"]
+        assert read_rgba_pixels(optimized_data) == pixels
+
+    @pytest.mark.parametrize("optimizer", OPTIMIZERS)
+    def test_PngWithFewColors_OptimizePng_ReducedToPaletteAndPixelsUnchanged(self, tmp_path, optimizer):
+        pixels = create_preview_pixels(40, 30, [b"\x80\x80\x80\xff", b"\x20\x40\x60\xff", b"\x20\x40\x60\x80", b"\x20\x40\x60\x00"])
+        (tmp_path / "preview.png").write_bytes(create_rgba_png(40, 30, pixels))
+
+        optimize_png(tmp_path / "preview.png", optimizer)
+
+        optimized_data = (tmp_path / "preview.png").read_bytes()
+        # IHDR color type 3 is indexed color
+        assert optimized_data[25] == 3
+        assert read_rgba_pixels(optimized_data) == pixels
+
+    @pytest.mark.parametrize("optimizer", OPTIMIZERS)
+    def test_PngWithMoreThan256Colors_OptimizePng_TruecolorKeptAndPixelsUnchanged(self, tmp_path, optimizer):
+        pixels = create_preview_pixels(80, 80, [bytes((index, index // 2, 0, 255)) for index in range(256)] + [b"\x00\x00\xff\xff"])
+        (tmp_path / "preview.png").write_bytes(create_rgba_png(80, 80, pixels))
+
+        optimize_png(tmp_path / "preview.png", optimizer)
+
+        optimized_data = (tmp_path / "preview.png").read_bytes()
+        assert optimized_data[25] != 3
+        assert read_rgba_pixels(optimized_data) == pixels
+
+    @pytest.mark.parametrize("optimizer", OPTIMIZERS)
+    def test_OptimizedPng_OptimizePngAgain_FileUnchanged(self, tmp_path, optimizer):
+        (tmp_path / "preview.png").write_bytes(create_rgba_png(20, 20, create_preview_pixels(20, 20, [b"\x20\x40\x60\xff"])))
+        optimize_png(tmp_path / "preview.png", optimizer)
+        optimized_data = (tmp_path / "preview.png").read_bytes()
+
+        assert optimize_png(tmp_path / "preview.png", optimizer) == (len(optimized_data), len(optimized_data))
+        assert (tmp_path / "preview.png").read_bytes() == optimized_data
+        assert [file_path.name for file_path in tmp_path.iterdir()] == ["preview.png"]
+
+    @pytest.mark.parametrize("optimizer", OPTIMIZERS)
+    def test_NoPngFile_OptimizePngs_FileUnchangedAndWarningLogged(self, caplog, tmp_path, optimizer):
+        (tmp_path / "preview.png").write_bytes(b"no png")
+
+        assert optimize_pngs([tmp_path / "preview.png"], optimizer) == (1, 0, 0)
+        assert (tmp_path / "preview.png").read_bytes() == b"no png"
+        assert "Unable to optimize" in caplog.text
+
+    @pytest.mark.parametrize("optimizer", OPTIMIZERS)
+    def test_MultiplePngs_OptimizePngsInThreadPool_SavedBytesReported(self, tmp_path, optimizer):
+        file_paths = []
+        for index in range(3):
+            (tmp_path / f"preview_{index}.png").write_bytes(create_rgba_png(20, 20, create_preview_pixels(20, 20, [bytes((index, 0, 0, 255))])))
+            file_paths.append(tmp_path / f"preview_{index}.png")
+        original_size = sum(file_path.stat().st_size for file_path in file_paths)
+
+        result = optimize_pngs(file_paths, optimizer, workers=2)
+
+        assert result.file_count == 3
+        assert result.original_size == original_size
+        assert result.optimized_size == sum(file_path.stat().st_size for file_path in file_paths)
+        assert result.saved_size > 0
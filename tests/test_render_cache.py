@@ -0,0 +1,91 @@
+# Copyright (C) 2024 twyleg
+import os
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.render_cache import RenderCache
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+RENDER_PARAMETERS = {"width": 1000, "height": 1000}
+FREECAD_VERSION = "FreeCAD 0.21.2"
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+@pytest.fixture
+def render_cache(tmp_path):
+    return RenderCache(RENDER_PARAMETERS, FREECAD_VERSION, tmp_path / "cache")
+
+
+class TestRenderCache:
+    def test_StoredOutputs_Restore_OutputsRestored(self, tmp_path, render_cache):
+        (tmp_path / "part.png").write_bytes(b"full")
+        (tmp_path / "part-200.png").write_bytes(b"200")
+        render_cache.store(render_cache.key("sha", "axo:full"), tmp_path / "part.png")
+        render_cache.store(render_cache.key("sha", "axo:200"), tmp_path / "part-200.png")
+
+        outputs = [(render_cache.key("sha", "axo:full"), tmp_path / "other/part.png"), (render_cache.key("sha", "axo:200"), tmp_path / "other/part-200.png")]
+        assert render_cache.restore(outputs)
+        assert (tmp_path / "other/part.png").read_bytes() == b"full"
+        assert (tmp_path / "other/part-200.png").read_bytes() == b"200"
+
+    def test_PartiallyStoredOutputs_Restore_NothingRestored(self, tmp_path, render_cache):
+        (tmp_path / "part.png").write_bytes(b"full")
+        render_cache.store(render_cache.key("sha", "axo:full"), tmp_path / "part.png")
+
+        outputs = [(render_cache.key("sha", "axo:full"), tmp_path / "other/part.png"), (render_cache.key("sha", "axo:200"), tmp_path / "other/part-200.png")]
+        assert not render_cache.restore(outputs)
+        assert not (tmp_path / "other/part.png").exists()
+
+    def test_StoredOutput_RestoreWithChangedFreecadVersion_NothingRestored(self, tmp_path, render_cache):
+        (tmp_path / "part.png").write_bytes(b"full")
+        render_cache.store(render_cache.key("sha", "axo:full"), tmp_path / "part.png")
+
+        changed_render_cache = RenderCache(RENDER_PARAMETERS, "FreeCAD 1.0.0", tmp_path / "cache")
+        assert not changed_render_cache.restore([(changed_render_cache.key("sha", "axo:full"), tmp_path / "other/part.png")])
+
+    def test_FreecadVersionAsCallable_CreateCacheAndLookUpKeys_VersionDeterminedOnceOnFirstLookup(self, tmp_path):
+        freecad_version_calls = []
+
+        def get_freecad_version():
+            freecad_version_calls.append(None)
+            return FREECAD_VERSION
+
+        render_cache = RenderCache(RENDER_PARAMETERS, get_freecad_version, tmp_path / "cache")
+        assert freecad_version_calls == []
+
+        key = render_cache.key("sha", "axo:full")
+        assert render_cache.key("sha", "axo:200") != key
+        assert len(freecad_version_calls) == 1
+        assert key == RenderCache(RENDER_PARAMETERS, FREECAD_VERSION, tmp_path / "cache").key("sha", "axo:full")
+
+    def test_CacheExceedingSizeCap_Evict_LeastRecentlyUsedEntriesRemoved(self, tmp_path):
+        render_cache = RenderCache(RENDER_PARAMETERS, FREECAD_VERSION, tmp_path / "cache", max_size=250)
+        (tmp_path / "part.png").write_bytes(b"x" * 100)
+        for index in range(3):
+            render_cache.store(render_cache.key("sha", f"variant_{index}"), tmp_path / "part.png")
+
+        # Mark variant_0 as the oldest entry, then access it so that variant_1 becomes least recently used
+        for index in range(3):
+            key = render_cache.key("sha", f"variant_{index}")
+            os.utime(render_cache.cache_dir_path / key[:2] / f"{key}.png", (index, index))
+        assert render_cache.restore([(render_cache.key("sha", "variant_0"), tmp_path / "restored.png")])
+
+        assert render_cache.evict() == 1
+        assert not render_cache.restore([(render_cache.key("sha", "variant_1"), tmp_path / "restored.png")])
+        assert render_cache.restore([(render_cache.key("sha", "variant_0"), tmp_path / "restored.png")])
+        assert render_cache.restore([(render_cache.key("sha", "variant_2"), tmp_path / "restored.png")])
@@ -0,0 +1,46 @@
+# Copyright (C) 2024 twyleg
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.render_history import RenderHistory
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+class TestRenderHistory:
+    def test_EmptyHistory_Estimate_LargerFilesEstimatedLonger(self, tmp_path):
+        (tmp_path / "small.FCStd").write_bytes(b"x" * 1024)
+        (tmp_path / "large.FCStd").write_bytes(b"x" * 4 * 1024 * 1024)
+        render_history = RenderHistory(tmp_path)
+        assert render_history.estimate(tmp_path / "large.FCStd") > render_history.estimate(tmp_path / "small.FCStd")
+
+    def test_RecordedDuration_SaveAndReload_RecordedDurationEstimated(self, tmp_path):
+        (tmp_path / "part.FCStd").write_bytes(b"x" * 1024)
+        render_history = RenderHistory(tmp_path)
+        render_history.record(tmp_path / "part.FCStd", 42.0)
+        render_history.save()
+
+        assert RenderHistory(tmp_path).estimate(tmp_path / "part.FCStd") == 42.0
+
+    def test_RecordedDurations_EstimateUnrecordedInput_RateOfRecordedInputsUsed(self, tmp_path):
+        (tmp_path / "recorded.FCStd").write_bytes(b"x" * 1024 * 1024)
+        (tmp_path / "new.FCStd").write_bytes(b"x" * 2 * 1024 * 1024)
+        render_history = RenderHistory(tmp_path)
+        render_history.record(tmp_path / "recorded.FCStd", RenderHistory.DEFAULT_BASE_DURATION + 10.0)
+        render_history.save()
+
+        assert RenderHistory(tmp_path).estimate(tmp_path / "new.FCStd") == pytest.approx(RenderHistory.DEFAULT_BASE_DURATION + 20.0)
@@ -0,0 +1,141 @@
+# Copyright (C) 2024 twyleg
+import hashlib
+import os
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.render_manifest import RenderManifest, compute_file_sha256
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+RENDER_PARAMETERS = {"width": 1000, "height": 1000}
+SCRIPT_VERSION = "script_version"
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    (tmp_path / "source").mkdir()
+    (tmp_path / "img").mkdir()
+    (tmp_path / "source/part.FCStd").write_bytes(b"part content")
+    (tmp_path / "img/part.png").write_bytes(b"png content")
+    return tmp_path
+
+
+class TestRenderManifest:
+    @staticmethod
+    def record(render_manifest: RenderManifest, input_file_path: Path, output_file_path: Path) -> str:
+        input_sha256 = render_manifest.compute_input_sha256(input_file_path)
+        fingerprint = render_manifest.fingerprint(input_sha256, SCRIPT_VERSION)
+        render_manifest.update(input_file_path, output_file_path, input_sha256, fingerprint)
+        return fingerprint
+
+    @staticmethod
+    def current_fingerprint(render_manifest: RenderManifest, input_file_path: Path) -> str:
+        input_sha256 = render_manifest.compute_input_sha256(input_file_path)
+        return render_manifest.fingerprint(input_sha256, SCRIPT_VERSION)
+
+    def test_LargeFile_ComputeSha256_MatchesHashlib(self, tmp_path):
+        content = os.urandom(3 * 1024 * 1024 + 17)
+        (tmp_path / "large.bin").write_bytes(content)
+        assert compute_file_sha256(tmp_path / "large.bin", chunk_size=1024 * 1024) == hashlib.sha256(content).hexdigest()
+
+    def test_EmptyManifest_CheckPreview_Dirty(self, workspace):
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        fingerprint = self.current_fingerprint(render_manifest, workspace / "source/part.FCStd")
+        assert render_manifest.is_dirty(workspace / "source/part.FCStd", workspace / "img/part.png", fingerprint)
+
+    def test_RecordedPreview_SaveAndReloadWithChangedMtime_NotDirty(self, workspace):
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        self.record(render_manifest, workspace / "source/part.FCStd", workspace / "img/part.png")
+        render_manifest.save()
+
+        os.utime(workspace / "source/part.FCStd", (0, 0))
+
+        reloaded_render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        fingerprint = self.current_fingerprint(reloaded_render_manifest, workspace / "source/part.FCStd")
+        assert not reloaded_render_manifest.is_dirty(workspace / "source/part.FCStd", workspace / "img/part.png", fingerprint)
+
+    def test_UnrenderedInput_ComputeAgainAfterSaveAndReload_FingerprintReusedUntilInputChanged(self, workspace, monkeypatch):
+        fingerprinted_file_paths = []
+
+        def compute_input_fingerprint(input_file_path):
+            fingerprinted_file_paths.append(input_file_path)
+            return compute_file_sha256(input_file_path)
+
+        monkeypatch.setattr("construction_utils.render_manifest.compute_input_fingerprint", compute_input_fingerprint)
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        input_sha256 = render_manifest.compute_input_sha256(workspace / "source/part.FCStd")
+        render_manifest.save()
+
+        reloaded_render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        assert reloaded_render_manifest.compute_input_sha256(workspace / "source/part.FCStd") == input_sha256
+        assert fingerprinted_file_paths == [workspace / "source/part.FCStd"]
+
+        (workspace / "source/part.FCStd").write_bytes(b"changed part content")
+        assert reloaded_render_manifest.compute_input_sha256(workspace / "source/part.FCStd") != input_sha256
+        assert len(fingerprinted_file_paths) == 2
+
+    def test_RecordedPreview_ChangeInputContent_Dirty(self, workspace):
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        self.record(render_manifest, workspace / "source/part.FCStd", workspace / "img/part.png")
+
+        (workspace / "source/part.FCStd").write_bytes(b"changed part content")
+
+        fingerprint = self.current_fingerprint(render_manifest, workspace / "source/part.FCStd")
+        assert render_manifest.is_dirty(workspace / "source/part.FCStd", workspace / "img/part.png", fingerprint)
+
+    def test_RecordedPreview_ChangeRenderParameters_Dirty(self, workspace):
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        self.record(render_manifest, workspace / "source/part.FCStd", workspace / "img/part.png")
+        render_manifest.save()
+
+        changed_render_manifest = RenderManifest(workspace, RENDER_PARAMETERS | {"width": 500})
+        fingerprint = self.current_fingerprint(changed_render_manifest, workspace / "source/part.FCStd")
+        assert changed_render_manifest.is_dirty(workspace / "source/part.FCStd", workspace / "img/part.png", fingerprint)
+
+    def test_RecordedPreview_DeleteOutput_Dirty(self, workspace):
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        fingerprint = self.record(render_manifest, workspace / "source/part.FCStd", workspace / "img/part.png")
+
+        (workspace / "img/part.png").unlink()
+
+        assert render_manifest.is_dirty(workspace / "source/part.FCStd", workspace / "img/part.png", fingerprint)
+
+    def test_RecordedExport_SaveAndReload_NotDirty(self, workspace):
+        (workspace / "3d").mkdir()
+        (workspace / "3d/part-Body.stl").write_bytes(b"stl content")
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        fingerprint = self.current_fingerprint(render_manifest, workspace / "source/part.FCStd")
+        assert render_manifest.is_export_dirty(workspace / "source/part.FCStd", fingerprint)
+
+        render_manifest.update_export(workspace / "source/part.FCStd", [workspace / "3d/part-Body.stl"], "sha", fingerprint)
+        render_manifest.save()
+
+        reloaded_render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        assert not reloaded_render_manifest.is_export_dirty(workspace / "source/part.FCStd", fingerprint)
+
+        (workspace / "3d/part-Body.stl").unlink()
+        assert reloaded_render_manifest.is_export_dirty(workspace / "source/part.FCStd", fingerprint)
+
+    def test_RecordedExport_UpdateWithRenamedBody_StaleExportReturned(self, workspace):
+        render_manifest = RenderManifest(workspace, RENDER_PARAMETERS)
+        render_manifest.update_export(workspace / "source/part.FCStd", [workspace / "3d/part-Body.stl", workspace / "3d/part-Lid.stl"], "sha", "fingerprint")
+
+        stale_file_paths = render_manifest.update_export(workspace / "source/part.FCStd", [workspace / "3d/part-Body.stl"], "sha", "fingerprint")
+
+        assert stale_file_paths == [workspace / "3d/part-Lid.stl"]
@@ -0,0 +1,60 @@
+# Copyright (C) 2024 twyleg
+import os
+import stat
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.runtime_dir import create_private_dir
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+class TestRuntimeDir:
+    def test_MissingDir_CreatePrivateDir_CreatedWithOwnerOnlyAccess(self, tmp_path):
+        create_private_dir(tmp_path / "runtime")
+        assert stat.S_IMODE((tmp_path / "runtime").stat().st_mode) == 0o700
+
+    def test_OwnDirReadableByOthers_CreatePrivateDir_AccessRestrictedToOwner(self, tmp_path):
+        (tmp_path / "runtime").mkdir(mode=0o755)
+        os.chmod(tmp_path / "runtime", 0o755)
+
+        create_private_dir(tmp_path / "runtime")
+
+        assert stat.S_IMODE((tmp_path / "runtime").stat().st_mode) == 0o700
+
+    def test_DirWritableByOthers_CreatePrivateDir_PermissionErrorRaised(self, tmp_path):
+        (tmp_path / "runtime").mkdir()
+        os.chmod(tmp_path / "runtime", 0o777)
+
+        with pytest.raises(PermissionError):
+            create_private_dir(tmp_path / "runtime")
+        assert stat.S_IMODE((tmp_path / "runtime").stat().st_mode) == 0o777
+
+    def test_SymlinkToPrivateDir_CreatePrivateDir_PermissionErrorRaised(self, tmp_path):
+        create_private_dir(tmp_path / "runtime")
+        (tmp_path / "link").symlink_to(tmp_path / "runtime")
+
+        with pytest.raises(PermissionError):
+            create_private_dir(tmp_path / "link")
+
+    def test_DirOfOtherUser_CreatePrivateDir_PermissionErrorRaised(self, tmp_path, monkeypatch):
+        create_private_dir(tmp_path / "runtime")
+        monkeypatch.setattr(os, "getuid", lambda: (tmp_path / "runtime").stat().st_uid + 1)
+
+        with pytest.raises(PermissionError):
+            create_private_dir(tmp_path / "runtime")
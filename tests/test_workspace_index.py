@@ -0,0 +1,138 @@
+# Copyright (C) 2024 twyleg
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.readme_generator import Workspace
+from construction_utils.workspace_index import WorkspaceIndex
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    workspace_template_filepath = FILE_DIR / "resources/workspaces/example_construction_workspace"
+    dst_workspace_filepath = tmp_path / "construction_workspace"
+    shutil.copytree(workspace_template_filepath, dst_workspace_filepath)
+    (dst_workspace_filepath / WorkspaceIndex.DEFAULT_INDEX_FILE_PATH).parent.mkdir()
+    age_workspace(dst_workspace_filepath)
+    return dst_workspace_filepath
+
+
+def age_workspace(workspace_dir_path: Path) -> None:
+    # Dirs modified within the last seconds are listed again on every run
+    mtime_ns = time.time_ns() - 10 * 1000 * 1000 * 1000
+    for dir_path, _, file_names in os.walk(workspace_dir_path):
+        for file_name in file_names:
+            os.utime(Path(dir_path) / file_name, ns=(mtime_ns, mtime_ns))
+        os.utime(dir_path, ns=(mtime_ns, mtime_ns))
+
+
+def scan_workspace(workspace_dir_path: Path) -> list:
+    workspace_index = WorkspaceIndex(workspace_dir_path)
+    # fmt: off
+    constructions = [
+        (construction.construction_relative_dir_path, construction.things_data, construction.filepaths_source, construction.filepaths_img,
+         construction.filepaths_3d, construction.filepaths_gcode)
+        for construction in Workspace(workspace_dir_path, workspace_index=workspace_index)
+    ]
+    # fmt: on
+    workspace_index.save()
+    return constructions
+
+
+class TestWorkspaceIndex:
+    def test_NoIndex_ScanWorkspace_SameConstructionsAsWithoutIndexAndIndexWritten(self, caplog, workspace):
+        constructions = scan_workspace(workspace)
+
+        # fmt: off
+        assert constructions == [
+            (construction.construction_relative_dir_path, construction.things_data, construction.filepaths_source, construction.filepaths_img,
+             construction.filepaths_3d, construction.filepaths_gcode)
+            for construction in Workspace(workspace)
+        ]
+        # fmt: on
+        assert (workspace / WorkspaceIndex.DEFAULT_INDEX_FILE_PATH).exists()
+
+    def test_IndexOfUnchangedWorkspace_ScanWorkspace_NoDirListedAndNoConstructionFileRead(self, caplog, workspace, monkeypatch):
+        constructions = scan_workspace(workspace)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Workspace read although unchanged")
+
+        monkeypatch.setattr(os, "scandir", fail)
+        monkeypatch.setattr(json, "load", fail)
+        assert scan_workspace(workspace) == constructions
+
+    def test_IndexOfChangedWorkspace_ScanWorkspace_ChangesListed(self, caplog, workspace):
+        scan_workspace(workspace)
+        (workspace / "construction_a/img/03-example_img.png").write_bytes(b"png")
+        (workspace / "construction_b/gcode/example_gcode.gcode").unlink()
+        construction_file_path = workspace / "construction_c/construction.json"
+        things_data = json.loads(construction_file_path.read_text())
+        things_data["name"] = "Construction C renamed"
+        construction_file_path.write_text(json.dumps(things_data))
+
+        constructions = {construction[0]: construction for construction in scan_workspace(workspace)}
+
+        assert constructions[Path("construction_a")][3][-1] == Path("img/03-example_img.png")
+        assert constructions[Path("construction_b")][5] == []
+        assert constructions[Path("construction_c")][1]["name"] == "Construction C renamed"
+
+    def test_IndexOfRemovedConstruction_ScanWorkspace_RowsOfRemovedDirsDropped(self, caplog, workspace):
+        scan_workspace(workspace)
+        shutil.rmtree(workspace / "construction_b")
+
+        constructions = scan_workspace(workspace)
+
+        assert [construction[0] for construction in constructions] == [Path("construction_a"), Path("construction_c")]
+        with closing(sqlite3.connect(workspace / WorkspaceIndex.DEFAULT_INDEX_FILE_PATH)) as connection:
+            # fmt: off
+            paths = [
+                *(path for path, in connection.execute("SELECT path FROM directories")),
+                *(directory for directory, in connection.execute("SELECT directory FROM files")),
+                *(path for path, in connection.execute("SELECT path FROM construction_files")),
+            ]
+            # fmt: on
+        assert any(path.startswith("construction_a") for path in paths)
+        assert not any(path.startswith("construction_b") for path in paths)
+
+    def test_IndexOfWorkspace_ListDir_FilesWithSizeAndMtime(self, caplog, workspace):
+        scan_workspace(workspace)
+
+        entries = {entry.name: entry for entry in WorkspaceIndex(workspace).list_dir(workspace / "construction_a")}
+
+        construction_file_content = (workspace / "construction_a/construction.json").read_bytes()
+        assert entries["construction.json"].size == len(construction_file_content)
+        assert entries["construction.json"].mtime_ns == (workspace / "construction_a/construction.json").stat().st_mtime_ns
+        assert entries["img"].is_dir
+
+    def test_CorruptIndex_ScanWorkspace_IndexRecreated(self, caplog, workspace):
+        index_file_path = workspace / WorkspaceIndex.DEFAULT_INDEX_FILE_PATH
+        index_file_path.write_bytes(b"no sqlite database")
+
+        constructions = scan_workspace(workspace)
+
+        assert len(constructions) == 3
+        assert "Unable to read workspace index" in caplog.text
+        assert scan_workspace(workspace) == constructions
@@ -0,0 +1,113 @@
+# Copyright (C) 2024 twyleg
+import json
+import os
+import signal
+import stat
+import time
+
+import pytest
+
+import logging
+from pathlib import Path
+
+from construction_utils.xvfb_manager import XvfbManager, XvfbStartupError
+
+#
+# General naming convention for unit tests:
+#               test_INITIALSTATE_ACTION_EXPECTATION
+#
+
+
+FILE_DIR = Path(__file__).parent
+
+
+FAKE_XVFB_SCRIPT = """#!/usr/bin/env python3
+import json, os, sys, time
+
+args = sys.argv[1:]
+with open(os.environ["FAKE_XVFB_ARGS_FILE"], "w") as args_file:
+    json.dump(args, args_file)
+os.write(int(args[args.index("-displayfd") + 1]), b"4242\\n")
+time.sleep(60)
+"""
+
+
+@pytest.fixture(autouse=True)
+def print_tmp_path(tmp_path):
+    logging.info("tmp_path: %s", tmp_path)
+    return None
+
+
+@pytest.fixture
+def fake_xvfb(tmp_path, monkeypatch):
+    # Records its arguments and reports display :4242
+    (tmp_path / "bin").mkdir()
+    (tmp_path / "bin/Xvfb").write_text(FAKE_XVFB_SCRIPT)
+    (tmp_path / "bin/Xvfb").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path / 'bin'}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_XVFB_ARGS_FILE", str(tmp_path / "xvfb_args.json"))
+    return tmp_path / "xvfb_args.json"
+
+
+class TestXvfbManager:
+    def test_Display_GetEnvironment_SoftwareGlConfigured(self, tmp_path):
+        xvfb_manager = XvfbManager(render_threads=4, state_dir_path=tmp_path)
+        environment = xvfb_manager.get_environment(":99")
+        assert environment["DISPLAY"] == ":99"
+        assert environment["LIBGL_ALWAYS_SOFTWARE"] == "1"
+        assert environment["GALLIUM_DRIVER"] == "llvmpipe"
+        assert environment["LP_NUM_THREADS"] == "4"
+
+    def test_StateWithDeadServerAndNoXvfb_Start_StartupErrorRaisedAndStateCleared(self, tmp_path, monkeypatch):
+        (tmp_path / XvfbManager.STATE_FILE_NAME).write_text(json.dumps([{"display": ":12345", "pid": 2**22 + 1}]))
+        monkeypatch.setenv("PATH", str(tmp_path))
+
+        xvfb_manager = XvfbManager(state_dir_path=tmp_path)
+        with pytest.raises(XvfbStartupError):
+            xvfb_manager.start()
+
+        assert json.loads((tmp_path / XvfbManager.STATE_FILE_NAME).read_text()) == []
+
+    def test_NoRunningServer_Start_XvfbStartedWithCookieOnlyFreecadKnows(self, tmp_path, fake_xvfb):
+        xvfb_manager = XvfbManager(state_dir_path=tmp_path / "xvfb")
+        try:
+            assert xvfb_manager.start() == [":4242"]
+        finally:
+            for server in json.loads((tmp_path / "xvfb" / XvfbManager.STATE_FILE_NAME).read_text()):
+                os.kill(server["pid"], signal.SIGKILL)
+
+        xauthority_file_path = tmp_path / "xvfb" / XvfbManager.XAUTHORITY_FILE_NAME
+        xvfb_args = json.loads(fake_xvfb.read_text())
+        assert xvfb_args[xvfb_args.index("-auth") + 1] == str(xauthority_file_path)
+        assert xvfb_manager.get_environment(":4242")["XAUTHORITY"] == str(xauthority_file_path)
+        # Wildcard entry with a 16 byte MIT-MAGIC-COOKIE-1, readable by the owner only
+        xauthority = xauthority_file_path.read_bytes()
+        assert xauthority.startswith(b"\xff\xff\x00\x00\x00\x00\x00\x12MIT-MAGIC-COOKIE-1\x00\x10")
+        assert len(xauthority) == 44
+        assert stat.S_IMODE(xauthority_file_path.stat().st_mode) == 0o600
+        assert stat.S_IMODE((tmp_path / "xvfb").stat().st_mode) == 0o700
+
+    def test_XauthorityOfEarlierRun_Start_CookieKept(self, tmp_path, fake_xvfb):
+        XvfbManager(state_dir_path=tmp_path / "xvfb")
+        (tmp_path / "xvfb").mkdir(mode=0o700)
+        (tmp_path / "xvfb" / XvfbManager.XAUTHORITY_FILE_NAME).write_bytes(b"cookie of running servers")
+        os.chmod(tmp_path / "xvfb" / XvfbManager.XAUTHORITY_FILE_NAME, 0o600)
+
+        xvfb_manager = XvfbManager(state_dir_path=tmp_path / "xvfb")
+        try:
+            xvfb_manager.start()
+        finally:
+            for server in json.loads((tmp_path / "xvfb" / XvfbManager.STATE_FILE_NAME).read_text()):
+                os.kill(server["pid"], signal.SIGKILL)
+
+        assert (tmp_path / "xvfb" / XvfbManager.XAUTHORITY_FILE_NAME).read_bytes() == b"cookie of running servers"
+
+    def test_StateDirWritableByOthers_Start_StartupErrorRaisedAndPlantedStateIgnored(self, tmp_path, fake_xvfb):
+        (tmp_path / "xvfb").mkdir()
+        os.chmod(tmp_path / "xvfb", 0o777)
+        (tmp_path / "xvfb" / XvfbManager.STATE_FILE_NAME).write_text(json.dumps([{"display": ":0", "pid": os.getpid()}]))
+
+        with pytest.raises(XvfbStartupError, match="Unusable Xvfb state dir"):
+            XvfbManager(state_dir_path=tmp_path / "xvfb").start()
+        time.sleep(0.1)
+        assert not fake_xvfb.exists()